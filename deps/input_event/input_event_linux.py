@@ -1,17 +1,29 @@
+import base64
 import json
 import os
 import select
 import struct
 import sys
 import threading
+import time
 
 TYPE_SYNC = "SYNC"
 TYPE_INFO = "INFO"
+TYPE_CODES = "CODES"
 TYPE_READY = "READY"
 TYPE_EVENT = "EVENT"
 TYPE_ERROR = "ERROR"
 EMPTY_CONTENT = {}
 
+# With --batch the events are not sent as JSON lines, but as the raw
+# records read from the device, grouped per SYN_REPORT, every group is
+# a frame of a header and the records, the frames read together are sent
+# base64 encoded as one "FRAMES <device> <data>" line.
+BATCH = "--batch" in sys.argv[1:]
+FRAMES_PREFIX = "FRAMES"
+# size of a record, time of sending, number of records
+FRAME_HDR_FMT = "=BdH"
+
 
 def send_message(mtype, content):
     message = {"type": mtype, "content": content}
@@ -40,8 +52,28 @@ def error_notify(error, dev=None):
     send_message(TYPE_ERROR, {"device": dev, "message": error})
 
 
+def codes_notify():
+    send_message(TYPE_CODES, EV_CODE_MAP)
+
+
+def frames_notify(dev, records):
+    """Send the lists of the records of the frames as one line"""
+    now = time.time()
+    data = b"".join(
+        struct.pack(FRAME_HDR_FMT, EV_PACK_SIZE, now, len(frame)) + b"".join(frame)
+        for frame in records
+    )
+    sys.stdout.write(
+        "%s %s %s" % (FRAMES_PREFIX, dev, base64.b64encode(data).decode("ascii"))
+    )
+    sys.stdout.write(os.linesep)
+    sys.stdout.flush()
+
+
 EV_PACK_FMT = "llHHI"
 EV_PACK_SIZE = struct.calcsize(EV_PACK_FMT)
+# records read from a device at once
+EV_READ_COUNT = 64
 
 EV_TYPES = {
     0x00: "EV_SYN",
@@ -818,21 +850,42 @@ def format_event(raw_event):
     return event
 
 
+def is_syn_report(record):
+    ev_type, ev_code = struct.unpack_from("HH", record, EV_PACK_SIZE - 8)
+    return ev_type == 0x00 and ev_code == 0
+
+
 def listen(devs):
     watch = list(devs.keys())
+    # records of the frames not completed yet, by device
+    pending = dict((fd, []) for fd in watch)
     while True:
         fds = select.select(watch, (), ())[0]
         for fd in fds:
             dev = devs[fd][0]
             try:
-                data = os.read(fd, EV_PACK_SIZE)
-                raw_event = struct.unpack(EV_PACK_FMT, data)
+                data = os.read(fd, EV_PACK_SIZE * EV_READ_COUNT)
             except Exception as details:
                 msg = "failed to get event: %s" % str(details)
                 error_notify(msg, dev)
                 watch.remove(fd)
-            event = format_event(raw_event)
-            event_notify(dev, event)
+                continue
+            records = [
+                data[i : i + EV_PACK_SIZE] for i in range(0, len(data), EV_PACK_SIZE)
+            ]
+            if not BATCH:
+                for record in records:
+                    raw_event = struct.unpack(EV_PACK_FMT, record)
+                    event_notify(dev, format_event(raw_event))
+                continue
+            frames = []
+            for record in records:
+                pending[fd].append(record)
+                if is_syn_report(record):
+                    frames.append(pending[fd])
+                    pending[fd] = []
+            if frames:
+                frames_notify(dev, frames)
         if not watch:
             break
 
@@ -859,6 +912,8 @@ def main_loop():
     global READY
 
     sync_notify()
+    if BATCH:
+        codes_notify()
     devs = setup()
     try:
         listen(devs)
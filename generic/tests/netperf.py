@@ -15,7 +15,14 @@ from virttest import (
     virt_vm,
 )
 
-from provider import netperf_base, vdpa_utils, win_driver_utils
+from provider import (
+    netperf_async,
+    netperf_base,
+    netperf_results,
+    perf_results_db,
+    vdpa_utils,
+    win_driver_utils,
+)
 
 LOG_JOB = logging.getLogger("avocado.test")
 
@@ -359,6 +366,67 @@ def run(test, params, env):
 
     env.stop_ip_sniffing()
 
+    orchestrator = None
+    if params.get("netperf_orchestration") == "asyncio":
+        if params.get("os_type_client") != "linux":
+            test.cancel("asyncio orchestration supports only linux clients")
+        client_specs = []
+        if clients[0] == "localhost":
+            client_specs.append({"name": "localhost"})
+        elif client_pub_ip:
+            client_specs.append(
+                {
+                    "name": client_pub_ip,
+                    "address": client_pub_ip,
+                    "port": params.get("shell_port_client", 22),
+                    "username": params.get("username_client"),
+                    "password": params.get("password_client"),
+                }
+            )
+        else:
+            params_client = params.object_params(params.get("client"))
+            client_specs.append(
+                {
+                    "name": params.get("client"),
+                    "address": client_ip,
+                    "port": params_client.get("shell_port", 22),
+                    "username": params_client.get("username"),
+                    "password": params_client.get("password"),
+                }
+            )
+        # more guests to spread the sessions over, netperf is set up there
+        for name in params.objects("netperf_async_client_vms"):
+            params_client = params.object_params(name)
+            vm_client = env.get_vm(name)
+            vm_client.verify_alive()
+            session_client = vm_client.wait_for_login(timeout=login_timeout)
+            address = vm_client.get_address()
+            netperf_base.env_setup(
+                test,
+                params,
+                session_client,
+                address,
+                params_client["username"],
+                int(params_client["shell_port"]),
+                params_client["password"],
+            )
+            session_client.close()
+            client_specs.append(
+                {
+                    "name": name,
+                    "address": address,
+                    "port": params_client["shell_port"],
+                    "username": params_client["username"],
+                    "password": params_client["password"],
+                }
+            )
+        orchestrator = netperf_async.NetperfOrchestrator(
+            client_specs,
+            host=host,
+            host_intr_pattern=params.get("netperf_host_intr_pattern"),
+        )
+        orchestrator.open(timeout=login_timeout)
+
     try:
         error_context.context("Start netperf testing", test.log.info)
         start_test(
@@ -377,6 +445,7 @@ def run(test, params, env):
             params=params,
             server_cyg=server_cyg,
             test=test,
+            orchestrator=orchestrator,
         )
 
         if params.get("log_hostinfo_script"):
@@ -397,6 +466,8 @@ def run(test, params, env):
             logfile.write(output)
             logfile.close()
     finally:
+        if orchestrator:
+            orchestrator.close()
         if mtu != 1500:
             mtu_default = 1500
             error_context.context(
@@ -429,6 +500,7 @@ def start_test(
     params=None,
     server_cyg=None,
     test=None,
+    orchestrator=None,
 ):
     """
     Start to test with different kind of configurations
@@ -447,12 +519,20 @@ def start_test(
     :param netserver_port: netserver listen port
     :param params: Dictionary with the test parameters.
     :param server_cyg: shell session for cygwin in windows guest
+    :param orchestrator: NetperfOrchestrator object to run the clients by
+                         an event loop, the threaded clients if None
     """
     if params is None:
         params = {}
 
-    fd = open("%s/netperf-result.%s.RHS" % (resultsdir, time.time()), "w")
-    netperf_base.record_env_version(test, params, host, server_ctl, fd, test_duration)
+    stamp = time.time()
+    fd = open("%s/netperf-result.%s.RHS" % (resultsdir, stamp), "w")
+    jsonl = "%s/netperf-result.%s.jsonl" % (resultsdir, stamp)
+    versions = netperf_base.record_env_version(
+        test, params, host, server_ctl, fd, test_duration
+    )
+    perf_results = {}
+    results = netperf_results.NetperfResults()
 
     record_list = [
         "size",
@@ -468,6 +548,7 @@ def start_test(
         "re_pkts",
         "exits",
         "tpkt_per_exit",
+        "host_intr",
     ]
 
     for i in range(int(params.get("queues", 0))):
@@ -476,6 +557,7 @@ def start_test(
     for i in range(int(params.get("queues", 0))):
         record_list.append("tx_intr_%s" % i)
     record_list.append("tx_intr_sum")
+    record_list.extend(["guest_CPU", "exits_per_pkt", "intr_per_pkt"])
     base = params.get("format_base", "12")
     fbase = params.get("format_fbase", "2")
 
@@ -504,6 +586,8 @@ def start_test(
         fd.write("Category:" + protocol_log + "\n")
 
         record_header = True
+        # the columns of the header, kept for all the rows of the category
+        columns = None
         for i in sizes_test:
             for j in sessions_test:
                 if protocol in ("TCP_RR", "TCP_CRR"):
@@ -525,26 +609,29 @@ def start_test(
                     params,
                     server_cyg,
                     test,
+                    orchestrator,
                 )
                 if ret:
-                    thu = float(ret["thu"])
-                    cpu = 100 - float(ret["mpstat"].split()[mpstat_index])
-                    normal = thu / cpu
-                    if ret.get("tx_pkt") and ret.get("exits"):
-                        ret["tpkt_per_exit"] = float(ret["tx_pkts"]) / float(
-                            ret["exits"]
-                        )
-
-                    ret["size"] = int(i)
-                    ret["sessions"] = int(j)
-                    if protocol in ("TCP_RR", "TCP_CRR"):
-                        ret["trans.rate"] = thu
-                    else:
-                        ret["throughput"] = thu
-                    ret["CPU"] = cpu
-                    ret["thr_per_CPU"] = normal
+                    result = netperf_results.NetperfResult.from_ret(
+                        protocol, i, j, ret, mpstat_index
+                    )
+                    results.add(result)
+                    results.write_jsonl(jsonl, [result])
+                    values = result.values()
+                    if columns is None:
+                        columns = [key for key in record_list if key in values]
+                    # the values not available are shown as NA to keep the
+                    # cells under their column names
+                    row_values = dict(
+                        (key, "NA" if values.get(key) is None else values[key])
+                        for key in columns
+                    )
                     row, key_list = netperf_base.netperf_record(
-                        ret, record_list, header=record_header, base=base, fbase=fbase
+                        row_values,
+                        columns,
+                        header=record_header,
+                        base=base,
+                        fbase=fbase,
                     )
                     category = ""
                     if record_header:
@@ -552,9 +639,15 @@ def start_test(
                         category = row.split("\n")[0]
 
                     test.write_test_keyval({"category": category})
-                    prefix = "%s--%s--%s" % (protocol, i, j)
+                    prefix = result.case
+                    key_list = [key for key in key_list if values.get(key) is not None]
                     for key in key_list:
-                        test.write_test_keyval({"%s--%s" % (prefix, key): ret[key]})
+                        test.write_test_keyval({"%s--%s" % (prefix, key): values[key]})
+                    perf_results[prefix] = {
+                        key: values[key]
+                        for key in key_list
+                        if key not in ("size", "sessions")
+                    }
 
                     test.log.info(row)
                     fd.write(row + "\n")
@@ -577,6 +670,12 @@ def start_test(
                     )
                     continue
     fd.close()
+    if params.get("netperf_baseline_jsonl"):
+        baseline = netperf_results.load_jsonl(params["netperf_baseline_jsonl"])
+        results.log_comparison(
+            baseline, metrics=("throughput", "trans.rate", "thr_per_CPU")
+        )
+    perf_results_db.record_results(test, params, perf_results, **versions)
 
 
 @error_context.context_aware
@@ -592,6 +691,7 @@ def launch_client(
     params,
     server_cyg,
     test,
+    orchestrator=None,
 ):
     """Launch netperf clients"""
 
@@ -697,6 +797,9 @@ def launch_client(
                 12
             ]
         )
+        # jiffies of user, nice, system, idle, iowait, irq, softirq and steal
+        stat = netperf_base.ssh_cmd(server_ctl, "head -1 /proc/stat").split()
+        jiffies = [int(n) for n in stat[1:9]]
         state_list = [
             "rx_pkts",
             nrx,
@@ -708,25 +811,29 @@ def launch_client(
             ntxb,
             "re_pkts",
             nre,
+            "guest_busy",
+            sum(jiffies) - jiffies[3] - jiffies[4],
+            "guest_total",
+            sum(jiffies),
         ]
         try:
             nrx_intr = count_interrupt("virtio.-input")
             ntx_intr = count_interrupt("virtio.-output")
-            sum = 0
+            intr_sum = 0
             for i in range(len(nrx_intr)):
                 state_list.append("rx_intr_%s" % i)
                 state_list.append(nrx_intr[i])
-                sum += nrx_intr[i]
+                intr_sum += nrx_intr[i]
             state_list.append("rx_intr_sum")
-            state_list.append(sum)
+            state_list.append(intr_sum)
 
-            sum = 0
+            intr_sum = 0
             for i in range(len(ntx_intr)):
                 state_list.append("tx_intr_%s" % i)
                 state_list.append(ntx_intr[i])
-                sum += ntx_intr[i]
+                intr_sum += ntx_intr[i]
             state_list.append("tx_intr_sum")
-            state_list.append(sum)
+            state_list.append(intr_sum)
 
         except IndexError:
             ninit = count_interrupt("virtio.")
@@ -803,6 +910,19 @@ def launch_client(
         test.log.debug("niteration: %s", niteration)
         return result
 
+    if orchestrator is not None:
+        return launch_client_async(
+            orchestrator,
+            sessions,
+            server,
+            l,
+            nf_args,
+            client_path,
+            get_state if get_status_flag else None,
+            params,
+            test,
+        )
+
     tries = int(params.get("tries", 1))
     while tries > 0:
         error_context.context("Start netperf client threads", test.log.info)
@@ -873,3 +993,60 @@ def launch_client(
             stop_netperf_clients()
             tries = tries - 1
             test.log.debug("left %s times", tries)
+
+
+def launch_client_async(
+    orchestrator, sessions, server, l, nf_args, client_path, get_state, params, test
+):
+    """
+    Launch netperf clients by the event loop of the orchestrator
+
+    :param orchestrator: NetperfOrchestrator object
+    :param get_state: callable of the guest counters, None to skip them
+    :return: dict of the results, None if not all the clients started
+    """
+    cmd = "%s -D 1 -H %s -l %s %s" % (client_path, server, int(l) * 1.5, nf_args)
+    if params.get("netperf_with_numa", "yes") == "yes":
+        n = abs(int(params.get("numa_node"))) - 1
+        cmd = "numactl --cpunodebind=%s --membind=%s %s" % (n, n, cmd)
+
+    tries = int(params.get("tries", 1))
+    while tries > 0:
+        error_context.context("Start netperf client sessions", test.log.info)
+        pid = str(os.getpid())
+        fname = "/tmp/netperf.%s.nf" % pid
+        with open(fname, "w") as log:
+            result = orchestrator.run(
+                cmd,
+                int(sessions),
+                int(l) - 1,
+                int(l) * 0.5,
+                kill_cmd=params.get("client_kill_linux"),
+                state=get_state,
+                log=log,
+            )
+        if result:
+            test.log.debug(
+                "All netperf clients started in %.2fs", result["start_spread"]
+            )
+            ret = {
+                "pid": pid,
+                "thu": result["thu"],
+                "mpstat": result["mpstat"],
+                "host_intr": result["host_intr"],
+            }
+            start_state, end_state = result["start_state"], result["end_state"]
+            if start_state is not None:
+                if len(start_state) != len(end_state):
+                    msg = "Initial state not match end state:\n"
+                    msg += "  start state: %s\n" % start_state
+                    msg += "  end state: %s\n" % end_state
+                    test.log.warning(msg)
+                else:
+                    for i in range(len(end_state) // 2):
+                        ret[end_state[i * 2]] = (
+                            end_state[i * 2 + 1] - start_state[i * 2 + 1]
+                        )
+            return ret
+        tries = tries - 1
+        test.log.debug("left %s times", tries)
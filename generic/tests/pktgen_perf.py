@@ -5,7 +5,7 @@ import time
 from avocado.utils import process
 from virttest import env_process, error_context, utils_misc, utils_test
 
-from provider import pktgen_utils
+from provider import perf_results_db, pktgen_utils
 from provider.vdpa_sim_utils import (
     VhostVdpaNetSimulatorTest,
     VirtioVdpaNetSimulatorTest,
@@ -69,6 +69,7 @@ def run(test, params, env):
         _pin_vm_threads(params.get("numa_node"))
         guest_ver = session_serial.cmd_output(guest_ver_cmd)
         result_file.write("### guest-kernel-ver :%s" % guest_ver)
+        versions["guest_ver"] = guest_ver
 
         if pktgen_runner.is_version_lt_rhel7(session_serial.cmd("uname -r")):
             if guest_ver.count("64k"):
@@ -99,6 +100,7 @@ def run(test, params, env):
     host_ver = os.uname()[2]
     result_file.write("### kvm-userspace-ver : %s\n" % kvm_ver)
     result_file.write("### kvm_version : %s\n" % host_ver)
+    versions = {"host_ver": host_ver, "qemu_ver": kvm_ver}
 
     if disable_iptables_rules_cmd:
         error_context.context("disable iptables rules on host")
@@ -113,6 +115,7 @@ def run(test, params, env):
 
     vdpa_net_test = None
     vm = None
+    perf_results = {}
     try:
         if vdpa_test and not test_vm:
             vdpa_net_test = VirtioVdpaNetSimulatorTest()
@@ -120,7 +123,7 @@ def run(test, params, env):
             interface = vdpa_net_test.add_dev(params.get("netdst"), params.get("mac"))
             LOG_JOB.info("The virtio_vdpa device name is: '%s'", interface)
             LOG_JOB.info("Test virtio_vdpa with the simulator on the host")
-            pktgen_utils.run_tests_for_category(
+            perf_results = pktgen_utils.run_tests_for_category(
                 params, result_file, interface=interface
             )
         elif vdpa_test and test_vm:
@@ -135,7 +138,7 @@ def run(test, params, env):
             vm, session_serial = init_vm_and_login(
                 test, params, env, result_file, pktgen_runner
             )
-            pktgen_utils.run_tests_for_category(
+            perf_results = pktgen_utils.run_tests_for_category(
                 params, result_file, test_vm, vm, session_serial
             )
         elif not vdpa_test:
@@ -143,13 +146,14 @@ def run(test, params, env):
                 test, params, env, result_file, pktgen_runner
             )
             if vp_vdpa:
-                pktgen_utils.run_tests_for_category(
+                perf_results = pktgen_utils.run_tests_for_category(
                     params, result_file, test_vm, vm, session_serial, vp_vdpa
                 )
             else:
-                pktgen_utils.run_tests_for_category(
+                perf_results = pktgen_utils.run_tests_for_category(
                     params, result_file, test_vm, vm, session_serial
                 )
+        perf_results_db.record_results(test, params, perf_results, **versions)
     finally:
         if test_vm:
             vm.verify_kernel_crash()
@@ -1,9 +1,13 @@
 import json
+import logging
 import math
+import os
 import random
 import re
+import time
 
 from avocado import fail_on
+from avocado.core import exceptions
 from avocado.utils import process
 from virttest import (
     data_dir,
@@ -19,6 +23,8 @@ from provider import block_dirty_bitmap as block_bitmap
 from provider import job_utils
 from provider.virt_storage.storage_admin import sp_admin
 
+LOG_JOB = logging.getLogger("avocado.test")
+
 BACKING_MASK_PROTOCOL_VERSION_SCOPE = "[9.0.0, )"
 
 
@@ -151,6 +157,151 @@ def verify_file_md5(vm, root_dir, filename, timeout=720):
         session.close()
 
 
+# checksum tool: suffix of the file saving the checksum
+CHECKSUM_SUFFIXES = {
+    "xxh128sum": "xxh128",
+    "xxhsum": "xxh",
+    "sha256sum": "sha256",
+    "md5sum": "md5",
+}
+
+
+def _get_checksum_tool(vm, session):
+    """
+    Get the checksum tool set by 'tempfile_checksum', 'auto' means the
+    first available one of 'tempfile_checksum_tools' in the guest
+    """
+    tool = vm.params.get("tempfile_checksum", "md5sum")
+    if tool != "auto":
+        return tool
+    tools = vm.params.get("tempfile_checksum_tools", "xxh128sum xxhsum sha256sum")
+    output = session.cmd_output("command -v %s" % tools)
+    found = [os.path.basename(line.strip()) for line in output.splitlines()]
+    for tool in tools.split():
+        if tool in found:
+            return tool
+    return "md5sum"
+
+
+def _run_guest_jobs(session, jobs, timeout):
+    """
+    Run shell commands as background jobs in one guest session
+
+    :param jobs: dict of {key: shell command}
+    :return: dict of {key: exit status}
+    """
+    keys = list(jobs)
+    cmd = " ".join(
+        '{ (%s) >/dev/null 2>&1; echo "JOB_RET_%d=$?"; } &' % (jobs[key], idx)
+        for idx, key in enumerate(keys)
+    )
+    output = session.cmd_output("%s wait" % cmd, timeout=timeout)
+    status = dict.fromkeys(keys)
+    for idx, ret in re.findall(r"JOB_RET_(\d+)=(\d+)", output):
+        status[keys[int(idx)]] = int(ret)
+    return status
+
+
+def generate_tempfiles(vm, files, timeout=720, session=None):
+    """
+    Generate temp data files and save their checksums in VM, the files
+    are generated concurrently in one guest session on Linux
+
+    :param vm: VM object
+    :param files: list of (root_dir, filename, size)
+    :param timeout: timeout for generating all files
+    :param session: guest session to be used, login once if None
+    """
+    own_session = session is None
+    if own_session:
+        session = vm.wait_for_login()
+    try:
+        if vm.params["os_type"] == "windows":
+            for root_dir, filename, size in files:
+                file_path = "%s\\%s" % (root_dir, filename)
+                session.cmd(
+                    "fsutil file createnew %s %s" % (file_path, size), timeout=timeout
+                )
+                session.cmd(
+                    "certutil -hashfile %s MD5 > %s.md5" % (file_path, file_path),
+                    timeout=timeout,
+                )
+            return
+
+        tool = _get_checksum_tool(vm, session)
+        suffix = CHECKSUM_SUFFIXES.get(tool, tool)
+        dd_cmd = vm.params.get(
+            "dd_cmd", "dd if=/dev/urandom of=%s bs=1M count=%s oflag=direct"
+        )
+        jobs = dict()
+        for root_dir, filename, size in files:
+            file_path = "%s/%s" % (root_dir, filename)
+            count = int(
+                utils_numeric.normalize_data_size(
+                    size, order_magnitude="M", factor=1024
+                )
+            )
+            jobs[file_path] = "%s && %s %s > %s.%s" % (
+                dd_cmd % (file_path, count),
+                tool,
+                file_path,
+                file_path,
+                suffix,
+            )
+        status = _run_guest_jobs(session, jobs, timeout)
+        session.cmd("sync", timeout=timeout)
+        failed = [f for f, ret in status.items() if ret != 0]
+        if failed:
+            raise exceptions.TestError("Failed to generate files: %s" % failed)
+    finally:
+        if own_session:
+            session.close()
+
+
+def verify_tempfiles(vm, files, timeout=720, session=None):
+    """
+    Verify the checksums of temp data files in VM, the files are hashed
+    concurrently in one guest session on Linux
+
+    :param vm: VM object
+    :param files: list of (root_dir, filename)
+    :param timeout: timeout for verifying all files
+    :param session: guest session to be used, login once if None
+    :return: dict of {file path: True if checksum matched}
+    """
+    own_session = session is None
+    if own_session:
+        session = vm.wait_for_login()
+    try:
+        if vm.params["os_type"] == "windows":
+            results = dict()
+            for root_dir, filename in files:
+                file_path = "%s\\%s" % (root_dir, filename)
+                now = session.cmd_output(
+                    "certutil -hashfile %s MD5" % file_path, timeout=timeout
+                )
+                saved = session.cmd_output("type %s.md5" % file_path, timeout=timeout)
+                results[file_path] = now.strip() == saved.strip()
+            return results
+
+        tool = _get_checksum_tool(vm, session)
+        suffix = CHECKSUM_SUFFIXES.get(tool, tool)
+        jobs = dict()
+        for root_dir, filename in files:
+            file_path = "%s/%s" % (root_dir, filename)
+            jobs[file_path] = '[ "$(%s %s)" = "$(cat %s.%s)" ]' % (
+                tool,
+                file_path,
+                file_path,
+                suffix,
+            )
+        status = _run_guest_jobs(session, jobs, timeout)
+        return {f: ret == 0 for f, ret in status.items()}
+    finally:
+        if own_session:
+            session.close()
+
+
 def blockdev_snapshot_qmp_cmd(source, target, **extra_options):
     options = ["node", "overlay"]
     arguments = copy_out_dict_if_exists(extra_options, options)
@@ -347,9 +498,7 @@ def blockdev_batch_snapshot(vm, source_lst, target_lst, **extra_options):
         actions.append({"type": snapshot_cmd, "data": arguments})
     arguments = {"actions": actions}
     vm.monitor.cmd("transaction", arguments)
-    list(
-        map(lambda x: job_utils.wait_until_block_job_completed(vm, x, timeout), jobs_id)
-    )
+    job_utils.wait_until_block_jobs_completed(vm, jobs_id, timeout)
 
 
 @fail_on
@@ -405,12 +554,7 @@ def blockdev_batch_backup(vm, source_lst, target_lst, bitmap_lst, **extra_option
     vm.monitor.cmd("transaction", arguments)
 
     if wait_job_complete:
-        list(
-            map(
-                lambda x: job_utils.wait_until_block_job_completed(vm, x, timeout),
-                jobs_id,
-            )
-        )
+        job_utils.wait_until_block_jobs_completed(vm, jobs_id, timeout)
 
 
 @fail_on
@@ -489,20 +633,74 @@ def format_storage_volume(img, filesystem, partition="mbr"):
         process.system("setenforce %s" % selinux_mode, shell=True)
 
 
+def _coalesce_extents(extents, max_len):
+    """
+    Merge adjacent extents and split the merged ones at max_len
+
+    :param extents: list of (start, length), sorted by start
+    :param max_len: max length qemu-io can read at a time
+    :return: list of (start, length)
+    """
+    merged = []
+    for start, length in extents:
+        if length <= 0:
+            continue
+        if merged and merged[-1][0] + merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], merged[-1][1] + length)
+        else:
+            merged.append((start, length))
+
+    ranges = []
+    for start, length in merged:
+        while length > max_len:
+            ranges.append((start, max_len))
+            start, length = start + max_len, length - max_len
+        ranges.append((start, length))
+    return ranges
+
+
+def _qemu_io_time_to_seconds(timestr):
+    """Convert qemu-io time string, e.g. '0.0123' or '00:01:02.50'"""
+    seconds = 0.0
+    for part in timestr.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
 def copyif(params, nbd_image, target_image, bitmap=None):
     """
     Python implementation of copyif3.sh
+
+    All the reads are done by a few qemu-io processes, each of which runs
+    a batch of 'qemu_io_batch_size' read commands, adjacent extents are
+    merged into one read. With 'qemu_io_inflight' > 1, disjoint ranges are
+    read by up to that number of in-flight aio_read requests in qemu-io.
+
     :params params: utils_params.Params object
     :params nbd_image: nbd image tag
     :params target_image: target image tag
     :params bitmap: bitmap name
+    :return: dict of statistics, e.g. the number of extents and
+             qemu-io invocations, bytes copied and per-extent time
     """
 
-    def _qemu_io_read(qemu_io, s, l, img):
-        cmd = '{io} -C -c "r {s} {l}" -f {fmt} {f}'.format(
-            io=qemu_io, s=s, l=l, fmt=img.image_format, f=img.image_filename
+    def _qemu_io_read(qemu_io, ranges, img):
+        if inflight > 1:
+            cmds = []
+            for idx in range(0, len(ranges), inflight):
+                cmds.extend(
+                    ["aio_read %s %s" % r for r in ranges[idx : idx + inflight]]
+                )
+                cmds.append("aio_flush")
+        else:
+            cmds = ["read %s %s" % r for r in ranges]
+        cmd = "{io} -C {cmds} -f {fmt} {f}".format(
+            io=qemu_io,
+            cmds=" ".join('-c "%s"' % c for c in cmds),
+            fmt=img.image_format,
+            f=img.image_filename,
         )
-        process.system(cmd, ignore_status=False, shell=True)
+        return process.run(cmd, ignore_status=False, shell=True).stdout_text
 
     qemu_io = utils_misc.get_qemu_io_binary(params)
     qemu_img = utils_misc.get_qemu_img_binary(params)
@@ -511,6 +709,8 @@ def copyif(params, nbd_image, target_image, bitmap=None):
     )
     nbd_img_obj = qemu_storage.QemuImg(params.object_params(nbd_image), None, nbd_image)
     max_len = int(params.get("qemu_io_max_len", 2147483136))
+    batch_size = int(params.get("qemu_io_batch_size", 256))
+    inflight = int(params.get("qemu_io_inflight", 1))
 
     if bitmap is None:
         args = "-f %s %s" % (nbd_img_obj.image_format, nbd_img_obj.image_filename)
@@ -529,24 +729,51 @@ def copyif(params, nbd_image, target_image, bitmap=None):
 
     map_cmd = "{qemu_img} map --output=json {args}".format(qemu_img=qemu_img, args=args)
     result = process.run(map_cmd, ignore_status=False, shell=True)
+    extents = [
+        (item["start"], item["length"])
+        for item in json.loads(result.stdout.decode().strip())
+        if item["data"] is state
+    ]
 
-    for item in json.loads(result.stdout.decode().strip()):
-        if item["data"] is not state:
-            continue
-
-        # qemu-io can only handle length less than 2147483136,
-        # so here we need to split 'large length' into several parts
-        start, length = item["start"], item["length"]
-        while length > max_len:
-            _qemu_io_read(qemu_io, start, max_len, img_obj)
-            start, length = start + max_len, length - max_len
-        else:
-            if length > 0:
-                _qemu_io_read(qemu_io, start, length, img_obj)
+    # qemu-io can only handle length less than 2147483136,
+    # so here we need to split 'large length' into several parts
+    ranges = _coalesce_extents(extents, max_len)
+    stats = {
+        "extents": len(extents),
+        "reads": len(ranges),
+        "invocations": 0,
+        "bytes": sum(r[1] for r in ranges),
+        "elapsed": 0.0,
+        "read_times": [],
+    }
+    # qemu-io reports every read, e.g. '1 MiB, 1 ops; 0.0010 sec (...)'
+    time_pattern = re.compile(r"ops;\s+([\d:.]+)\s+sec")
+    for idx in range(0, len(ranges), batch_size):
+        start_time = time.time()
+        output = _qemu_io_read(qemu_io, ranges[idx : idx + batch_size], img_obj)
+        stats["elapsed"] += time.time() - start_time
+        stats["invocations"] += 1
+        stats["read_times"].extend(
+            _qemu_io_time_to_seconds(t) for t in time_pattern.findall(output)
+        )
 
     img_obj.base_tag = "null"
     img_obj.rebase(img_obj.params)
 
+    read_times = stats["read_times"]
+    LOG_JOB.info(
+        "copyif: %d extents(%d reads, %d bytes) copied by %d qemu-io in %.2fs,"
+        " max/avg read time: %.4fs/%.4fs",
+        stats["extents"],
+        stats["reads"],
+        stats["bytes"],
+        stats["invocations"],
+        stats["elapsed"],
+        max(read_times) if read_times else 0,
+        sum(read_times) / len(read_times) if read_times else 0,
+    )
+    return stats
+
 
 def get_disk_info_by_param(tag, params, session):
     """
@@ -0,0 +1,203 @@
+"""
+Module for tracking the progress of a memory balloon change.
+
+QEMU emits BALLOON_CHANGE whenever the actual size of the balloon
+changes, throttled to one event per second, so the last event of a
+change is always delivered. BalloonTracker listens for the events by the
+shared QMP event index, and samples query-balloon and optionally the
+memory reported by the guest at a sub-second cadence. A change is
+complete as soon as the target size is reported, or, when the target is
+unknown, e.g. the guest gives as much memory as it can, when the balloon
+and the guest memory have been quiet for a while.
+
+Available classes:
+- BalloonTracker: Track a balloon change by events and fast sampling
+"""
+
+import logging
+import re
+import threading
+import time
+from array import array
+
+from provider import qmp_event_index
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+MB = 1024**2
+
+
+class BalloonTracker(object):
+    """Track a balloon change by BALLOON_CHANGE events and fast sampling"""
+
+    def __init__(self, vm, interval=0.2, session=None, guest_cmd=None):
+        """
+        :param vm: VM object with a QMP monitor
+        :param interval: seconds between two samples
+        :param session: guest session used only by the tracker
+        :param guest_cmd: command printing the guest memory in KB as the
+                          first number, e.g. "grep MemTotal /proc/meminfo"
+        """
+        self.vm = vm
+        self.interval = interval
+        self.session = session
+        self.guest_cmd = guest_cmd
+        self.event_times = array("d")
+        self.event_actual = array("d")
+        self.times = array("d")
+        self.actual = array("d")
+        self.guest_times = array("d")
+        self.guest_mem = array("d")
+        self.initial = None
+        self._index = qmp_event_index.get_event_index(vm)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._error = None
+
+    def _on_event(self, event):
+        if event.get("event") != "BALLOON_CHANGE":
+            return
+        with self._cond:
+            self.event_times.append(time.time() - self._start_time)
+            self.event_actual.append(event["data"]["actual"] / MB)
+            self._cond.notify_all()
+
+    def _query(self):
+        return self.vm.monitor.cmd("query-balloon", debug=False)["actual"] / MB
+
+    def _record(self):
+        self._index.update()
+        actual = self._query()
+        now = time.time() - self._start_time
+        guest = None
+        if self.session is not None and self.guest_cmd:
+            output = self.session.cmd_output(self.guest_cmd)
+            values = re.findall(r"\d+", output)
+            if values:
+                guest = int(values[0]) / 1024.0
+        with self._cond:
+            self.times.append(now)
+            self.actual.append(actual)
+            if guest is not None:
+                self.guest_times.append(time.time() - self._start_time)
+                self.guest_mem.append(guest)
+            self._cond.notify_all()
+
+    def _run(self):
+        next_time = time.time()
+        while not self._stop.is_set():
+            try:
+                self._record()
+            except Exception as err:
+                with self._cond:
+                    self._error = err
+                    self._cond.notify_all()
+                break
+            next_time += self.interval
+            self._stop.wait(max(next_time - time.time(), 0))
+
+    def start(self):
+        """Start tracking, call it right before changing the balloon"""
+        self._start_time = time.time()
+        self.initial = self._query()
+        self._index.add_listener(self._on_event)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._index.remove_listener(self._on_event)
+
+    def _last_change(self):
+        """Time of the last change of the balloon size, event or sample"""
+        last = 0.0
+        for times, values in (
+            (self.event_times, self.event_actual),
+            (self.times, self.actual),
+        ):
+            previous = self.initial
+            for when, value in zip(times, values):
+                if value != previous:
+                    last = max(last, when)
+                previous = value
+        return last
+
+    def _reached(self, target):
+        """Time when the target size was reported, None if not yet"""
+        found = []
+        for times, values in (
+            (self.event_times, self.event_actual),
+            (self.times, self.actual),
+        ):
+            for when, value in zip(times, values):
+                if abs(value - target) < 1:
+                    found.append(when)
+                    break
+        return min(found) if found else None
+
+    def _guest_stable(self, since, threshold):
+        values = [v for t, v in zip(self.guest_times, self.guest_mem) if t >= since]
+        return not values or max(values) - min(values) < threshold
+
+    def wait(self, target=None, timeout=480, quiet=3.0, guest_threshold=100):
+        """
+        Wait for the balloon change to complete
+
+        :param target: target size in MB, None if it is unknown
+        :param timeout: seconds to wait
+        :param quiet: seconds without change to complete a change whose
+                      target is unknown
+        :param guest_threshold: max change in MB of the guest memory
+                                during the quiet seconds
+        :return: seconds from start() to the completion, None for timeout
+        :raise: the error of sampling
+        """
+        end_time = self._start_time + timeout
+        with self._cond:
+            while True:
+                if self._error is not None:
+                    raise self._error
+                if target is not None:
+                    reached = self._reached(target)
+                    if reached is not None:
+                        return reached
+                elif len(self.times):
+                    now = time.time() - self._start_time
+                    last = self._last_change()
+                    if now - last >= quiet and self._guest_stable(
+                        now - quiet, guest_threshold
+                    ):
+                        return last
+                if time.time() >= end_time:
+                    return None
+                self._cond.wait(min(self.interval, end_time - time.time()))
+
+    def summary(self, completed=None):
+        """
+        Get the size and the speed of the change
+
+        :param completed: seconds returned by wait()
+        :return: dict of initial, final in MB, elapsed seconds, rate in
+                 MB/s, negative when the balloon inflated, and the number
+                 of events
+        """
+        with self._cond:
+            final = self.actual[-1] if len(self.actual) else self.initial
+            if len(self.event_times) and (
+                not len(self.times) or self.event_times[-1] > self.times[-1]
+            ):
+                final = self.event_actual[-1]
+            elapsed = completed
+            if elapsed is None:
+                elapsed = self.times[-1] if len(self.times) else 0
+            return {
+                "initial": self.initial,
+                "final": final,
+                "elapsed": elapsed,
+                "rate": (final - self.initial) / elapsed if elapsed else 0,
+                "events": len(self.event_times),
+            }
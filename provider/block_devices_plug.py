@@ -10,9 +10,11 @@ Available methods:
 - unplug_devs_serial: Unplug the block devices by serial.
 - hotplug_devs_threaded: Hot plug the block devices by threaded.
 - unplug_devs_threaded: Unplug the block devices by threaded.
+- hotplug_devs_batch: Hot plug the block devices by pipelined QMP commands.
 
 """
 
+import json
 import logging
 import multiprocessing
 import sys
@@ -30,18 +32,102 @@ from virttest.qemu_devices.utils import (
     DeviceHotplugError,
     DeviceUnplugError,
 )
-from virttest.qemu_monitor import MonitorLockError
+from virttest.qemu_monitor import (
+    MonitorLockError,
+    MonitorProtocolError,
+    QMPMonitor,
+)
+
+from provider import guest_disk_watcher, qmp_event_index
 
 LOG_JOB = logging.getLogger("avocado.test")
 
 HOTPLUG, UNPLUG = ("hotplug", "unplug")
 HOTPLUGGED_HBAS = {}
 DELETED_EVENT = "DEVICE_DELETED"
+OST_EVENT = "ACPI_DEVICE_OST"
 DISK = {"name": "images", "media": "disk"}
 CDROM = {"name": "cdroms", "media": "cdrom"}
 
 _LOCK = threading.Lock()
 _QMP_OUTPUT = {}
+# time.time() when the plug command of an image was sent
+_PLUG_TIMES = {}
+
+
+def _pipeline_cmds(monitor, cmds, window=8, timeout=300):
+    """
+    Send QMP commands without waiting for the response of every command,
+    QEMU runs the commands of a monitor in their order. The commands and
+    the responses are logged like QMPMonitor.cmd() does.
+
+    :param monitor: QMP monitor
+    :param cmds: list of (command, arguments)
+    :param window: max number of the commands waiting for responses
+    :param timeout: timeout of all the responses
+    :return: list of the response dicts, in the order of the commands
+    """
+    if not monitor._acquire_lock():
+        raise MonitorLockError("Could not acquire exclusive lock to send QMP commands")
+    try:
+        monitor._read_objects()
+        prefix = "batch-%s" % utils_misc.generate_random_string(4)
+        ids = ["%s-%d" % (prefix, i) for i in xrange(len(cmds))]
+        names = dict(zip(ids, [cmd for cmd, _ in cmds]))
+        responses = {}
+        pending = set()
+        sent = 0
+        end_time = time.time() + timeout
+        while sent < len(cmds) or pending:
+            while sent < len(cmds) and len(pending) < window:
+                cmd, args = cmds[sent]
+                monitor._log_command(cmd)
+                data = json.dumps(monitor._build_cmd(cmd, args, ids[sent]))
+                LOG_JOB.debug("Send command: %s", data)
+                monitor._send(data.encode())
+                pending.add(ids[sent])
+                sent += 1
+            if not monitor._data_available(end_time - time.time()):
+                raise MonitorProtocolError(
+                    "Received no response to %d pipelined QMP commands" % len(pending)
+                )
+            for obj in monitor._read_objects():
+                q_id = obj.get("id") if isinstance(obj, dict) else None
+                if q_id in pending and ("return" in obj or "error" in obj):
+                    pending.remove(q_id)
+                    responses[q_id] = obj
+                    if obj.get("return"):
+                        monitor._log_response(names[q_id], obj["return"])
+                    elif "error" in obj:
+                        monitor._log_response(names[q_id], obj["error"])
+        return [responses[q_id] for q_id in ids]
+    finally:
+        monitor._lock.release()
+
+
+class _CachedInfoMonitor(object):
+    """
+    Monitor whose info queries are run once, so the hot plugged devices of
+    a batch are verified by one "info qtree" instead of one per device.
+    """
+
+    def __init__(self, monitor):
+        self._monitor = monitor
+        self._info = {}
+
+    def __getattr__(self, name):
+        return getattr(self._monitor, name)
+
+    def info(self, what, debug=True):
+        if what not in self._info:
+            self._info[what] = self._monitor.info(what, debug)
+        return self._info[what]
+
+
+def _event_time(event):
+    """Get the time.time() of a QMP event."""
+    stamp = event.get("timestamp", {})
+    return stamp.get("seconds", 0) + stamp.get("microseconds", 0) / 10.0**6
 
 
 def _verify_plugged_num(action):
@@ -51,18 +137,32 @@ def _verify_plugged_num(action):
 
     def decorator(func):
         def wrapper(self, *args, **kwargs):
+            watcher = self._get_disk_watcher()
             orig_disks = self._list_all_disks()
             LOG_JOB.debug("The index of disks before %s:\n %s", action, orig_disks)
+            start = time.time()
             result = func(self, *args, **kwargs)
             if self._dev_type != CDROM:
                 for dev in HOTPLUGGED_HBAS.values():
                     if dev.get_param("hotplug") == "off":
                         return result
-                if not utils_misc.wait_for(
-                    lambda: len(self._imgs) == len(self._list_all_disks() ^ orig_disks),
-                    self._timeout,
-                    step=1.5,
-                ):
+                changed = False
+                if watcher:
+                    changed = watcher.wait_for(
+                        lambda disks: len(self._imgs) == len(disks ^ orig_disks),
+                        self._timeout,
+                    )
+                    self._all_disks = watcher.disks
+                if not changed and not (watcher and watcher.is_alive()):
+                    # the guest was not watched, or the watching stopped, e.g.
+                    # the guest rebooted
+                    changed = utils_misc.wait_for(
+                        lambda: len(self._imgs)
+                        == len(self._list_all_disks() ^ orig_disks),
+                        self._timeout,
+                        step=1.5,
+                    )
+                if not changed:
                     disks_info_win = (
                         "wmic logicaldisk get drivetype,name,description "
                         "& wmic diskdrive list brief /format:list"
@@ -81,6 +181,17 @@ def _verify_plugged_num(action):
                 self._plugged_disks = sorted(
                     [disk.split("/")[-1] for disk in list(self._all_disks ^ orig_disks)]
                 )
+                if watcher:
+                    self._update_plug_latency(action, watcher.changes(start))
+            elapsed = time.time() - start
+            self.plug_rate = len(self._imgs) / elapsed if elapsed else 0
+            LOG_JOB.info(
+                "%s %d devices in %.2fs, %.2f devices/s",
+                action.capitalize(),
+                len(self._imgs),
+                elapsed,
+                self.plug_rate,
+            )
             return result
 
         return wrapper
@@ -202,6 +313,11 @@ class BlockDevicesPlug(object):
         self._timeout = 300
         self._interval = 0
         self._qemu_version = self.vm.devices.qemu_version
+        self._watch_events = vm.params.get("plug_watch_events", "no") == "yes"
+        self._watcher = None
+        self._event_times = {}
+        self.plug_latency = {}
+        self.plug_rate = 0
 
     def __getitem__(self, index):
         """Get the hot plugged disk index."""
@@ -216,8 +332,18 @@ class BlockDevicesPlug(object):
         for disk in self._plugged_disks:
             yield disk
 
+    def _get_disk_watcher(self):
+        """Get the guest disk watcher if the events are watched."""
+        self._watcher = None
+        if self._watch_events:
+            self._watcher = guest_disk_watcher.get_disk_watcher(self.vm)
+        return self._watcher
+
     def _list_all_disks(self):
         """List all the disks."""
+        if self._watcher and self._watcher.is_alive():
+            self._all_disks = self._watcher.disks
+            return self._all_disks
         session = self.vm.wait_for_login(timeout=360)
         if self._islinux:
             self._all_disks = utils_misc.list_linux_guest_disks(session)
@@ -249,11 +375,41 @@ class BlockDevicesPlug(object):
         self.vm.monitor.clear_event(DELETED_EVENT)
         return not self.event_devs
 
+    def _on_event_deleted(self, event):
+        """Record the device deleted event of an unplugged device."""
+        name = (event.get("data") or {}).get("device")
+        if event.get("event") != DELETED_EVENT or name not in self.event_devs:
+            return
+        # skip the events of the former unplugging of the device
+        if _event_time(event) >= _PLUG_TIMES.get(name, 0):
+            self._event_times[name] = _event_time(event)
+            self.event_devs.remove(name)
+
+    def _check_events_deleted(self, index):
+        """Index the new events, then check if all the devices are deleted."""
+        index.update()
+        return not self.event_devs
+
     def _wait_events_deleted(self, timeout=300):
         """
         Wait the events "DEVICE DELETED" to be generated after unplug device.
         """
-        if not utils_misc.wait_for(self._get_events_deleted, timeout):
+        if self._watch_events:
+            # every event is checked once as it is indexed, instead of
+            # scanning the whole event backlog on every check
+            index = qmp_event_index.get_event_index(self.vm)
+            self.event_devs = list(self._unplugged_devs.keys())
+            index.add_listener(self._on_event_deleted, replay=True)
+            try:
+                deleted = utils_misc.wait_for(
+                    lambda: self._check_events_deleted(index), timeout, step=0.1
+                )
+            finally:
+                index.remove_listener(self._on_event_deleted)
+            self.vm.monitor.clear_event(DELETED_EVENT)
+        else:
+            deleted = utils_misc.wait_for(self._get_events_deleted, timeout)
+        if not deleted:
             raise TestError(
                 'No "DEVICE DELETED" event generated after unplug "%s".'
                 % (";".join(self.event_devs))
@@ -306,8 +462,8 @@ class BlockDevicesPlug(object):
                 else plug_func(monitor, self._qemu_version)
             )
 
-    def _hotplug_atomic(self, device, monitor, bus=None):
-        """Function hot plug device to devices representation."""
+    def _prepare_hotplug(self, device, bus=None):
+        """Insert the device to be hot plugged into devices representation."""
         self.vm.devices.set_dirty()
 
         qdev_out = ""
@@ -334,8 +490,10 @@ class BlockDevicesPlug(object):
             if bus is not None:
                 bus.prepare_hotplug(device)
                 qdev_out = self.vm.devices.insert(device)
+        return qdev_out
 
-        out = self._plug(device.hotplug, monitor, HOTPLUG)
+    def _verify_hotplugged(self, device, out, monitor, qdev_out):
+        """Verify the hot plugged device and update devices representation."""
         ver_out = device.verify_hotplug(out, monitor)
         if ver_out is False:
             self.vm.devices.set_clean()
@@ -357,6 +515,12 @@ class BlockDevicesPlug(object):
             )
         return out, ver_out
 
+    def _hotplug_atomic(self, device, monitor, bus=None):
+        """Function hot plug device to devices representation."""
+        qdev_out = self._prepare_hotplug(device, bus)
+        out = self._plug(device.hotplug, monitor, HOTPLUG)
+        return self._verify_hotplugged(device, out, monitor, qdev_out)
+
     def _unplug_atomic(self, device, monitor):
         """Function unplug device to devices representation."""
         device = self.vm.devices[device]
@@ -430,6 +594,8 @@ class BlockDevicesPlug(object):
                 ):
                     args += (bus,)
                 with _LOCK:
+                    if self._watch_events and device.get_qid() == img:
+                        _PLUG_TIMES[img] = time.time()
                     _QMP_OUTPUT[device.get_qid()] = getattr(
                         self, "_%s_atomic" % action
                     )(*args)
@@ -448,6 +614,127 @@ class BlockDevicesPlug(object):
         self._create_devices(*args)
         self._plug_devs(HOTPLUG, self._hotplugged_devs, monitor, bus, interval)
 
+    def _hotplug_devs_batch(self, images, monitor, bus=None, window=8):
+        """
+        Hot plug the block devices which are defined by images by pipelined
+        QMP commands, the objects and the nodes of all the images are added
+        first, then the devices, so the guest discovers the first disks
+        while the others are being plugged. A device without QMP hotplug
+        command is plugged by its hotplug() in its turn.
+        """
+        LOG_JOB.info(
+            'Start to hotplug devices "%s" by monitor %s in batch.',
+            " ".join(images),
+            monitor.name,
+        )
+        self._create_devices(
+            images, {"aobject": "pci.0" if bus is None else bus.aobject}
+        )
+        backends, frontends = [], []
+        for img, devices in self._hotplugged_devs.items():
+            for device in devices:
+                stage = frontends if isinstance(device, qdevices.QDevice) else backends
+                stage.append((img, device))
+
+        for stage in (backends, frontends):
+            batch = []
+            failed = False
+            for img, device in stage:
+                args = (device,)
+                if (
+                    isinstance(device, qdevices.QDevice)
+                    and bus is not None
+                    and self.vm.devices.is_pci_device(device["driver"])
+                ):
+                    args += (bus,)
+                qdev_out = self._prepare_hotplug(*args)
+                cmd = self._get_hotplug_qmp_cmd(device)
+                if cmd is not None:
+                    batch.append((img, device, qdev_out, cmd))
+                    continue
+                # keep the order of the commands, send the batch first
+                try:
+                    failed = self._send_hotplug_batch(batch, monitor, window)
+                except Exception:
+                    self.vm.devices.set_clean()
+                    raise
+                batch = []
+                if failed:
+                    # the device is prepared but not plugged
+                    self.vm.devices.set_clean()
+                    break
+                if self._watch_events and device.get_qid() == img:
+                    _PLUG_TIMES[img] = time.time()
+                out = self._plug(device.hotplug, monitor, HOTPLUG)
+                output = self._verify_hotplugged(device, out, monitor, qdev_out)
+                _QMP_OUTPUT[device.get_qid()] = output
+                failed = output[1] is False
+                if failed:
+                    break
+            else:
+                failed = self._send_hotplug_batch(batch, monitor, window)
+            # the devices are plugged to the nodes, so stop at a failure
+            if failed:
+                break
+
+    def _get_hotplug_qmp_cmd(self, device):
+        """
+        Get the QMP hotplug command of a device to be pipelined
+
+        :return: tuple of (command, arguments), None if the device must be
+                 plugged by its hotplug(), i.e. it overrides hotplug(), like
+                 the daemon devices, or it has no QMP command and falls
+                 back to HMP
+        """
+        if type(device).hotplug is not qdevices.QBaseDevice.hotplug:
+            return None
+        try:
+            return device._hotplug_qmp_mapping(self._qemu_version)()
+        except DeviceError:
+            return None
+
+    def _send_hotplug_batch(self, batch, monitor, window):
+        """
+        Send the hotplug commands of a batch by pipelined QMP commands and
+        verify the devices
+
+        :param batch: list of (image tag, device, qdev output, command)
+        :return: True if any device failed to be plugged
+        """
+        if not batch:
+            return False
+        if self._watch_events:
+            sent = time.time()
+            for img, device, _, _ in batch:
+                if device.get_qid() == img:
+                    _PLUG_TIMES[img] = sent
+        LOG_JOB.debug("Send %d pipelined QMP commands", len(batch))
+        verified = 0
+        try:
+            responses = _pipeline_cmds(
+                monitor, [cmd for _, _, _, cmd in batch], window, self._timeout
+            )
+            # one "info qtree" verifies all the devices of the batch
+            verify_monitor = _CachedInfoMonitor(monitor)
+            failed = False
+            for (img, device, qdev_out, _), resp in zip(batch, responses):
+                if "error" in resp:
+                    self.vm.devices.set_clean()
+                    output = (str(resp["error"]), False)
+                else:
+                    output = self._verify_hotplugged(
+                        device, resp["return"], verify_monitor, qdev_out
+                    )
+                _QMP_OUTPUT[device.get_qid()] = output
+                failed = failed or output[1] is False
+                verified += 1
+        except Exception:
+            # the devices prepared but not verified are never plugged
+            for _ in batch[verified:]:
+                self.vm.devices.set_clean()
+            raise
+        return failed
+
     def _unplug_devs(self, images, monitor, interval=0):
         """
         Unplug the block devices which are defined by images.
@@ -491,6 +778,41 @@ class BlockDevicesPlug(object):
         )
         self._plug_devs(UNPLUG, self._unplugged_devs, monitor, interval=interval)
 
+    def _update_plug_latency(self, action, changes):
+        """
+        Update the latencies of the plugged images, from sending the plug
+        command to QEMU reporting the device deleted, or ACPI_DEVICE_OST
+        if any, and to the disk changed in guest. The disk changes are
+        matched to the images in the order of the commands, so the guest
+        latency is only exact for plugging in serial.
+
+        :param action: HOTPLUG or UNPLUG
+        :param changes: disk changes since the plugging by the watcher
+        """
+        sent = dict(
+            (img, _PLUG_TIMES.pop(img)) for img in self._imgs if img in _PLUG_TIMES
+        )
+        host = dict(self._event_times)
+        self._event_times.clear()
+        if action == HOTPLUG:
+            index = qmp_event_index.get_event_index(self.vm)
+            for event in index.get_events(OST_EVENT):
+                name = event.get("data", {}).get("info", {}).get("device")
+                if name in sent and _event_time(event) >= sent[name]:
+                    host.setdefault(name, _event_time(event))
+        guest_action = (
+            guest_disk_watcher.ADD if action == HOTPLUG else guest_disk_watcher.REMOVE
+        )
+        guest = [when for when, change, _ in changes if change == guest_action]
+        self.plug_latency = {}
+        for img, when in sorted(sent.items(), key=lambda item: item[1]):
+            self.plug_latency[img] = {
+                "host": host[img] - when if img in host else None,
+                "guest": guest.pop(0) - when if guest else None,
+            }
+        for img, latency in self.plug_latency.items():
+            LOG_JOB.debug("Latency of %s %s: %s", action, img, latency)
+
     def _plug_devs_threads(self, action, images, bus, timeout, interval=0):
         """Threads that plug blocks devices."""
         self._orig_disks = self._list_all_disks()
@@ -556,7 +878,7 @@ class BlockDevicesPlug(object):
         self._check_qmp_outputs(UNPLUG)
         self._wait_events_deleted(timeout)
 
-    @_verify_plugged_num(action=UNPLUG)
+    @_verify_plugged_num(action=HOTPLUG)
     def hotplug_devs_threaded(self, images=None, timeout=300, bus=None, interval=0):
         """
         Hot plug the block devices by threaded.
@@ -590,3 +912,39 @@ class BlockDevicesPlug(object):
         self._plug_devs_threads(UNPLUG, images, None, timeout, interval)
         self._check_qmp_outputs(UNPLUG)
         self._wait_events_deleted(timeout)
+
+    @_verify_plugged_num(action=HOTPLUG)
+    def hotplug_devs_batch(
+        self, images=None, monitor=None, bus=None, timeout=300, window=8
+    ):
+        """
+        Hot plug the block devices by pipelined QMP commands, which are not
+        waiting for the response of every command.
+
+        :param images: Image or cdrom tags, e.g, "stg0" or "stg0 stg1 stg3".
+        :type images: str
+        :param monitor: QMP monitor from vm.
+        :type monitor: qemu_monitor.QMPMonitor
+        :param bus: The bus to be plugged into
+        :type bus: qdevice.QSparseBus
+        :param timeout: Timeout for hot plugging.
+        :type timeout: float
+        :param window: Max number of the commands waiting for responses.
+        :type window: int
+        """
+        self._timeout = timeout
+        if monitor is None:
+            monitor = self.vm.monitor
+        if images:
+            self._imgs = [img for img in images.split()]
+        if set(self._imgs) <= set(self.vm.params["cdroms"].split()):
+            self._dev_type = CDROM
+        # the nodes of drives may be added by HMP commands
+        if (
+            isinstance(monitor, QMPMonitor)
+            and self._qdev_type is qdevices.QBlockdevNode
+        ):
+            self._hotplug_devs_batch(self._imgs, monitor, bus, window)
+        else:
+            self._hotplug_devs(self._imgs, monitor, bus)
+        self._check_qmp_outputs(HOTPLUG)
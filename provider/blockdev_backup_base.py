@@ -87,9 +87,8 @@ class BlockdevBackupBaseTest(object):
     def prepare_data_disks(self):
         for tag in self.source_disks:
             self.format_data_disk(tag)
-            backup_utils.generate_tempfile(
-                self.main_vm, self.disks_info[tag][1], "data"
-            )
+        files = [(self.disks_info[tag][1], "data", "10M") for tag in self.source_disks]
+        backup_utils.generate_tempfiles(self.main_vm, files)
 
     def verify_data_files(self):
         session = self.clone_vm.wait_for_login()
@@ -98,9 +97,15 @@ class BlockdevBackupBaseTest(object):
             for tag, info in self.disks_info.items():
                 LOG_JOB.debug("mount target disk in VM!")
                 utils_disk.mount(info[0], info[1], session=session)
-                backup_utils.verify_file_md5(self.clone_vm, info[1], "data")
+            files = [(info[1], "data") for info in self.disks_info.values()]
+            results = backup_utils.verify_tempfiles(
+                self.clone_vm, files, session=session
+            )
         finally:
             session.close()
+        mismatched = [f for f, matched in results.items() if not matched]
+        if mismatched:
+            raise exceptions.TestFail("Files' checksum mismatch: %s" % mismatched)
 
     def prepare_clone_vm(self):
         """Boot VM with target data disk for verify purpose"""
@@ -83,19 +83,34 @@ class BlockdevBaseTest(object):
         :param tag: image tag
         :param filename: temp filename
         """
-        if not filename:
-            filename = utils_misc.generate_random_string(4)
-        params = self.params.object_params(tag)
-        image_size = params.get("tempfile_size", "10M")
-        timeout = params.get_numeric("create_tempfile_timeout", 720)
-        backup_utils.generate_tempfile(
-            self.main_vm, self.disks_info[tag][1], filename, image_size, timeout
-        )
-
-        if tag not in self.files_info:
-            self.files_info[tag] = [filename]
-        else:
-            self.files_info[tag].append(filename)
+        self.generate_data_files([tag], filename)
+
+    def generate_data_files(self, tags, filename=None):
+        """
+        Generate tempfiles in the images concurrently in one guest session
+
+        :param tags: image tags
+        :param filename: temp filename, a random name for each image if None
+        """
+        files = []
+        timeout = 0
+        for tag in tags:
+            name = filename or utils_misc.generate_random_string(4)
+            params = self.params.object_params(tag)
+            image_size = params.get("tempfile_size", "10M")
+            timeout = max(timeout, params.get_numeric("create_tempfile_timeout", 720))
+            files.append((self.disks_info[tag][1], name, image_size))
+            self.files_info.setdefault(tag, []).append(name)
+        backup_utils.generate_tempfiles(self.main_vm, files, timeout)
+
+    def configure_data_disk(self, tag):
+        """
+        Make file system on the disk and mount it
+
+        :param tag: image tag
+        """
+        if tag != "image1":
+            self.format_data_disk(tag)
 
     def prepare_data_disk(self, tag):
         """
@@ -104,16 +119,20 @@ class BlockdevBaseTest(object):
 
         :param tag: image tag
         """
-        if tag != "image1":
-            self.format_data_disk(tag)
+        self.configure_data_disk(tag)
         self.generate_data_file(tag)
 
-    def prepare_data_disks(self):
+    def prepare_data_disks(self, filename=None):
         """
-        prepare all data disks
+        prepare all data disks, the temp files are created in one go
+        after all disks are mounted
+
+        :param filename: temp filename, a random name for each image if None
         """
-        for tag in self.params.objects("source_images"):
-            self.prepare_data_disk(tag)
+        tags = self.params.objects("source_images")
+        for tag in tags:
+            self.configure_data_disk(tag)
+        self.generate_data_files(tags, filename)
 
     def verify_data_files(self):
         """
@@ -126,10 +145,19 @@ class BlockdevBaseTest(object):
                 if tag != "image1":
                     LOG_JOB.debug("mount target disk in VM!")
                     utils_disk.mount(info[0], info[1], session=session)
-                for data_file in self.files_info[tag]:
-                    backup_utils.verify_file_md5(self.clone_vm, info[1], data_file)
+            files = [
+                (info[1], data_file)
+                for tag, info in self.disks_info.items()
+                for data_file in self.files_info[tag]
+            ]
+            results = backup_utils.verify_tempfiles(
+                self.clone_vm, files, session=session
+            )
         finally:
             session.close()
+        mismatched = [f for f, matched in results.items() if not matched]
+        if mismatched:
+            raise exceptions.TestFail("Files' checksum mismatch: %s" % mismatched)
 
     @error_context.context_aware
     def format_data_disk(self, tag):
@@ -87,13 +87,16 @@ class BlockdevLiveBackupBaseTest(BlockdevBaseTest):
             finally:
                 session.close()
 
-    def prepare_data_disk(self, tag):
+    def configure_data_disk(self, tag):
         """Data disk can be a system disk or a non-system disk"""
         if tag == self.params["images"].split()[0]:
             self._configure_system_disk(tag)
         else:
             self._configure_data_disk(tag)
-        self.generate_data_file(tag, filename="base")
+
+    def prepare_data_disks(self, filename="base"):
+        """Create the base files on all data disks"""
+        super(BlockdevLiveBackupBaseTest, self).prepare_data_disks(filename)
 
     def generate_inc_files(self, filename="inc"):
         """Create new files on data disks"""
@@ -83,7 +83,7 @@ class BlockdevMirrorBaseTest(blockdev_base.BlockdevBaseTest):
             finally:
                 session.close()
 
-    def prepare_data_disk(self, tag):
+    def configure_data_disk(self, tag):
         """
         data disk can be a system disk or a non-system disk
         """
@@ -91,7 +91,6 @@ class BlockdevMirrorBaseTest(blockdev_base.BlockdevBaseTest):
             self._configure_system_disk(tag)
         else:
             self._configure_data_disk(tag)
-        self.generate_data_file(tag)
 
     def clone_vm_with_mirrored_images(self):
         """Boot VM with mirrored data disks"""
@@ -3,10 +3,7 @@ Module specified for test cases that don't need to wait job done,
 please refer to blockdev_mirror_base for detailed test strategy.
 """
 
-from functools import partial
-
 from avocado.utils import memory
-from virttest import utils_misc
 
 from provider import backup_utils, blockdev_mirror_base, job_utils
 
@@ -34,11 +31,7 @@ class BlockdevMirrorNowaitTest(blockdev_mirror_base.BlockdevMirrorBaseTest):
 
     def wait_mirror_jobs_completed(self):
         """Wait till all mirror jobs completed in parallel"""
-        targets = [
-            partial(job_utils.wait_until_block_job_completed, vm=self.main_vm, job_id=j)
-            for j in self._jobs
-        ]
         try:
-            utils_misc.parallel(targets)
+            job_utils.wait_until_block_jobs_completed(self.main_vm, self._jobs)
         finally:
             memory.drop_caches()
@@ -1,6 +1,9 @@
 import re
 import subprocess
 import sys
+import time
+
+from provider import testpmd_stats
 
 # Ensure paramiko is installed
 for pip in ["pip3", "pip"]:
@@ -84,11 +87,12 @@ class TestPMD:
         self.session = None
         self.dpdk_channel = None
 
-    def _expect_prompt(self, timeout=10):
+    def _expect_prompt(self, timeout=10, quiet=False):
         """
         Wait for the testpmd prompt.
 
         :param timeout: Maximum time to wait for the prompt
+        :param quiet: Do not print the output
         :return: Output received from the channel
         """
 
@@ -96,7 +100,8 @@ class TestPMD:
         while True:
             data = self.dpdk_channel.recv(16384).decode()
             output += data
-            print(data, end="")
+            if not quiet:
+                print(data, end="")
 
             if "testpmd>" in output:
                 return output
@@ -206,6 +211,77 @@ class TestPMD:
 
         return output
 
+    def command(self, cmd, quiet=False):
+        """
+        Run a testpmd command.
+
+        :param cmd: testpmd command
+        :param quiet: Do not print the output
+        :return: Output of the command
+        """
+
+        self.dpdk_channel.sendall(cmd + "\n")
+        return self._expect_prompt(quiet=quiet)
+
+    def port_counters(self):
+        """
+        Read the cumulative counters of all ports.
+
+        :return: dict of {port: {counter: value}}
+        """
+
+        return testpmd_stats.parse_port_stats(
+            self.command("show port stats all", quiet=True)
+        )
+
+    def sample_port_stats(self, duration, interval=1.0, xstats=False):
+        """
+        Sample the port counters at a fixed interval.
+
+        :param duration: Seconds to sample
+        :param interval: Seconds between two samples
+        :param xstats: Sample the per queue counters too
+        :return: PortStatsSeries object
+        """
+
+        series = testpmd_stats.PortStatsSeries()
+        start = time.time()
+        next_time = start
+        while True:
+            stats = self.port_counters()
+            queues = None
+            if xstats:
+                queues = testpmd_stats.parse_xstats(
+                    self.command("show port xstats all", quiet=True)
+                )
+            series.add(time.time() - start, stats, queues)
+            if time.time() - start >= duration:
+                break
+            next_time += interval
+            time.sleep(max(next_time - time.time(), 0))
+        return series
+
+    def set_tx_rate(self, pps, pkt_size, queues, port=0):
+        """
+        Limit the tx rate of a port by the rate limit of its queues, the
+        NIC must support the queue rate limit.
+
+        :param pps: Packets per second of the port
+        :param pkt_size: Packet size in bytes
+        :param queues: Number of tx queues
+        :param port: Port id
+        """
+
+        # the preamble, the start delimiter and the gap take 20 bytes
+        mbps = float(pps) / queues * (int(pkt_size) + 20) * 8 / 10**6
+        for queue in range(int(queues)):
+            output = self.command(
+                "set port %d queue %d rate %d" % (port, queue, max(round(mbps), 1)),
+                quiet=True,
+            )
+            if re.search(r"error|not supported|fail", output, re.I):
+                raise ValueError("Failed to limit the tx rate: %s" % output)
+
     def quit_testpmd(self):
         """
         Quit the testpmd tool.
@@ -0,0 +1,226 @@
+"""
+Module for aggregating the results of repeated fio runs.
+
+The IOPS, bandwidth and latency of every job are kept per image in
+array.array, the raw fio JSON objects are only kept when asked, so the
+memory used by hundreds of runs stays small. Outliers are dropped by
+their distance to the median in one pass, and robust statistics are
+computed on the remaining samples.
+
+Available classes:
+- FioJobResults: Samples of one fio job
+- FioImageResults: Results of all fio jobs run on one image
+- FioResults: Results of all images
+
+Available functions:
+- drop_outliers: Drop the samples farthest from the median
+- median: Median of samples
+- mad: Median absolute deviation of samples
+- trimmed_mean: Mean of samples without the lowest and highest ones
+- confidence_interval: Confidence interval of the mean of samples
+"""
+
+import logging
+import math
+import statistics
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+
+def median(values):
+    """Median of samples, 0 for no sample"""
+    return statistics.median(values) if len(values) else 0
+
+
+def mad(values):
+    """Median absolute deviation of samples"""
+    center = median(values)
+    return median([abs(v - center) for v in values])
+
+
+def drop_outliers(values, drop_num):
+    """
+    Drop the samples farthest from the median
+
+    :param values: sequence of samples
+    :param drop_num: number of samples to be dropped
+    :return: list of the kept samples, in their original order
+    """
+    if drop_num <= 0 or not len(values):
+        return list(values)
+    center = median(values)
+    ranked = sorted(range(len(values)), key=lambda i: abs(values[i] - center))
+    kept = sorted(ranked[: max(len(values) - drop_num, 1)])
+    return [values[i] for i in kept]
+
+
+def trimmed_mean(values, proportion=0.1):
+    """
+    Mean of samples without the lowest and highest ones
+
+    :param values: sequence of samples
+    :param proportion: proportion of samples cut from each end
+    """
+    values = sorted(values)
+    cut = int(len(values) * proportion)
+    values = values[cut : len(values) - cut] or values
+    return sum(values) / len(values) if values else 0
+
+
+def confidence_interval(values, level=0.95):
+    """
+    Confidence interval of the mean of samples, by normal approximation
+
+    :param values: sequence of samples
+    :param level: confidence level
+    :return: tuple of (low, high)
+    """
+    mean = sum(values) / len(values) if len(values) else 0
+    if len(values) < 2:
+        return mean, mean
+    z = statistics.NormalDist().inv_cdf((1 + level) / 2)
+    half = z * statistics.stdev(values) / math.sqrt(len(values))
+    return mean - half, mean + half
+
+
+class FioJobResults(object):
+    """Samples of one fio job"""
+
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = options or {}
+        self.iops = array("d")
+        self.bw = array("d")
+        self.lat = array("d")
+        self.job_runtime = 0
+
+    def add(self, job):
+        """
+        Add the result of the job from a fio JSON object
+
+        :param job: item of "jobs" in fio JSON object
+        """
+        read, write = job["read"], job["write"]
+        self.iops.append(int(read["iops"]) + int(write["iops"]))
+        self.bw.append(int(read["bw"]) + int(write["bw"]))
+        self.lat.append(int(read["lat_ns"]["mean"]) + int(write["lat_ns"]["mean"]))
+        self.job_runtime = job["job_runtime"]
+
+    def summarize(self, drop_num=0, level=0.95):
+        """
+        Get the statistics of the job
+
+        :param drop_num: number of outliers dropped from IOPS and latency
+        :param level: confidence level of the IOPS confidence interval
+        :return: dict of statistics
+        """
+        iops = drop_outliers(self.iops, drop_num)
+        lat = drop_outliers(self.lat, drop_num)
+        bw = drop_outliers(self.bw, drop_num)
+        iops_avg = int(sum(iops) / len(iops)) if iops else 0
+        iops_std = statistics.stdev(iops) if len(iops) > 1 else 0
+        return {
+            "sample_iops": iops,
+            "sample_lat": lat,
+            "iops_avg": iops_avg,
+            "iops_std": iops_std,
+            "iops_dispersion": round(iops_std / iops_avg, 6) if iops_avg else 0,
+            "iops_median": median(iops),
+            "iops_mad": mad(iops),
+            "iops_trimmed_mean": trimmed_mean(iops),
+            "iops_ci": confidence_interval(iops, level),
+            "bw_avg": int(sum(bw) / len(bw)) if bw else 0,
+            "lat_avg": int(sum(lat) / len(lat)) if lat else 0,
+            "lat_median": median(lat),
+            "job_runtime": self.job_runtime,
+        }
+
+
+class FioImageResults(object):
+    """Results of all fio jobs run on one image"""
+
+    def __init__(self, name):
+        self.name = name
+        self.filename = ""
+        self.global_options = {}
+        self.disk_name = "unknown"
+        self.jobs = {}
+        self.raw = []
+
+    def add_output(self, fio_output, keep_raw=False):
+        """
+        Add the results of a fio JSON object
+
+        :param fio_output: fio JSON object
+        :param keep_raw: keep the fio JSON object
+        :raise ValueError: the file of fio output is not the one of image
+        """
+        global_options = fio_output["global options"]
+        filename = global_options.get("directory", global_options.get("filename"))
+        if self.filename:
+            if filename != self.filename:
+                raise ValueError("Wrong data %s %s" % (filename, self.filename))
+        else:
+            self.filename = filename
+            self.global_options = dict(global_options)
+            if fio_output.get("disk_util"):
+                self.disk_name = fio_output["disk_util"][0]["name"]
+        if keep_raw:
+            self.raw.append(fio_output)
+
+        for job in fio_output["jobs"]:
+            jobname = job["jobname"]
+            if jobname not in self.jobs:
+                LOG_JOB.debug("Add job: %s %s", filename, jobname)
+                self.jobs[jobname] = FioJobResults(jobname, dict(job["job options"]))
+            self.jobs[jobname].add(job)
+            LOG_JOB.debug(
+                "Get %s %s runtime:%s IOPS:%s",
+                filename,
+                jobname,
+                job["job_runtime"],
+                self.jobs[jobname].iops[-1],
+            )
+
+    def summarize(self, drop_num=0, level=0.95):
+        """
+        Get the statistics of all jobs
+
+        :return: dict of {job name: statistics dict}
+        """
+        return {name: job.summarize(drop_num, level) for name, job in self.jobs.items()}
+
+
+class FioResults(object):
+    """Results of fio jobs on all images"""
+
+    def __init__(self, images=None):
+        self.images = {}
+        for image in images or []:
+            self.images[image] = FioImageResults(image)
+
+    def add_output(self, image, fio_output, keep_raw=False):
+        """
+        Add the results of a fio JSON object run on the image
+
+        :param image: image name
+        :param fio_output: fio JSON object
+        :param keep_raw: keep the fio JSON object
+        :return: FioImageResults object of the image
+        """
+        if image not in self.images:
+            self.images[image] = FioImageResults(image)
+        self.images[image].add_output(fio_output, keep_raw)
+        return self.images[image]
+
+    def summarize(self, drop_num=0, level=0.95):
+        """
+        Get the statistics of all images
+
+        :return: dict of {image: {job name: statistics dict}}
+        """
+        return {
+            name: image.summarize(drop_num, level)
+            for name, image in self.images.items()
+        }
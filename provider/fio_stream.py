@@ -0,0 +1,188 @@
+"""
+Module for decoding fio JSON output incrementally.
+
+fio prints a JSON document for every report, e.g. one per interval with
+--status-interval plus the final one, so its output is a stream of
+concatenated JSON objects, mixed with non-JSON lines such as the echoed
+command, warnings and the shell prompt.
+
+Available classes:
+- FioJSONDecoder: Decode fio JSON objects from chunks of output
+
+Available functions:
+- parse_fio_json: Decode all fio JSON objects in a complete output
+- iter_session_fio_json: Run fio in a session, yield its JSON objects as
+                         soon as they are printed
+- get_job_iops: Get the read and write IOPS of a job from a fio JSON object
+"""
+
+import json
+import logging
+import re
+import time
+
+import aexpect
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+# fio prints the opening brace of a JSON object at the beginning of a line
+_OBJECT_BEGIN = re.compile(r"^\{", re.M)
+_STRUCT_CHAR = re.compile(r'[{}"]')
+_STRING_CHAR = re.compile(r'["\\]')
+
+
+class FioJSONDecoder(object):
+    """
+    Decode fio JSON objects from chunks of output
+
+    The end of an object is found by a scanner that keeps its state
+    (depth, inside a string) across chunks, so every char is scanned only
+    once, then the object is decoded by json.JSONDecoder.raw_decode.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        """
+        Feed a chunk of output
+
+        :param data: output string
+        :return: list of the objects completed by the chunk
+        """
+        buf = self._buffer + data
+        pos = self._pos
+        objects = []
+        while True:
+            if self._start is None:
+                match = _OBJECT_BEGIN.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                self._start, self._depth, pos = match.start(), 1, match.end()
+                continue
+
+            if self._in_string:
+                match = _STRING_CHAR.search(buf, pos)
+                if match is None:
+                    # pos is beyond the end if the escaped char is to come
+                    pos = max(pos, len(buf))
+                    break
+                if match.group() == "\\":
+                    # skip the escaped char
+                    pos = match.end() + 1
+                else:
+                    self._in_string = False
+                    pos = match.end()
+                continue
+
+            match = _STRUCT_CHAR.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        obj = self._decoder.raw_decode(buf, self._start)[0]
+                    except ValueError as err:
+                        LOG_JOB.debug("Skip non fio JSON output: %s", err)
+                        # look for an object inside the broken one
+                        pos = self._start + 1
+                    else:
+                        objects.append(obj)
+                    self._start = None
+
+        # only keep the unfinished object, or the last char to know if
+        # the next chunk begins a new line
+        if self._start is None:
+            keep = max(min(pos, len(buf)) - 1, 0)
+        else:
+            keep = self._start
+        self._buffer = buf[keep:]
+        self._pos = pos - keep
+        if self._start is not None:
+            self._start = 0
+        return objects
+
+
+def parse_fio_json(output):
+    """
+    Decode all fio JSON objects in a complete output
+
+    :param output: fio output with option --output-format=json
+    :return: list of the JSON objects
+    """
+    return FioJSONDecoder().feed(output)
+
+
+def iter_session_fio_json(session, cmd, timeout=1800, internal_timeout=0.5):
+    """
+    Run fio in the session and yield its JSON objects as they are printed,
+    closing the generator before fio exits interrupts fio by Ctrl-C.
+    The exit status of fio is checked once it exits by itself.
+
+    :param session: aexpect ShellSession object
+    :param cmd: fio command line with option --output-format=json
+    :param timeout: timeout for fio to finish
+    :param internal_timeout: the time without output to end a read
+    :raise aexpect.ShellTimeoutError: fio not finished in timeout
+    :raise aexpect.ShellCmdError: fio exited with a non-zero status
+    """
+    decoder = FioJSONDecoder()
+    prompt = re.compile(session.prompt)
+    tail = ""
+    # the last lines of output for the error message
+    last_lines = []
+    finished = False
+    session.read_nonblocking(0, timeout)
+    LOG_JOB.debug("Sending command: %s", cmd)
+    session.sendline(cmd)
+    end_time = time.time() + timeout
+    try:
+        while True:
+            data = session.read_nonblocking(internal_timeout, end_time - time.time())
+            for obj in decoder.feed(data):
+                yield obj
+            lines = [line for line in (tail + data).splitlines() if line.strip()]
+            last_lines = (last_lines[:-1] + lines)[-20:]
+            if lines and prompt.search(lines[-1]):
+                finished = True
+                last_lines.pop()
+                break
+            tail = "\n".join(lines[-1:])
+            if time.time() > end_time:
+                raise aexpect.ShellTimeoutError(cmd, tail)
+    finally:
+        if not finished:
+            session.sendcontrol("c")
+            session.read_up_to_prompt(timeout=60)
+
+    output = session.cmd_output(session.status_test_command, timeout=60)
+    status = re.findall(r"^\s*(\d+)\s*$", output, re.M)
+    if not status:
+        raise aexpect.ShellStatusError(cmd, output)
+    if int(status[-1]) != 0:
+        raise aexpect.ShellCmdError(cmd, int(status[-1]), "\n".join(last_lines))
+
+
+def get_job_iops(obj, index=0):
+    """
+    Get the read and write IOPS of a job from a fio JSON object
+
+    :param obj: fio JSON object
+    :param index: job index
+    :return: tuple of (read iops, write iops)
+    """
+    job = obj["jobs"][index]
+    return job["read"]["iops"], job["write"]["iops"]
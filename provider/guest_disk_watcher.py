@@ -0,0 +1,223 @@
+"""
+Module for watching the disks added and removed in a guest.
+
+Listing the disks of a guest takes a new login and a run of ls or wmic,
+so polling the list until the plugging of many disks is done takes
+minutes. GuestDiskWatcher lists the disks once, then keeps a command
+running in a dedicated session, "udevadm monitor" on Linux or a WMI event
+subscription of PowerShell on Windows, and updates the disks from the
+lines of the command as soon as they are received, together with the
+time of every change.
+
+Available classes:
+- GuestDiskWatcher: Watch the disks added and removed in a guest
+
+Available functions:
+- get_disk_watcher: Get the running disk watcher shared by the users of a VM
+- stop_disk_watcher: Stop the disk watcher of a VM
+"""
+
+import base64
+import logging
+import re
+import threading
+import time
+
+from virttest import utils_misc
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+ADD, REMOVE = ("add", "remove")
+
+LINUX_WATCH_CMD = "udevadm monitor --udev --subsystem-match=block"
+LINUX_READY = "monitor will print the received events"
+# UDEV  [1234.567890] add      /devices/.../block/vdb (block)
+# the disks are the ones listed by utils_misc.list_linux_guest_disks
+LINUX_EVENT_RE = re.compile(
+    r"^UDEV\s+\[[\d.]+\]\s+(add|remove)\s+\S*/block/([vhs]d[a-z]+)\s+\(block\)"
+)
+
+WIN_LIST_CMD = "wmic diskdrive get index"
+WIN_READY = "DISK_WATCHER_READY"
+WIN_WATCH_SCRIPT = """
+$query = "SELECT * FROM __InstanceOperationEvent WITHIN 1 " +
+         "WHERE TargetInstance ISA 'Win32_DiskDrive'"
+Register-WmiEvent -Query $query -SourceIdentifier disks | Out-Null
+Write-Host 'DISK_WATCHER_READY'
+while ($true) {
+    $received = Wait-Event -SourceIdentifier disks
+    $instance = $received.SourceEventArgs.NewEvent
+    Write-Host ('DISK ' + $instance.__CLASS + ' ' + $instance.TargetInstance.Index)
+    Remove-Event -EventIdentifier $received.EventIdentifier
+}
+"""
+WIN_EVENT_RE = re.compile(r"^DISK __Instance(Creation|Deletion)Event (\d+)")
+WIN_ACTIONS = {"Creation": ADD, "Deletion": REMOVE}
+
+
+class GuestDiskWatcher(object):
+    """Watch the disks added and removed in a guest by a long-lived command"""
+
+    def __init__(self, vm, login_timeout=360):
+        """
+        :param vm: VM object
+        :param login_timeout: timeout of the login of the watching session
+        """
+        self.vm = vm
+        self._login_timeout = login_timeout
+        self._iswindows = vm.params["os_type"] == "windows"
+        self._session = None
+        self._cond = threading.Condition()
+        self._ready = False
+        self._disks = set()
+        self._changes = []
+
+    def _on_line(self, line):
+        line = line.strip()
+        with self._cond:
+            if not self._ready:
+                if (WIN_READY if self._iswindows else LINUX_READY) in line:
+                    self._ready = True
+                    self._cond.notify_all()
+                return
+            match = (WIN_EVENT_RE if self._iswindows else LINUX_EVENT_RE).match(line)
+            if not match:
+                return
+            action, disk = match.groups()
+            if self._iswindows:
+                action = WIN_ACTIONS[action]
+            else:
+                disk = "/dev/%s" % disk
+            if action == ADD:
+                self._disks.add(disk)
+            else:
+                self._disks.discard(disk)
+            self._changes.append((time.time(), action, disk))
+            self._cond.notify_all()
+
+    def _watch_cmd(self):
+        if not self._iswindows:
+            return LINUX_WATCH_CMD
+        script = base64.b64encode(WIN_WATCH_SCRIPT.encode("utf-16-le"))
+        return "powershell -NoProfile -EncodedCommand %s" % script.decode()
+
+    def start(self, timeout=60):
+        """
+        List the disks and start watching their changes
+
+        :param timeout: timeout of the watching command to get ready
+        :return: True if the watching command is ready
+        """
+        session = self.vm.wait_for_login(timeout=self._login_timeout)
+        if self._iswindows:
+            disks = set(session.cmd(WIN_LIST_CMD).split()[1:])
+        else:
+            disks = utils_misc.list_linux_guest_disks(session)
+        with self._cond:
+            self._ready = False
+            self._disks = disks
+            self._changes = []
+        self._session = session
+        session.set_output_func(self._on_line)
+        session.set_output_params(tuple())
+        session.sendline(self._watch_cmd())
+        if not self.wait_for(lambda disks: self._ready, timeout):
+            LOG_JOB.warning("Failed to watch the disks of %s", self.vm.name)
+            self.stop()
+            return False
+        LOG_JOB.debug("Watching the disks of %s: %s", self.vm.name, sorted(disks))
+        return True
+
+    def stop(self):
+        """Stop watching and close the session"""
+        session, self._session = self._session, None
+        if session is None:
+            return
+        try:
+            if session.is_alive():
+                session.sendcontrol("c")
+            session.close()
+        finally:
+            # the session wants output_func to be serializable
+            session.set_output_func(None)
+
+    def is_alive(self):
+        return self._session is not None and self._session.is_alive()
+
+    @property
+    def disks(self):
+        """The disks in the guest now"""
+        with self._cond:
+            return set(self._disks)
+
+    def changes(self, since=0):
+        """
+        Get the changes of the disks
+
+        :param since: time.time() of the earliest change
+        :return: list of (time.time() of receiving, "add" or "remove", disk)
+        """
+        with self._cond:
+            return [change for change in self._changes if change[0] >= since]
+
+    def wait_for(self, func, timeout, step=1.0):
+        """
+        Wait for the disks to meet a condition, it is checked whenever they
+        change
+
+        :param func: callable of the set of the disks
+        :param timeout: timeout in seconds
+        :param step: max interval between two checks of the session
+        :return: True if the condition is met, False for the timeout or the
+                 session terminated
+        """
+        end_time = time.time() + timeout
+        with self._cond:
+            while not func(set(self._disks)):
+                remaining = end_time - time.time()
+                if remaining <= 0 or not self.is_alive():
+                    return False
+                self._cond.wait(min(step, remaining))
+        return True
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def get_disk_watcher(vm):
+    """
+    Get the disk watcher shared by all the users of the VM, a new watcher
+    is started when the former one terminated, e.g. the guest rebooted.
+    The watcher keeps running until stop_disk_watcher() is called, so the
+    test registers it to be called at its exit.
+
+    :param vm: VM object
+    :return: GuestDiskWatcher object, None if the disks can not be watched
+    """
+    with _watchers_lock:
+        watcher = _watchers.get(vm.name)
+        if watcher is not None and watcher.vm is vm and watcher.is_alive():
+            return watcher
+        if watcher is not None:
+            watcher.stop()
+        watcher = GuestDiskWatcher(vm)
+        if not watcher.start():
+            _watchers.pop(vm.name, None)
+            return None
+        _watchers[vm.name] = watcher
+        return watcher
+
+
+def stop_disk_watcher(vm):
+    """
+    Stop the disk watcher of the VM and drop it, do nothing if there is no
+    watcher
+
+    :param vm: VM object
+    """
+    with _watchers_lock:
+        watcher = _watchers.pop(vm.name, None)
+    if watcher is not None:
+        LOG_JOB.debug("Stop watching the disks of %s", vm.name)
+        watcher.stop()
@@ -1,6 +1,10 @@
+import base64
+import binascii
 import json
 import logging
 import os
+import struct
+import time
 from queue import Queue
 
 from virttest import data_dir, utils_misc
@@ -16,6 +20,7 @@ class AgentMessageType:
 
     SYNC = "SYNC"
     INFO = "INFO"
+    CODES = "CODES"
     READY = "READY"
     EVENT = "EVENT"
     ERROR = "ERROR"
@@ -31,6 +36,10 @@ class AgentState:
 
 EventTypeKey = "type"
 DevNameKey = "device"
+# time.time() of the host when the event was received
+EventTimeKey = "time"
+# seconds from the event in the guest kernel to its sending by the agent
+GuestDelayKey = "guestDelay"
 
 
 class EventType:
@@ -71,6 +80,7 @@ class _EventListener(object):
 
     agent_source = ""
     agent_target = ""
+    agent_args = ""
     python_bin = ""
 
     def __init__(self, vm):
@@ -103,8 +113,8 @@ class _EventListener(object):
         self._agent_sh = self._vm.wait_for_login()
         self._agent_sh.set_output_func(self._parse_output)
         self._agent_sh.set_output_params(tuple())
-        cmd = " ".join((self.python_bin, self.agent_target))
-        self._agent_sh.sendline(cmd)
+        cmd = " ".join((self.python_bin, self.agent_target, self.agent_args))
+        self._agent_sh.sendline(cmd.strip())
 
     def _terminate(self):
         """Terminate the agent."""
@@ -153,6 +163,8 @@ class _EventListener(object):
             self._agent_state = AgentState.GREETING
         elif mtype == AgentMessageType.INFO:
             self._report_info(content)
+        elif mtype == AgentMessageType.CODES:
+            self._report_codes(content)
         elif mtype == AgentMessageType.READY:
             self._agent_state = AgentState.LISTENING
         elif mtype == AgentMessageType.EVENT:
@@ -168,6 +180,10 @@ class _EventListener(object):
         info = content["info"]
         self.targets[dev] = info
 
+    def _report_codes(self, content):
+        """Report the names of the event codes."""
+        pass
+
     def _report_error(self, content):
         """Report errors."""
         pass
@@ -177,6 +193,39 @@ class _EventListener(object):
         raise NotImplementedError()
 
 
+# evdev event types and codes handled by EventListenerLinux
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_REL = 0x02
+EV_ABS = 0x03
+EV_MSC = 0x04
+EV_LED = 0x11
+EV_REP = 0x14
+SYN_REPORT = 0x00
+MSC_SCAN = 0x04
+# pointer axes, by type and code
+POINTER_AXES = {
+    (EV_REL, 0x00): PointerEventData.XPOS,  # REL_X
+    (EV_REL, 0x01): PointerEventData.YPOS,  # REL_Y
+    (EV_ABS, 0x00): PointerEventData.XPOS,  # ABS_X
+    (EV_ABS, 0x01): PointerEventData.YPOS,  # ABS_Y
+}
+# wheels, by type and code, and if they scroll horizontally
+WHEELS = {
+    (EV_REL, 0x06): 1,  # REL_HWHEEL
+    (EV_REL, 0x08): 0,  # REL_WHEEL
+    (EV_ABS, 0x08): 0,  # ABS_WHEEL
+}
+
+# "FRAMES <device> <base64 data>" lines of the agent started with --batch,
+# data is a sequence of frames of a header and the raw input_event records
+# up to a SYN_REPORT
+FRAMES_PREFIX = "FRAMES "
+FRAME_HDR = struct.Struct("=BdH")
+# struct input_event of 64 and 32 bits guests
+EVENT_RECORDS = {24: struct.Struct("=qqHHI"), 16: struct.Struct("=iiHHI")}
+
+
 class EventListenerLinux(_EventListener):
     """Linux implementation for the event listener class."""
 
@@ -191,8 +240,22 @@ class EventListenerLinux(_EventListener):
     WHEELBACKWARD = 0xFFFFFFFF
 
     def __init__(self, vm):
-        super(EventListenerLinux, self).__init__(vm)
+        # the agent reports the devices as soon as it is launched
         self._buffers = {}
+        self._codes = {}
+        self._handlers = {
+            EV_SYN: self._on_syn,
+            EV_KEY: self._on_key,
+            EV_REL: self._on_axis,
+            EV_ABS: self._on_axis,
+            EV_MSC: self._on_msc,
+            # TODO: handle EV_LED and EV_REP events when necessary
+            EV_LED: None,
+            EV_REP: None,
+        }
+        if vm.params.get("input_event_batch", "yes") == "yes":
+            self.agent_args = "--batch"
+        super(EventListenerLinux, self).__init__(vm)
 
     def _uninstall(self):
         cmd = " ".join(("rm", "-f", self.agent_target))
@@ -203,78 +266,107 @@ class EventListenerLinux(_EventListener):
         dev = content["device"]
         self._buffers[dev] = {}
 
+    def _report_codes(self, content):
+        self._codes = dict(
+            (int(etype), dict((int(code), name) for code, name in codes.items()))
+            for etype, codes in content.items()
+        )
+
+    def _parse_output(self, line):
+        if line.startswith(FRAMES_PREFIX):
+            self._parse_frames(line)
+        else:
+            super(EventListenerLinux, self)._parse_output(line)
+
+    def _parse_frames(self, line):
+        """Parse the frames of raw events sent by the agent in batch mode."""
+        now = time.time()
+        try:
+            _, dev, encoded = line.split(None, 2)
+            data = base64.b64decode(encoded)
+        except (ValueError, binascii.Error):
+            # garbage line, skip it
+            return
+        offset = 0
+        while offset + FRAME_HDR.size <= len(data):
+            rec_size, sent, count = FRAME_HDR.unpack_from(data, offset)
+            offset += FRAME_HDR.size
+            end = offset + rec_size * count
+            record = EVENT_RECORDS.get(rec_size)
+            if record is None or end > len(data):
+                LOG_JOB.error("Input event listener received a broken frame")
+                return
+            for tv_sec, tv_usec, etype, code, value in record.iter_unpack(
+                data[offset:end]
+            ):
+                self._dispatch(
+                    dev, etype, code, value, now, sent - tv_sec - tv_usec / 1e6
+                )
+            offset = end
+
     def _parse_platform_event(self, content):
-        dev = content["device"]
         nevent = content["event"]
-        etype = nevent["typeName"]
-        value = nevent["value"]
+        # the names of the codes come with the events in JSON lines
+        codes = self._codes.setdefault(nevent["typeNum"], {})
+        codes[nevent["codeNum"]] = nevent["codeName"]
+        self._dispatch(
+            content["device"],
+            nevent["typeNum"],
+            nevent["codeNum"],
+            nevent["value"],
+            time.time(),
+        )
+
+    def _dispatch(self, dev, etype, code, value, received, delay=None):
         ebuf = self._buffers[dev]
-        if etype == "EV_SYN":
-            subtype = nevent["codeName"]
-            if subtype == "SYN_REPORT":
-                # end of event, report it
-                ebuf[DevNameKey] = dev
-                self.events.put(ebuf)
-                ebuf = {EventTypeKey: EventType.UNKNOWN}
-        elif etype == "EV_KEY":
-            keycode = nevent["codeName"]
-            if value == self.KEYDOWN:
-                mtype = EventType.KEYDOWN
-            elif value == self.KEYUP:
-                mtype = EventType.KEYUP
-            else:
-                mtype = value
-            if mtype:
-                ebuf[EventTypeKey] = mtype
-            ebuf[KeyEventData.KEYCODE] = keycode
-        elif etype == "EV_REL":
-            subtype = nevent["codeName"]
-            if subtype in ("REL_X", "REL_Y"):
-                ebuf[EventTypeKey] = EventType.POINTERMOVE
-                if subtype.endswith("X"):
-                    ebuf[PointerEventData.XPOS] = value
-                else:  # 'Y'
-                    ebuf[PointerEventData.YPOS] = value
-                ebuf[PointerEventData.ABS] = 0
-            elif subtype in ("REL_HWHEEL", "REL_WHEEL"):
-                if value == self.WHEELFORWARD:
-                    ebuf[EventTypeKey] = EventType.WHEELFORWARD
-                elif value == self.WHEELBACKWARD:
-                    ebuf[EventTypeKey] = EventType.WHEELBACKWARD
-                if subtype.endswith("HWHEEL"):
-                    ebuf[WheelEventData.HSCROLL] = 1
-                else:
-                    ebuf[WheelEventData.HSCROLL] = 0
-                ebuf[WheelEventData.ABS] = 0
-        elif etype == "EV_ABS":
-            subtype = nevent["codeName"]
-            if subtype in ("ABS_X", "ABS_Y"):
-                ebuf[EventTypeKey] = EventType.POINTERMOVE
-                if subtype.endswith("X"):
-                    ebuf[PointerEventData.XPOS] = value
-                else:  # 'Y'
-                    ebuf[PointerEventData.YPOS] = value
-                ebuf[PointerEventData.ABS] = 1
-            elif subtype == "ABS_WHEEL":
-                if value == self.WHEELFORWARD:
-                    ebuf[EventTypeKey] = EventType.WHEELFORWARD
-                elif value == self.WHEELBACKWARD:
-                    ebuf[EventTypeKey] = EventType.WHEELBACKWARD
-                ebuf[WheelEventData.HSCROLL] = 0
-                ebuf[WheelEventData.ABS] = 1
-        elif etype == "EV_MSC":
-            subtype = nevent["codeName"]
-            if subtype == "MSC_SCAN":
-                ebuf[KeyEventData.SCANCODE] = value
-        elif etype == "EV_LED":
-            # TODO: handle this kind of events when necessary
-            pass
-        elif etype == "EV_REP":
-            # FIXME: handle this kind of events
-            pass
-        else:
+        try:
+            handler = self._handlers[etype]
+        except KeyError:
             ebuf[EventTypeKey] = EventType.UNKNOWN
-        self._buffers[dev] = ebuf
+            return
+        if handler:
+            handler(dev, ebuf, etype, code, value, received, delay)
+
+    def _on_syn(self, dev, ebuf, etype, code, value, received, delay):
+        if code != SYN_REPORT:
+            return
+        # end of event, report it
+        ebuf[DevNameKey] = dev
+        ebuf[EventTimeKey] = received
+        if delay is not None:
+            ebuf[GuestDelayKey] = delay
+        self.events.put(ebuf)
+        self._buffers[dev] = {EventTypeKey: EventType.UNKNOWN}
+
+    def _on_key(self, dev, ebuf, etype, code, value, received, delay):
+        if value == self.KEYDOWN:
+            mtype = EventType.KEYDOWN
+        elif value == self.KEYUP:
+            mtype = EventType.KEYUP
+        else:
+            mtype = value
+        if mtype:
+            ebuf[EventTypeKey] = mtype
+        ebuf[KeyEventData.KEYCODE] = self._codes.get(etype, {}).get(code, "UNKNOWN")
+
+    def _on_axis(self, dev, ebuf, etype, code, value, received, delay):
+        absolute = int(etype == EV_ABS)
+        axis = POINTER_AXES.get((etype, code))
+        if axis:
+            ebuf[EventTypeKey] = EventType.POINTERMOVE
+            ebuf[axis] = value
+            ebuf[PointerEventData.ABS] = absolute
+        elif (etype, code) in WHEELS:
+            if value == self.WHEELFORWARD:
+                ebuf[EventTypeKey] = EventType.WHEELFORWARD
+            elif value == self.WHEELBACKWARD:
+                ebuf[EventTypeKey] = EventType.WHEELBACKWARD
+            ebuf[WheelEventData.HSCROLL] = WHEELS[(etype, code)]
+            ebuf[WheelEventData.ABS] = absolute
+
+    def _on_msc(self, dev, ebuf, etype, code, value, received, delay):
+        if code == MSC_SCAN:
+            ebuf[KeyEventData.SCANCODE] = value
 
 
 # XXX: we may need different map tables for different keyboard layouts,
@@ -548,6 +640,7 @@ class EventListenerWin(_EventListener):
             event[PointerEventData.YPOS] = ypos
         event[EventTypeKey] = mtype
         event[DevNameKey] = dev
+        event[EventTimeKey] = time.time()
         self.events.put(event)
 
 
@@ -25,6 +25,49 @@ def get_keycode_cfg(filename):
         return json.load(f)
 
 
+def event_latency(events, sent):
+    """
+    Get the end to end latency of an input, from sending it to the guest
+    to receiving its first event from the agent in the guest.
+
+    :param events: events received for the input.
+    :param sent: time.time() when the input was sent.
+    :return: latency in seconds, None if no event has the receiving time.
+    """
+    times = [
+        event[input_event_proxy.EventTimeKey]
+        for event in events
+        if input_event_proxy.EventTimeKey in event
+    ]
+    return min(times) - sent if times else None
+
+
+def check_input_latency(test, params, latencies):
+    """
+    Log the latency of the inputs and check it against max_input_latency,
+    the max latency in milliseconds, if it is set.
+
+    :param test: kvm test object
+    :param params: Dictionary with the test parameters
+    :param latencies: latencies in seconds, None if not measured.
+    """
+    values = sorted(v * 1000 for v in latencies if v is not None)
+    if not values:
+        return
+    LOG_JOB.info(
+        "Input latency of %d inputs: min %.1fms, median %.1fms, max %.1fms",
+        len(values),
+        values[0],
+        values[len(values) // 2],
+        values[-1],
+    )
+    max_latency = params.get_numeric("max_input_latency", 0, float)
+    if max_latency and values[-1] > max_latency:
+        test.fail(
+            "Input latency %.1fms is beyond the limit %sms" % (values[-1], max_latency)
+        )
+
+
 @error_context.context_aware
 def key_tap_test(test, params, console, listener, wait_time):
     """
@@ -36,12 +79,15 @@ def key_tap_test(test, params, console, listener, wait_time):
     :param listener: listening the mouse button event in guest.
     :param keys_file: a file include all tested keys.
     :param wait_time: wait event received in listener event queue.
+    :return: latencies of the key taps in seconds.
     """
 
     keys_file = params.get("key_table_file")
     keys_dict = get_keycode_cfg(keys_file)
+    latencies = []
     for key in keys_dict.keys():
         error_context.context("Send %s key tap event" % key, LOG_JOB.info)
+        sent = time.time()
         console.key_tap(key)
         time.sleep(wait_time)
 
@@ -53,11 +99,14 @@ def key_tap_test(test, params, console, listener, wait_time):
         exp_events = [(keycode, "KEYDOWN"), (keycode, "KEYUP")]
         event_queue = listener.events
         key_events = []
+        received = []
         while not event_queue.empty():
             event = event_queue.get()
             if event["type"] == "POINTERMOVE":
                 continue
             key_events.append((event["keyCode"], event["type"]))
+            received.append(event)
+        latencies.append(event_latency(received, sent))
 
         if key_events != exp_events:
             test.fail(
@@ -65,6 +114,7 @@ def key_tap_test(test, params, console, listener, wait_time):
                 "Received key event as: %s\n Expected event as: %s"
                 % (key_events, exp_events)
             )
+    return latencies
 
 
 @error_context.context_aware
@@ -78,6 +128,7 @@ def mouse_btn_test(test, params, console, listener, wait_time):
     :param console: graphical console.
     :param listener: listening the mouse button event in guest.
     :param wait_time: wait event received in listener event queue.
+    :return: latencies of the clicks in seconds.
     """
     mouse_btn_map = {
         "left": "BTN_LEFT",
@@ -87,8 +138,10 @@ def mouse_btn_test(test, params, console, listener, wait_time):
         "extra": "BTN_EXTRA",
     }
     btns = params.objects("btns")
+    latencies = []
     for btn in btns:
         error_context.context("Click mouse %s button" % btn, LOG_JOB.info)
+        sent = time.time()
         console.btn_click(btn)
 
         keycode = mouse_btn_map[btn]
@@ -96,6 +149,7 @@ def mouse_btn_test(test, params, console, listener, wait_time):
         time.sleep(wait_time)
         events_queue = listener.events
         btn_event = list()
+        received = []
 
         error_context.context("Check correct button event is received", LOG_JOB.info)
         while not events_queue.empty():
@@ -105,6 +159,8 @@ def mouse_btn_test(test, params, console, listener, wait_time):
             if events["type"] == "POINTERMOVE":
                 continue
             btn_event.append((events["keyCode"], events["type"]))
+            received.append(events)
+        latencies.append(event_latency(received, sent))
 
         if btn_event != exp_events:
             test.fail(
@@ -112,6 +168,7 @@ def mouse_btn_test(test, params, console, listener, wait_time):
                 "Received btn events as: %s\n Expected events as: %s"
                 % (btn_event, exp_events)
             )
+    return latencies
 
 
 @error_context.context_aware
@@ -125,11 +182,14 @@ def mouse_scroll_test(test, params, console, listener, wait_time, count=1):
     :param listener: listening the mouse button event in guest.
     :param wait_time: wait event received in listener event queue.
     :param count: wheel event counts, default count=1.
+    :return: latencies of the scrolls in seconds.
     """
     scrolls = params.objects("scrolls")
     exp_events = {"wheel-up": ("WHEELFORWARD", 0), "wheel-down": ("WHEELBACKWARD", 0)}
+    latencies = []
     for scroll in scrolls:
         error_context.context("Scroll mouse %s" % scroll, LOG_JOB.info)
+        sent = time.time()
         if "up" in scroll:
             console.scroll_forward(count)
         else:
@@ -140,6 +200,7 @@ def mouse_scroll_test(test, params, console, listener, wait_time, count=1):
         error_context.context("Check correct scroll event is received", LOG_JOB.info)
         exp_event = exp_events.get(scroll)
         samples = []
+        received = []
         while not events_queue.empty():
             event = events_queue.get()
             # some windows os will return pointer move event first
@@ -147,6 +208,8 @@ def mouse_scroll_test(test, params, console, listener, wait_time, count=1):
             if event["type"] == "POINTERMOVE":
                 continue
             samples.append((event["type"], event["hScroll"]))
+            received.append(event)
+        latencies.append(event_latency(received, sent))
 
         counter = Counter(samples)
         num = counter.pop(exp_event, 0)
@@ -161,6 +224,7 @@ def mouse_scroll_test(test, params, console, listener, wait_time, count=1):
                 "Received scroll events as: %s\n Expected events as: %s"
                 % (counter, exp_event)
             )
+    return latencies
 
 
 @error_context.context_aware
@@ -286,9 +350,10 @@ def keyboard_test(test, params, vm, wait_time):
     """
     console = graphical_console.GraphicalConsole(vm)
     listener = input_event_proxy.EventListener(vm)
-    key_tap_test(test, params, console, listener, wait_time)
+    latencies = key_tap_test(test, params, console, listener, wait_time)
     listener.clear_events()
     listener.cleanup()
+    check_input_latency(test, params, latencies)
 
 
 def mouse_test(test, params, vm, wait_time, count=1):
@@ -310,8 +375,10 @@ def mouse_test(test, params, vm, wait_time, count=1):
     if not mice_info["current"]:
         test.fail("%s does not worked currently" % mice_name)
 
-    mouse_btn_test(test, params, console, listener, wait_time)
-    mouse_scroll_test(test, params, console, listener, wait_time, count=count)
+    latencies = mouse_btn_test(test, params, console, listener, wait_time)
+    latencies += mouse_scroll_test(
+        test, params, console, listener, wait_time, count=count
+    )
     if not params.get("target_pos", None):
         width, height = console.screen_size
         x_max, y_max = width - 1, height - 1
@@ -323,3 +390,4 @@ def mouse_test(test, params, vm, wait_time, count=1):
         mouse_move_test(test, params, console, listener, wait_time, end_pos, absolute)
     listener.clear_events()
     listener.cleanup()
+    check_input_latency(test, params, latencies)
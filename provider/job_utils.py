@@ -2,7 +2,9 @@ import logging
 import time
 
 from avocado import fail_on
-from virttest import utils_misc
+from virttest import qemu_monitor, utils_misc
+
+from provider import qmp_event_index
 
 LOG_JOB = logging.getLogger("avocado.test")
 
@@ -10,6 +12,8 @@ BLOCK_JOB_COMPLETED_EVENT = "BLOCK_JOB_COMPLETED"
 BLOCK_JOB_CANCELLED_EVENT = "BLOCK_JOB_CANCELLED"
 BLOCK_JOB_ERROR_EVENT = "BLOCK_JOB_ERROR"
 BLOCK_IO_ERROR_EVENT = "BLOCK_IO_ERROR"
+BLOCK_JOB_READY_EVENT = "BLOCK_JOB_READY"
+JOB_STATUS_CHANGE_EVENT = "JOB_STATUS_CHANGE"
 
 
 def get_job_status(vm, device):
@@ -41,41 +45,228 @@ def wait_until_job_status_match(vm, status, device, timeout):
     assert matched, "wait job status to '%s' timeout in %s seconds" % (status, timeout)
 
 
-@fail_on
-def wait_until_block_job_completed(vm, job_id, timeout=900):
-    """Block until block job completed"""
+class BlockJobTracker(object):
+    """
+    Track the state of block jobs by following the QMP event stream
+
+    JOB_STATUS_CHANGE, BLOCK_JOB_READY, BLOCK_JOB_COMPLETED and
+    BLOCK_JOB_CANCELLED events are consumed only once from the shared
+    QMP event index of the VM, the state of every tracked job is kept in
+    a table indexed by job id, so many jobs can be waited for with a
+    single deadline instead of polling 'query-jobs' job by job.
+
+    Jobs are finalized when pending (auto-finalize off), completed when
+    ready and dismissed when concluded (auto-dismiss off), in the same
+    way as wait_until_block_job_completed does. The retained events only
+    rebuild the job table, commands are sent for the live job states.
+    """
 
-    def _wait_until_block_job_completed():
-        finished = False
-        status = get_job_status(vm, job_id)
-        if status == "pending":
-            block_job_finalize(vm, job_id)
-        if status == "ready":
+    def __init__(self, vm, job_ids=None, complete_ready=True):
+        """
+        :param vm: VM or QSD object with a QMP monitor
+        :param job_ids: list of job IDs to track
+        :param complete_ready: send 'job-complete' once a job is ready
+        """
+        self._vm = vm
+        self._index = qmp_event_index.get_event_index(vm)
+        self._listening = False
+        self._replaying = False
+        self._complete_ready = complete_ready
+        self._jobs = dict()
+        for job_id in job_ids or []:
+            self.track(job_id)
+
+    def track(self, job_id):
+        """Start tracking the job, it's a no-op for a tracked job"""
+        if job_id not in self._jobs:
+            self._jobs[job_id] = self._new_job_state()
+
+    @staticmethod
+    def _new_job_state():
+        return {
+            "status": None,
+            "handled": None,
+            "completed": False,
+            "cancelled": False,
+            "error": None,
+            "auto-finalize": True,
+            "auto-dismiss": True,
+        }
+
+    def get_state(self, job_id):
+        """Get the tracked state dict of the job"""
+        return self._jobs[job_id]
+
+    def refresh(self):
+        """
+        Synchronize the job table with a single 'query-block-jobs', so that
+        state changes happened before tracking are not missed
+
+        Only the jobs still listed are acted on, a job missing from the
+        list has already been finalized and dismissed.
+        """
+        live = set()
+        for job in query_block_jobs(self._vm):
+            state = self._jobs.get(job["device"])
+            if state is None:
+                continue
+            live.add(job["device"])
+            state["status"] = job.get("status", state["status"])
+            state["auto-finalize"] = job.get("auto-finalize", True)
+            state["auto-dismiss"] = job.get("auto-dismiss", True)
+        for job_id, state in self._jobs.items():
+            if job_id in live:
+                self._handle(job_id)
+            else:
+                state["handled"] = state["status"]
+
+    def start(self):
+        """
+        Rebuild the job table from the retained events, without sending
+        any command, and follow the new ones
+        """
+        if not self._listening:
+            self._replaying = True
             try:
-                arguments = {"id": job_id}
-                vm.monitor.cmd("job-complete", arguments)
+                self._index.add_listener(self._consume, replay=True)
+            finally:
+                self._replaying = False
+            self._listening = True
+
+    def stop(self):
+        """Stop following the events"""
+        if self._listening:
+            self._index.remove_listener(self._consume)
+            self._listening = False
+
+    def poll(self):
+        """Consume the new events and act on the jobs whose state changed"""
+        self._index.update()
+
+    def _consume(self, event):
+        name = event.get("event")
+        data = event.get("data", dict())
+        job_id = data.get("id", data.get("device"))
+        state = self._jobs.get(job_id)
+        if state is None:
+            return
+
+        if name == JOB_STATUS_CHANGE_EVENT:
+            if data.get("status") == "created":
+                # the job ID is reused by a new job
+                options = (state["auto-finalize"], state["auto-dismiss"])
+                state.update(self._new_job_state())
+                state["auto-finalize"], state["auto-dismiss"] = options
+            state["status"] = data.get("status")
+        elif name == BLOCK_JOB_READY_EVENT:
+            if state["status"] in [None, "running"]:
+                state["status"] = "ready"
+        elif name == BLOCK_JOB_COMPLETED_EVENT:
+            state["completed"] = True
+            state["error"] = data.get("error")
+        elif name == BLOCK_JOB_CANCELLED_EVENT:
+            state["cancelled"] = True
+        else:
+            return
+        if not self._replaying:
+            self._handle(job_id)
+
+    def _handle(self, job_id):
+        state = self._jobs[job_id]
+        status = state["status"]
+        if status == state["handled"]:
+            return
+        state["handled"] = status
+
+        if status == "pending" and state["auto-finalize"] is False:
+            self._job_cmd("job-finalize", job_id)
+        elif status == "ready" and self._complete_ready:
+            try:
+                self._vm.monitor.cmd("job-complete", {"id": job_id})
             except Exception as err:
-                LOG_JOB.debug("'job-complete' hit error: %s", err.data["desc"])
+                LOG_JOB.debug("'job-complete' hit error: %s", err)
+        elif status == "concluded" and state["auto-dismiss"] is False:
+            self._job_cmd("job-dismiss", job_id)
+
+    def _job_cmd(self, cmd, job_id):
+        """
+        Send job-finalize/job-dismiss, the job may already have left the
+        state, e.g. finalized or dismissed by the test itself
+        """
+        try:
+            self._vm.monitor.cmd(cmd, {"id": job_id})
+        except qemu_monitor.QMPCmdError as err:
+            job = get_job_by_id(self._vm, job_id)
+            if job.get("status") == self._jobs[job_id]["status"]:
+                raise
+            LOG_JOB.debug("'%s' of job %s skipped: %s", cmd, job_id, err)
+
+    def is_finished(self, job_id):
+        """
+        The job is finished when its BLOCK_JOB_COMPLETED event arrived
+        and it has been dismissed if auto-dismiss is off
+        """
+        state = self._jobs[job_id]
+        if not state["completed"]:
+            return False
+        return state["auto-dismiss"] is not False or state["status"] == "null"
+
+    @fail_on
+    def wait_completed(self, job_ids=None, timeout=900, interval=0.1):
+        """
+        Block until all the given jobs completed
+
+        :param job_ids: list of job IDs, all tracked jobs by default
+        :param timeout: the deadline shared by all jobs
+        :param interval: the interval between two event checks
+        """
+        job_ids = list(self._jobs) if job_ids is None else job_ids
+        for job_id in job_ids:
+            self.track(job_id)
+        self.start()
+        self.refresh()
+
+        end_time = time.time() + timeout
         try:
-            for event in vm.monitor.get_events():
-                if event.get("event") != BLOCK_JOB_COMPLETED_EVENT:
-                    continue
-                data = event.get("data", dict())
-                if job_id in [data.get("id"), data.get("device")]:
-                    error = data.get("error")
-                    assert not error, "block backup job finished with error: %s" % error
-                    finished = True
+            while True:
+                self.poll()
+                for job_id in job_ids:
+                    state = self._jobs[job_id]
+                    assert not state["error"], (
+                        "block backup job finished with error: %s" % state["error"]
+                    )
+                    assert not state["cancelled"], (
+                        "block job '%s' was cancelled" % job_id
+                    )
+                unfinished = [j for j in job_ids if not self.is_finished(j)]
+                if not unfinished or time.time() >= end_time:
                     break
+                time.sleep(interval)
         finally:
-            status = get_job_status(vm, job_id)
-            if status == "concluded":
-                block_job_dismiss(vm, job_id)
-        return finished
+            self.stop()
 
-    finished = utils_misc.wait_for(
-        _wait_until_block_job_completed, first=0.1, timeout=timeout
-    )
-    assert finished, "wait for block job complete event timeout in %s seconds" % timeout
+        assert not unfinished, (
+            "wait for block job complete event timeout in %s seconds: %s"
+            % (timeout, unfinished)
+        )
+
+
+@fail_on
+def wait_until_block_job_completed(vm, job_id, timeout=900):
+    """Block until block job completed"""
+    wait_until_block_jobs_completed(vm, [job_id], timeout)
+
+
+@fail_on
+def wait_until_block_jobs_completed(vm, job_ids, timeout=900):
+    """
+    Block until all block jobs completed, with a single deadline
+
+    :param vm: VM object
+    :param job_ids: list of job IDs
+    :param timeout: blocked timeout for all jobs
+    """
+    BlockJobTracker(vm, job_ids).wait_completed(timeout=timeout)
 
 
 @fail_on
@@ -195,22 +386,41 @@ def get_event_by_condition(vm, event_name, tmo=30, **condition):
 
     :return: The event dict or None
     """
-    event = None
+    index = qmp_event_index.get_event_index(vm)
+    return index.wait_for_event(event_name, tmo, **condition)
+
+
+def _query_block_jobs_by_id(vm):
+    """Get block jobs info dict indexed by job ID"""
+    return {job["device"]: job for job in query_block_jobs(vm)}
+
+
+def _block_jobs_started(vm, jobid_list, tmo):
+    """
+    Check all block jobs with one 'query-block-jobs' per second,
+    return {jobid: True if its offset > 0 in tmo}
+    """
+    results = dict()
     for i in range(tmo):
-        all_events = vm.monitor.get_events()
-        events = [e for e in all_events if e.get("event") == event_name]
-        if condition:
-            events = [
-                e
-                for e in events
-                if e.get("data")
-                and all(item in e["data"].items() for item in condition.items())
-            ]
-        if events:
-            event = events[0]
-            break
+        jobs = _query_block_jobs_by_id(vm)
+        for jobid in jobid_list:
+            if jobid in results:
+                continue
+            job = jobs.get(jobid)
+            if not job:
+                LOG_JOB.debug("job %s was not found", jobid)
+                results[jobid] = False
+            elif job["offset"] > 0:
+                results[jobid] = True
+        if len(results) == len(jobid_list):
+            return results
         time.sleep(1)
-    return event
+
+    for jobid in jobid_list:
+        if jobid not in results:
+            LOG_JOB.debug("block job %s never starts in %s", jobid, tmo)
+            results[jobid] = False
+    return results
 
 
 def is_block_job_started(vm, jobid, tmo=10):
@@ -218,90 +428,118 @@ def is_block_job_started(vm, jobid, tmo=10):
     offset should be greater than 0 when block job starts,
     return True if offset > 0 in tmo, or return False
     """
-    for i in range(tmo):
-        job = get_block_job_by_id(vm, jobid)
-        if not job:
-            LOG_JOB.debug("job %s was not found", jobid)
-            break
-        elif job["offset"] > 0:
-            return True
-        time.sleep(1)
-    else:
-        LOG_JOB.debug("block job %s never starts in %s", jobid, tmo)
-    return False
+    return _block_jobs_started(vm, [jobid], tmo)[jobid]
 
 
 def check_block_jobs_started(vm, jobid_list, tmo=10):
     """
     Test failed if any block job failed to start
     """
-    started = all(list(map(lambda j: is_block_job_started(vm, j, tmo), jobid_list)))
+    started = all(_block_jobs_started(vm, jobid_list, tmo).values())
     assert started, "Not all block jobs start successfully"
 
 
+def _block_jobs_running(vm, jobid_list, tmo):
+    """
+    Check all block jobs with one 'query-block-jobs' per second,
+    return {jobid: True if its offset increases in tmo}
+    """
+    results = dict()
+    offsets = dict()
+    for i in range(tmo):
+        jobs = _query_block_jobs_by_id(vm)
+        for jobid in jobid_list:
+            if jobid in results:
+                continue
+            job = jobs.get(jobid)
+            if not job:
+                LOG_JOB.debug("job %s cancelled unexpectedly", jobid)
+                results[jobid] = False
+            elif job["status"] not in ["running", "pending", "ready"]:
+                LOG_JOB.debug("job %s is not in running status", jobid)
+                results[jobid] = False
+            elif jobid not in offsets:
+                if job["status"] in ["pending", "ready"]:
+                    results[jobid] = True
+                else:
+                    offsets[jobid] = job["offset"]
+            elif job["offset"] > offsets[jobid]:
+                results[jobid] = True
+        if len(results) == len(jobid_list):
+            return results
+        time.sleep(1)
+
+    for jobid in jobid_list:
+        if jobid not in results:
+            LOG_JOB.debug("offset never changed for block job %s in %s", jobid, tmo)
+            results[jobid] = False
+    return results
+
+
 def is_block_job_running(vm, jobid, tmo=200):
     """
     offset should keep increasing when block job keeps running,
     return True if offset increases in tmo, or return False
     """
-    offset = None
-    for i in range(tmo):
-        job = get_block_job_by_id(vm, jobid)
-        if not job:
-            LOG_JOB.debug("job %s cancelled unexpectedly", jobid)
-            break
-        elif job["status"] not in ["running", "pending", "ready"]:
-            LOG_JOB.debug("job %s is not in running status", jobid)
-            return False
-        elif offset is None:
-            if job["status"] in ["pending", "ready"]:
-                return True
-            else:
-                offset = job["offset"]
-        elif job["offset"] > offset:
-            return True
-        time.sleep(1)
-    else:
-        LOG_JOB.debug("offset never changed for block job %s in %s", jobid, tmo)
-    return False
+    return _block_jobs_running(vm, [jobid], tmo)[jobid]
 
 
 def check_block_jobs_running(vm, jobid_list, tmo=200):
     """
     Test failed if any block job's offset never increased
     """
-    running = all(list(map(lambda j: is_block_job_running(vm, j, tmo), jobid_list)))
+    running = all(_block_jobs_running(vm, jobid_list, tmo).values())
     assert running, "Not all block jobs are running"
 
 
-def is_block_job_paused(vm, jobid, tmo=50):
+def _block_jobs_paused(vm, jobid_list, tmo):
     """
-    offset should stay the same when block job paused,
-    return True if offset never changed in tmo, or return False
+    Check all block jobs with one 'query-block-jobs' per second,
+    return {jobid: True if its offset never changed in tmo}
     """
-    offset = None
+    results = dict()
+    offsets = dict()
     time.sleep(10)
 
     for i in range(tmo):
-        job = get_block_job_by_id(vm, jobid)
-        if not job:
-            LOG_JOB.debug("job %s cancelled unexpectedly", jobid)
-            return False
-        elif job["status"] != "running":
-            LOG_JOB.debug("job %s is not in running status", jobid)
-            return False
-        elif offset is None:
-            offset = job["offset"]
-        elif offset != job["offset"]:
-            LOG_JOB.debug("offset %s changed for job %s in %s", offset, jobid, tmo)
-            return False
+        jobs = _query_block_jobs_by_id(vm)
+        for jobid in jobid_list:
+            if jobid in results:
+                continue
+            job = jobs.get(jobid)
+            if not job:
+                LOG_JOB.debug("job %s cancelled unexpectedly", jobid)
+                results[jobid] = False
+            elif job["status"] != "running":
+                LOG_JOB.debug("job %s is not in running status", jobid)
+                results[jobid] = False
+            elif jobid not in offsets:
+                offsets[jobid] = job["offset"]
+            elif offsets[jobid] != job["offset"]:
+                LOG_JOB.debug(
+                    "offset %s changed for job %s in %s", offsets[jobid], jobid, tmo
+                )
+                results[jobid] = False
+        if len(results) == len(jobid_list):
+            return results
         time.sleep(1)
-    return True
+
+    for jobid in jobid_list:
+        results.setdefault(jobid, True)
+    return results
+
+
+def is_block_job_paused(vm, jobid, tmo=50):
+    """
+    offset should stay the same when block job paused,
+    return True if offset never changed in tmo, or return False
+    """
+    return _block_jobs_paused(vm, [jobid], tmo)[jobid]
 
 
 def check_block_jobs_paused(vm, jobid_list, tmo=50):
     """
     Test failed if any block job's offset changed
     """
-    paused = all(list(map(lambda j: is_block_job_paused(vm, j, tmo), jobid_list)))
+    paused = all(_block_jobs_paused(vm, jobid_list, tmo).values())
     assert paused, "Not all block jobs are paused"
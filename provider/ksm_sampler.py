@@ -0,0 +1,237 @@
+"""
+Module for sampling the KSM counters of the host.
+
+The counters in /sys/kernel/mm/ksm are read by os.pread() on files kept
+open, so a background thread can sample them every few milliseconds
+into array.array time series. A scenario is marked when it begins, the
+merge rate and the time for KSM to reach the steady state are computed
+from the samples afterwards.
+
+KSM reached the steady state when full_scans advanced and pages_sharing
+did not change more than a tolerance during the last full scan, i.e. a
+whole pass over the mergeable memory found nothing more to merge.
+
+Available classes:
+- KSMSampler: Sample the KSM counters of the host in background
+"""
+
+import logging
+import os
+import threading
+import time
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+KSM_PATH = "/sys/kernel/mm/ksm"
+KSM_COUNTERS = ("pages_sharing", "pages_shared", "pages_unshared", "full_scans")
+
+
+class KSMSampler(object):
+    """Sample the KSM counters of the host in background"""
+
+    def __init__(self, interval=0.1, counters=KSM_COUNTERS, path=KSM_PATH):
+        """
+        :param interval: seconds between two samples
+        :param counters: names of the counters in path, full_scans and
+                         pages_sharing are always sampled
+        :param path: sysfs directory of KSM
+        """
+        self.interval = interval
+        self.path = path
+        self.counters = list(counters)
+        for name in ("full_scans", "pages_sharing"):
+            if name not in self.counters:
+                self.counters.append(name)
+        self.times = array("d")
+        self.samples = dict((name, array("q")) for name in self.counters)
+        self.marks = []
+        self._fds = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._error = None
+
+    def _read(self, name):
+        return int(os.pread(self._fds[name], 32, 0))
+
+    def _record(self):
+        values = [self._read(name) for name in self.counters]
+        now = time.time() - self._start_time
+        with self._lock:
+            self.times.append(now)
+            for name, value in zip(self.counters, values):
+                self.samples[name].append(value)
+
+    def _run(self):
+        next_time = time.time()
+        while not self._stop.is_set():
+            try:
+                self._record()
+            except Exception as err:
+                self._error = err
+                break
+            next_time += self.interval
+            self._stop.wait(max(next_time - time.time(), 0))
+
+    def start(self):
+        for name in self.counters:
+            self._fds[name] = os.open(os.path.join(self.path, name), os.O_RDONLY)
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and close the counter files
+
+        :raise: the error of sampling
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+        if self._error is not None:
+            raise self._error
+
+    def now(self):
+        """Seconds since the sampling started"""
+        return time.time() - self._start_time
+
+    def mark(self, label):
+        """
+        Mark the beginning of a scenario
+
+        :param label: scenario name
+        :return: the time of the mark
+        """
+        when = self.now()
+        self.marks.append((label, when))
+        return when
+
+    def _index(self, when):
+        """Index of the first sample taken at or after when"""
+        times = self.times
+        low, high = 0, len(times)
+        while low < high:
+            mid = (low + high) // 2
+            if times[mid] < when:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def steady_time(self, since, tolerance=0.01, scans=1):
+        """
+        Find when KSM reached the steady state after since
+
+        :param since: time after which the memory is not changed anymore
+        :param tolerance: relative change of pages_sharing allowed during
+                          the last scans
+        :param scans: number of full scans without change
+        :return: time when pages_sharing entered its final band, None if
+                 the steady state is not reached yet
+        """
+        with self._lock:
+            num = len(self.times)
+            scans_done = self.samples["full_scans"]
+            sharing = self.samples["pages_sharing"]
+            first = self._index(since)
+            if first >= num:
+                return None
+            # the scans completed since the memory was changed, the first
+            # one may have scanned pages before they were changed
+            boundaries = [
+                i for i in range(first + 1, num) if scans_done[i] != scans_done[i - 1]
+            ]
+            if len(boundaries) < scans + 1:
+                return None
+            value = sharing[boundaries[-1]]
+            band = max(value * tolerance, 1)
+            if any(
+                abs(sharing[i] - value) > band
+                for i in range(boundaries[-scans - 1], boundaries[-1])
+            ):
+                return None
+            # walk back to the last sample out of the band
+            index = boundaries[-1]
+            while index > first and abs(sharing[index - 1] - value) <= band:
+                index -= 1
+            return self.times[index]
+
+    def wait_steady(self, since, timeout, tolerance=0.01, scans=1):
+        """
+        Wait for KSM to reach the steady state, see steady_time()
+
+        :param timeout: seconds to wait
+        :return: time when the steady state was reached, None for timeout
+        :raise: the error of sampling
+        """
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            if self._error is not None:
+                raise self._error
+            steady = self.steady_time(since, tolerance, scans)
+            if steady is not None:
+                return steady
+            time.sleep(max(self.interval, 0.5))
+        return None
+
+    def merge_rate(self, begin, end, window=1.0):
+        """
+        Get the rate of pages_sharing between two times
+
+        :param begin: begin time
+        :param end: end time
+        :param window: seconds of the windows of the peak rate
+        :return: tuple of (average, peak) pages per second, negative when
+                 pages are split
+        """
+        with self._lock:
+            first, last = self._index(begin), self._index(end)
+            last = min(last, len(self.times) - 1)
+            if last <= first:
+                return 0.0, 0.0
+            times, sharing = self.times, self.samples["pages_sharing"]
+            average = (sharing[last] - sharing[first]) / (times[last] - times[first])
+            peak = 0.0
+            low = first
+            for high in range(first + 1, last + 1):
+                while times[high] - times[low] > window:
+                    low += 1
+                elapsed = times[high] - times[low]
+                if elapsed >= window / 2:
+                    rate = (sharing[high] - sharing[low]) / elapsed
+                    if abs(rate) > abs(peak):
+                        peak = rate
+            return average, peak
+
+    def value(self, name, when=None):
+        """
+        Get a counter at a time
+
+        :param name: counter name
+        :param when: time, the last sample if None
+        """
+        with self._lock:
+            if not len(self.times):
+                return 0
+            index = len(self.times) - 1
+            if when is not None:
+                index = min(self._index(when), index)
+            return self.samples[name][index]
+
+    def save(self, filename):
+        """Save the time series as CSV"""
+        with self._lock:
+            with open(filename, "w") as csv:
+                csv.write("time,%s\n" % ",".join(self.counters))
+                columns = [self.samples[name] for name in self.counters]
+                for index, when in enumerate(self.times):
+                    csv.write(
+                        "%.3f,%s\n" % (when, ",".join(str(c[index]) for c in columns))
+                    )
+        return filename
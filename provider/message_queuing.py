@@ -1,5 +1,9 @@
+import collections
 import logging
 import re
+import selectors
+import socket
+import threading
 import time
 
 from aexpect import client
@@ -253,3 +257,496 @@ class MQClient(MQBase):
                         callback = self.msg_callback[msg[0]]
                         LOG_JOB.info("Ready callback %s %s", callback, msg[1])
                         callback(self, msg[1])
+
+
+class _Reactor(object):
+    """Selector loop shared by all the socket connections of the MQ"""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._calls = collections.deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, self._drain)
+        self._thread = threading.Thread(target=self._run, name="MQReactor", daemon=True)
+        self._thread.start()
+
+    def _drain(self, mask):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def call(self, func, *args):
+        """Run func(*args) in the loop thread, the selector is not thread safe"""
+        self._calls.append((func, args))
+        try:
+            self._wakeup_w.send(b"\0")
+        except BlockingIOError:
+            # the wakeup bytes are not drained yet, the loop will wake up
+            pass
+
+    def register(self, sock, events, handler):
+        self._selector.register(sock, events, handler)
+
+    def modify(self, sock, events, handler):
+        self._selector.modify(sock, events, handler)
+
+    def unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _run(self):
+        while True:
+            for key, mask in self._selector.select():
+                try:
+                    key.data(mask)
+                except Exception as err:
+                    LOG_JOB.error("MQ handler failed: %s", err)
+            while self._calls:
+                func, args = self._calls.popleft()
+                try:
+                    func(*args)
+                except Exception as err:
+                    LOG_JOB.error("MQ call failed: %s", err)
+
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+
+def _get_reactor():
+    global _reactor
+    with _reactor_lock:
+        if _reactor is None:
+            _reactor = _Reactor()
+        return _reactor
+
+
+class _Connection(object):
+    """Line based connection driven by the reactor"""
+
+    def __init__(self, reactor, sock, on_line, on_close):
+        self.reactor = reactor
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.closed = False
+        self._on_line = on_line
+        self._on_close = on_close
+        self._inbuf = b""
+        self._outbuf = bytearray()
+        self._lock = threading.Lock()
+        reactor.call(reactor.register, sock, selectors.EVENT_READ, self._handle)
+
+    def _handle(self, mask):
+        if mask & selectors.EVENT_WRITE:
+            self._write()
+        if mask & selectors.EVENT_READ and not self.closed:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self._close()
+                return
+            lines = (self._inbuf + data).split(b"\n")
+            self._inbuf = lines.pop()
+            for line in lines:
+                self._on_line(self, line.decode(errors="replace").rstrip("\r"))
+
+    def _write(self):
+        with self._lock:
+            try:
+                sent = self.sock.send(self._outbuf)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                sent = len(self._outbuf)
+            del self._outbuf[:sent]
+            if not self._outbuf and not self.closed:
+                self.reactor.modify(self.sock, selectors.EVENT_READ, self._handle)
+
+    def _want_write(self):
+        if not self.closed:
+            self.reactor.modify(
+                self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self._handle
+            )
+
+    def send(self, data):
+        if self.closed:
+            return
+        with self._lock:
+            self._outbuf += data
+        self.reactor.call(self._want_write)
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.reactor.unregister(self.sock)
+        self.sock.close()
+        self._on_close(self)
+
+    def close(self):
+        self.reactor.call(self._close)
+
+
+class MQSocketBase(object):
+    """
+    The base class of the MQ backend speaking directly over sockets, it
+    speaks the same line protocol as the nc based classes. All the
+    connections of the process are served by one selector thread.
+    """
+
+    # lines kept for the waiters and the error messages
+    max_lines = 10000
+
+    def __init__(self):
+        self._reactor = _get_reactor()
+        self._connections = []
+        self._lines = collections.deque(maxlen=self.max_lines)
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _add_connection(self, sock):
+        conn = _Connection(self._reactor, sock, self._on_line, self._on_close)
+        with self._cond:
+            self._connections.append(conn)
+            self._cond.notify_all()
+        return conn
+
+    def _on_line(self, conn, line):
+        with self._cond:
+            self._lines.append(line)
+            self._cond.notify_all()
+
+    def _on_close(self, conn):
+        with self._cond:
+            if conn in self._connections:
+                self._connections.remove(conn)
+            self._cond.notify_all()
+
+    def _wait_line(self, regex, timeout):
+        """
+        Consume the received lines until one matches
+
+        :param regex: compiled pattern
+        :param timeout: seconds to wait
+        :return: the matched line, None for timeout
+        """
+        end_time = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while self._lines:
+                    line = self._lines.popleft()
+                    if regex.search(line):
+                        return line
+                rest = end_time - time.monotonic()
+                if rest <= 0:
+                    return None
+                self._cond.wait(rest)
+
+    def _output(self):
+        with self._cond:
+            return "\n".join(self._lines)
+
+    def _confirm_message(self, message):
+        self.sendline("CONFIRM-" + message)
+
+    def _monitor_message(self, message, timeout=DEFAULT_MONITOR_TIMEOUT):
+        if self._wait_line(re.compile(message), timeout) is None:
+            raise MessageNotFoundError(message, self._output())
+        LOG_JOB.info('The message "%s" has been monitored.', message)
+
+    def _monitor_confirm_message(self, message, timeout=DEFAULT_MONITOR_TIMEOUT):
+        return self._monitor_message("CONFIRM-" + message, timeout)
+
+    def sendline(self, line=""):
+        data = (line + "\n").encode()
+        with self._cond:
+            connections = list(self._connections)
+        for conn in connections:
+            conn.send(data)
+
+    def send_message(self, msg):
+        """
+        Send message to other.
+        """
+        self.sendline(msg)
+
+    def is_alive(self):
+        with self._cond:
+            return not self._closed and bool(self._connections)
+
+    def close(self):
+        """
+        Close the connections.
+        """
+        with self._cond:
+            self._closed = True
+            connections = list(self._connections)
+        for conn in connections:
+            conn.close()
+
+
+class MQSocketPublisher(MQSocketBase):
+    def __init__(self, port, multiple_connections=False, broker=False, address=""):
+        """
+        MQ publisher over sockets, TCP only.
+
+        :param port: The listening port.
+        :param multiple_connections: Accept multiple connections.
+        :param broker: Relay the messages of every subscriber to the
+                       others, like "nc --broker", implies
+                       multiple_connections.
+        :param address: The listening address, all addresses if empty.
+        """
+        super(MQSocketPublisher, self).__init__()
+        self.multiple_connections = multiple_connections or broker
+        self.broker = broker
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((address, int(port)))
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        self._reactor.call(
+            self._reactor.register, self._listener, selectors.EVENT_READ, self._accept
+        )
+        LOG_JOB.info("MQ socket publisher listening on %s:%s", address, port)
+
+    def _accept(self, mask):
+        try:
+            sock, peer = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        LOG_JOB.debug("MQ connection from %s:%s", *peer[:2])
+        self._add_connection(sock)
+        if not self.multiple_connections:
+            self._stop_listening()
+
+    def _stop_listening(self):
+        if self._listener is not None:
+            self._reactor.unregister(self._listener)
+            self._listener.close()
+            self._listener = None
+
+    def _on_line(self, conn, line):
+        if self.broker:
+            data = (line + "\n").encode()
+            with self._cond:
+                others = [c for c in self._connections if c is not conn]
+            for other in others:
+                other.send(data)
+        super(MQSocketPublisher, self)._on_line(conn, line)
+
+    def close(self):
+        self._reactor.call(self._stop_listening)
+        super(MQSocketPublisher, self).close()
+
+    def confirm_access(self, timeout=DEFAULT_MONITOR_TIMEOUT):
+        self._monitor_message("ACCESS", timeout)
+        self._confirm_message("ACCESS")
+
+    def approve(self, timeout=DEFAULT_MONITOR_TIMEOUT):
+        self.sendline("APPROVE")
+        self._monitor_confirm_message("APPROVE", timeout)
+
+    def notify(self, timeout=DEFAULT_MONITOR_TIMEOUT):
+        self.sendline("NOTIFY")
+        self._monitor_confirm_message("NOTIFY", timeout)
+
+    def alert(self, timeout=DEFAULT_MONITOR_TIMEOUT):
+        self.sendline("ALERT")
+        self._monitor_confirm_message("ALERT", timeout)
+
+    def refuse(self, timeout=DEFAULT_MONITOR_TIMEOUT):
+        self.sendline("REFUSE")
+        self._monitor_message("REFUSE", timeout)
+
+
+class MQSocketSubscriber(MQSocketBase):
+    def __init__(self, server_address, port, timeout=DEFAULT_MONITOR_TIMEOUT):
+        """
+        MQ subscriber over sockets, TCP only.
+
+        :param server_address: The address of remote/local MQ server.
+        :param port: The listening port of the MQ server.
+        :param timeout: The timeout to connect.
+        """
+        super(MQSocketSubscriber, self).__init__()
+        self._add_connection(
+            socket.create_connection((server_address, int(port)), timeout)
+        )
+        self._access()
+
+    def _access(self):
+        self.sendline("ACCESS")
+        self._monitor_confirm_message("ACCESS")
+
+    def confirm_approve(self):
+        self._confirm_message("APPROVE")
+
+    def confirm_notify(self):
+        self._confirm_message("NOTIFY")
+
+    def confirm_alert(self):
+        self._confirm_message("ALERT")
+
+    def confirm_refuse(self):
+        self._confirm_message("REFUSE")
+
+    def receive_event(self, timeout=DEFAULT_MONITOR_TIMEOUT):
+        event = self._wait_line(re.compile("APPROVE|NOTIFY|ALERT|REFUSE"), timeout)
+        if event is None:
+            raise UnknownEventError(self._output().strip())
+        event = event.strip()
+        getattr(self, "confirm_" + event.lower())()
+        return event
+
+
+class MQSocketClient(MQSocketBase):
+    """
+    Message queue client like chat over sockets, it has the API of
+    MQClient. The registered patterns are compiled into one regex, so a
+    line is matched against all of them in one pass.
+    """
+
+    def __init__(self, server_address, port, timeout=DEFAULT_MONITOR_TIMEOUT):
+        """
+        :param server_address: The address of remote/local MQ server.
+        :param port: The listening port of the MQ server.
+        :param timeout: The timeout to connect.
+        """
+        super(MQSocketClient, self).__init__()
+        self.msg_loop_flag = True
+        self.msg_callback = {}
+        self._regex = None
+        self._groups = {}
+        self._add_connection(
+            socket.create_connection((server_address, int(port)), timeout)
+        )
+
+    @staticmethod
+    def _compile(patterns):
+        """
+        Compile patterns into one regex, every pattern is an optional
+        lookahead group, so all the patterns matching a line are found
+        by a single match()
+
+        :return: tuple of (regex, dict of {group name: pattern})
+        """
+        groups = dict(("p%d" % i, p) for i, p in enumerate(patterns) if p)
+        regex = re.compile(
+            "".join("(?=.*?(?P<%s>%s))?" % (name, p) for name, p in groups.items())
+        )
+        return regex, groups
+
+    def match_patterns(self, lines, patterns):
+        if list(patterns) == list(self.msg_callback):
+            regex, groups = self._get_regex()
+        else:
+            regex, groups = self._compile(patterns)
+        matches = []
+        for line in lines:
+            match = regex.match(line)
+            for name, value in match.groupdict().items():
+                if value is not None and name in groups:
+                    matches.append([groups[name], line])
+        return matches if len(matches) else None
+
+    def _get_regex(self):
+        with self._cond:
+            if self._regex is None:
+                self._regex, self._groups = self._compile(list(self.msg_callback))
+            return self._regex, self._groups
+
+    def register_msg(self, msg, callback):
+        """
+        Register callback for specific msg.
+        Callback will be invoked when receive registered msg
+        """
+        if callback:
+            with self._cond:
+                self.msg_callback[msg] = callback
+                self._regex = None
+
+    def unregister_msg(self, msg):
+        """Remove registered msg"""
+        with self._cond:
+            if msg in self.msg_callback:
+                self.msg_callback.pop(msg)
+                self._regex = None
+
+    def _read_matches(self, msgs, timeout, in_loop=False):
+        """
+        Consume the received lines until some match
+
+        :param in_loop: Stop waiting when the msg loop is disabled
+        :return: list of [pattern, line], None for timeout
+        """
+        end_time = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                lines = list(self._lines)
+                self._lines.clear()
+                if lines:
+                    matches = self.match_patterns(lines, msgs)
+                    if matches:
+                        return matches
+                rest = end_time - time.monotonic()
+                if rest <= 0 or (in_loop and not self.msg_loop_flag):
+                    return None
+                self._cond.wait(rest)
+
+    def filter_msg(self, msgs=None, timeout=DEFAULT_MONITOR_TIMEOUT):
+        """
+        Read match msgs
+
+        :param msgs: msg list want to filter
+        :param timeout: read timeout
+        :return: list of matched msg
+        """
+        if not msgs:
+            msgs = list(self.msg_callback)
+        matches = self._read_matches(msgs, timeout)
+        if matches is None:
+            raise MessageNotFoundError(msgs, self._output())
+        LOG_JOB.debug('Monitor The message "%s"', matches)
+        return matches
+
+    def set_msg_loop(self, flag):
+        with self._cond:
+            self.msg_loop_flag = flag
+            self._cond.notify_all()
+
+    def msg_loop(self, msgs=None, timeout=DEFAULT_MONITOR_TIMEOUT):
+        """
+        Messages handle loop, the loop will keep reading messages
+        until timeout or the msg loop disabled.
+        The registered callbacks will be invoked in the order of the
+        messages if read match messages.
+
+        :param msgs: msg list want to filter
+        :param timeout: The whole time in handling
+        """
+        end_time = time.monotonic() + timeout
+        while self.msg_loop_flag:
+            rest_time = end_time - time.monotonic()
+            if rest_time <= 0:
+                raise MessageNotFoundError(
+                    msgs or list(self.msg_callback), self._output()
+                )
+            matches = self._read_matches(
+                msgs or list(self.msg_callback), rest_time, in_loop=True
+            )
+            for pattern, line in matches or []:
+                callback = self.msg_callback.get(pattern)
+                if callback:
+                    LOG_JOB.info("Ready callback %s %s", callback, line)
+                    callback(self, line)
@@ -0,0 +1,417 @@
+"""
+Module for measuring the throughput of NBD exports.
+
+The exports of provider.nbd_image_export are driven by a local NBD client
+on the host, either NBDBenchClient, a Python client keeping many requests
+in flight on one connection and timing every request, or qemu-img bench
+over the same address. A run reports the MB/s and IOPS, and the latency
+percentiles of the requests with NBDBenchClient, so the exports of
+different iothread, socket and TLS settings can be compared.
+
+Available classes:
+- NBDBenchClient: NBD client sending pipelined read or write requests
+
+Available functions:
+- get_bench_address: Get the address of the export of an image
+- run_client_bench: Run a benchmark with NBDBenchClient
+- run_qemu_img_bench: Run a benchmark with qemu-img bench
+- log_bench_results: Log the results of the benchmarks as a table
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import socket
+import ssl
+import struct
+import time
+from array import array
+
+from avocado.utils import process
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+MB = 1024.0**2
+
+NBD_MAGIC = b"NBDMAGIC"
+NBD_OPTS_MAGIC = 0x49484156454F5054  # IHAVEOPT
+NBD_REP_MAGIC = 0x3E889045565A9
+NBD_REQUEST_MAGIC = 0x25609513
+NBD_SIMPLE_REPLY_MAGIC = 0x67446698
+
+NBD_FLAG_FIXED_NEWSTYLE = 1 << 0
+NBD_FLAG_NO_ZEROES = 1 << 1
+NBD_FLAG_READ_ONLY = 1 << 1
+
+NBD_OPT_STARTTLS = 5
+NBD_OPT_GO = 7
+NBD_REP_ACK = 1
+NBD_REP_INFO = 3
+NBD_REP_FLAG_ERROR = 1 << 31
+NBD_INFO_EXPORT = 0
+
+NBD_CMD_READ = 0
+NBD_CMD_WRITE = 1
+NBD_CMD_DISC = 2
+
+_OPTION = struct.Struct(">QII")
+_OPTION_REPLY = struct.Struct(">QIII")
+_REQUEST = struct.Struct(">IHHQQI")
+_REPLY = struct.Struct(">IIQ")
+
+_BENCH_DONE_RE = re.compile(r"Run completed in ([\d.]+) seconds")
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+class NBDError(Exception):
+    pass
+
+
+class NBDBenchClient(object):
+    """NBD client sending pipelined read or write requests"""
+
+    def __init__(self, address, export="", tls_dir=None, timeout=60):
+        """
+        :param address: dict of type "unix" with path, or "inet" with host
+                        and port
+        :param export: export name
+        :param tls_dir: directory of ca-cert.pem and the optional
+                        client-cert.pem and client-key.pem, no TLS if None
+        :param timeout: socket timeout in seconds
+        """
+        self.address = address
+        self.export = export
+        self.tls_dir = tls_dir
+        self.timeout = timeout
+        self.size = None
+        self.flags = 0
+        self._sock = None
+
+    def _recv_exact(self, view):
+        received = 0
+        while received < len(view):
+            count = self._sock.recv_into(view[received:])
+            if not count:
+                raise NBDError("Connection closed by the NBD server")
+            received += count
+
+    def _recv(self, size):
+        buf = bytearray(size)
+        self._recv_exact(memoryview(buf))
+        return bytes(buf)
+
+    def _option(self, option, data=b""):
+        self._sock.sendall(_OPTION.pack(NBD_OPTS_MAGIC, option, len(data)) + data)
+
+    def _option_reply(self, option):
+        magic, reply_option, reply, length = _OPTION_REPLY.unpack(
+            self._recv(_OPTION_REPLY.size)
+        )
+        if magic != NBD_REP_MAGIC or reply_option != option:
+            raise NBDError("Unexpected reply of option %d" % option)
+        data = self._recv(length)
+        if reply & NBD_REP_FLAG_ERROR:
+            raise NBDError("Option %d failed: %d %r" % (option, reply, data))
+        return reply, data
+
+    def _start_tls(self, host):
+        self._option(NBD_OPT_STARTTLS)
+        self._option_reply(NBD_OPT_STARTTLS)
+        context = ssl.create_default_context(
+            cafile=os.path.join(self.tls_dir, "ca-cert.pem")
+        )
+        # the certificates of the tests are not issued for the host names
+        context.check_hostname = False
+        cert = os.path.join(self.tls_dir, "client-cert.pem")
+        if os.path.exists(cert):
+            context.load_cert_chain(cert, os.path.join(self.tls_dir, "client-key.pem"))
+        self._sock = context.wrap_socket(self._sock, server_hostname=host)
+
+    def connect(self):
+        """Connect to the export by the fixed newstyle negotiation"""
+        if self.address["type"] == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address["path"])
+            host = "localhost"
+        else:
+            host = self.address.get("host", "localhost")
+            sock = socket.create_connection(
+                (host, int(self.address["port"])), self.timeout
+            )
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+
+        magic, opts_magic, flags = struct.unpack(">8sQH", self._recv(18))
+        if magic != NBD_MAGIC or opts_magic != NBD_OPTS_MAGIC:
+            raise NBDError("Not a newstyle NBD server")
+        if not flags & NBD_FLAG_FIXED_NEWSTYLE:
+            raise NBDError("Not a fixed newstyle NBD server")
+        sock.sendall(
+            struct.pack(">I", flags & (NBD_FLAG_FIXED_NEWSTYLE | NBD_FLAG_NO_ZEROES))
+        )
+        if self.tls_dir:
+            self._start_tls(host)
+
+        name = self.export.encode()
+        self._option(
+            NBD_OPT_GO, struct.pack(">I", len(name)) + name + struct.pack(">H", 0)
+        )
+        while True:
+            reply, data = self._option_reply(NBD_OPT_GO)
+            if reply == NBD_REP_ACK:
+                break
+            if reply == NBD_REP_INFO and struct.unpack(">H", data[:2])[0] == (
+                NBD_INFO_EXPORT
+            ):
+                self.size, self.flags = struct.unpack(">QH", data[2:12])
+        if self.size is None:
+            raise NBDError("No size of export %r" % self.export)
+
+    def close(self):
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendall(
+                _REQUEST.pack(NBD_REQUEST_MAGIC, 0, NBD_CMD_DISC, 0, 0, 0)
+            )
+        except (IOError, OSError):
+            pass
+        finally:
+            self._sock.close()
+            self._sock = None
+
+    def run(self, block_size, depth, duration, write=False, pattern="seq"):
+        """
+        Keep depth requests in flight for a while
+
+        :param block_size: bytes of a request
+        :param depth: number of requests in flight
+        :param duration: seconds to run
+        :param write: send write requests instead of read requests
+        :param pattern: "seq" or "rand" offsets
+        :return: tuple of (elapsed seconds, requests done, array of the
+                 latencies in microseconds)
+        """
+        if write and self.flags & NBD_FLAG_READ_ONLY:
+            raise NBDError("Export %r is read only" % self.export)
+        blocks = self.size // block_size
+        if not blocks:
+            raise NBDError("Export is smaller than %d bytes" % block_size)
+        command = NBD_CMD_WRITE if write else NBD_CMD_READ
+        # a request is sent from one buffer, with the payload of writes
+        packet = bytearray(_REQUEST.size) + bytearray(os.urandom(block_size))
+        request = memoryview(packet)[: len(packet) if write else _REQUEST.size]
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        header = bytearray(_REPLY.size)
+        header_view = memoryview(header)
+        latencies = array("d")
+        inflight = {}
+        next_block = [0]
+
+        def send(handle):
+            if pattern == "rand":
+                block = random.randrange(blocks)
+            else:
+                block = next_block[0]
+                next_block[0] = (block + 1) % blocks
+            _REQUEST.pack_into(
+                packet,
+                0,
+                NBD_REQUEST_MAGIC,
+                0,
+                command,
+                handle,
+                block * block_size,
+                block_size,
+            )
+            inflight[handle] = time.perf_counter()
+            self._sock.sendall(request)
+
+        start = time.perf_counter()
+        end_time = start + duration
+        for handle in range(depth):
+            send(handle)
+        while inflight:
+            self._recv_exact(header_view)
+            magic, error, handle = _REPLY.unpack(header)
+            if magic != NBD_SIMPLE_REPLY_MAGIC or handle not in inflight:
+                raise NBDError("Unexpected reply %x of %d" % (magic, handle))
+            if error:
+                raise NBDError("Request %d failed: %d" % (handle, error))
+            if not write:
+                self._recv_exact(view)
+            now = time.perf_counter()
+            latencies.append((now - inflight.pop(handle)) * 1e6)
+            if now < end_time:
+                send(handle)
+        return time.perf_counter() - start, len(latencies), latencies
+
+
+def get_bench_address(image_params):
+    """
+    Get the address of the export of an image, as exported by
+    QemuNBDExportImage or InternalNBDExportImage
+
+    :param image_params: params of the exported image
+    :return: dict of type "unix" with path, or "inet" with host and port
+    """
+    if image_params.get("nbd_unix_socket"):
+        return {"type": "unix", "path": image_params["nbd_unix_socket"]}
+    return {
+        "type": "inet",
+        "host": image_params.get("nbd_bench_host", "localhost"),
+        "port": image_params.get("nbd_port", "10809"),
+    }
+
+
+def _summary(elapsed, requests, block_size, latencies=None):
+    result = {
+        "elapsed": elapsed,
+        "requests": requests,
+        "mbps": requests * block_size / elapsed / MB,
+        "iops": requests / elapsed,
+    }
+    if latencies:
+        values = sorted(latencies)
+        result["latency"] = {
+            "min": values[0],
+            "p50": _percentile(values, 50),
+            "p90": _percentile(values, 90),
+            "p99": _percentile(values, 99),
+            "p999": _percentile(values, 99.9),
+            "max": values[-1],
+            "mean": sum(values) / len(values),
+        }
+    return result
+
+
+def run_client_bench(
+    address,
+    export,
+    block_size,
+    depth,
+    duration,
+    write=False,
+    pattern="seq",
+    tls_dir=None,
+):
+    """
+    Run a benchmark of an export with NBDBenchClient
+
+    :param address: address returned by get_bench_address()
+    :param export: export name
+    :param block_size: bytes of a request
+    :param depth: number of requests in flight
+    :param duration: seconds to run
+    :param write: send write requests instead of read requests
+    :param pattern: "seq" or "rand" offsets
+    :param tls_dir: directory of the client TLS credentials, None for no TLS
+    :return: dict of elapsed, requests, mbps, iops and latency: {min, p50,
+             p90, p99, p999, max, mean} in microseconds
+    """
+    client = NBDBenchClient(address, export, tls_dir)
+    client.connect()
+    try:
+        elapsed, requests, latencies = client.run(
+            block_size, depth, duration, write, pattern
+        )
+    finally:
+        client.close()
+    return _summary(elapsed, requests, block_size, latencies)
+
+
+def run_qemu_img_bench(
+    qemu_img,
+    address,
+    export,
+    block_size,
+    depth,
+    count,
+    write=False,
+    tls_dir=None,
+    timeout=600,
+):
+    """
+    Run a benchmark of an export with qemu-img bench
+
+    :param qemu_img: qemu-img binary
+    :param count: number of requests
+    :param timeout: timeout of qemu-img bench
+    :return: dict of elapsed, requests, mbps and iops, qemu-img bench
+             does not time the requests
+    """
+    opts = ["driver=nbd", "server.type=%s" % address["type"]]
+    if address["type"] == "unix":
+        opts.append("server.path=%s" % address["path"])
+    else:
+        opts.append("server.host=%s" % address["host"])
+        opts.append("server.port=%s" % address["port"])
+    if export:
+        opts.append("export=%s" % export)
+    tls_obj = ""
+    if tls_dir:
+        tls_obj = "--object tls-creds-x509,id=bench_tls,endpoint=client,dir=%s" % (
+            tls_dir
+        )
+        opts.append("tls-creds=bench_tls")
+    cmd = "%s bench %s --image-opts -c %d -d %d -s %d %s '%s'" % (
+        qemu_img,
+        tls_obj,
+        count,
+        depth,
+        block_size,
+        "-w" if write else "",
+        ",".join(opts),
+    )
+    output = process.run(cmd, timeout=timeout, shell=True).stdout_text
+    match = _BENCH_DONE_RE.search(output)
+    if not match:
+        raise NBDError("Unexpected output of qemu-img bench: %s" % output)
+    return _summary(float(match.group(1)), count, block_size)
+
+
+def log_bench_results(results, filename=None):
+    """
+    Log the results of the benchmarks as a table
+
+    :param results: list of dicts of the config, block_size, depth and the
+                    values returned by the bench functions
+    :param filename: JSON lines file to append the results to
+    """
+    LOG_JOB.info(
+        "%-32s %8s %5s %10s %10s %10s %10s %10s",
+        "config",
+        "bs",
+        "depth",
+        "MB/s",
+        "IOPS",
+        "p50(us)",
+        "p99(us)",
+        "p99.9(us)",
+    )
+    for result in results:
+        latency = result.get("latency", {})
+        LOG_JOB.info(
+            "%-32s %8d %5d %10.2f %10.0f %10s %10s %10s",
+            result["config"],
+            result["block_size"],
+            result["depth"],
+            result["mbps"],
+            result["iops"],
+            "%.1f" % latency["p50"] if latency else "-",
+            "%.1f" % latency["p99"] if latency else "-",
+            "%.1f" % latency["p999"] if latency else "-",
+        )
+    if filename:
+        with open(filename, "a") as jsonl:
+            for result in results:
+                jsonl.write(json.dumps(result, sort_keys=True) + "\n")
@@ -0,0 +1,466 @@
+"""
+Module for driving netperf sessions by an asyncio event loop.
+
+The threaded mode of the netperf test starts the sessions by a blocking
+shell command, polls a result file over SSH to know whether they are all
+up and parses the interim results from the file at the end.
+NetperfOrchestrator keeps one persistent shell per client instead, a
+local bash or an ssh connection, and starts all the sessions of a client
+by a single line written to it. Every output line of a session is tagged
+with the session, so the interim results are read as a live stream and
+attributed to their session as they arrive. The measurement begins when
+every session of every client reported its start, the host mpstat and
+interrupt counters are sampled during the measurement, and all of this
+runs in one event loop, whatever the number of sessions.
+
+Available classes:
+- ClientShell: Persistent shell connection to a netperf client
+- NetperfOrchestrator: Run netperf sessions on clients by an event loop
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from provider import netperf_base
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+INTERIM_RE = re.compile(r"Interim result:\s*(\S+)\s+\S+\s+over\s+(\S+)\s+sec")
+_ASKPASS = '#!/bin/sh\nprintf "%s\\n" "$NETPERF_ASKPASS"\n'
+
+
+async def _gather(*coros, **kwargs):
+    # gather() outside of a coroutine binds to the default loop
+    return await asyncio.gather(*coros, **kwargs)
+
+
+class ClientShell(object):
+    """Persistent shell connection to a netperf client"""
+
+    def __init__(
+        self,
+        name,
+        address=None,
+        port=22,
+        username="root",
+        password=None,
+        askpass=None,
+    ):
+        """
+        :param name: client name used in the logs
+        :param address: address of the client, None for a local shell
+        :param port: ssh port of the client
+        :param username: user to log in
+        :param password: password to log in, None for key authentication
+        :param askpass: script printing $NETPERF_ASKPASS for ssh
+        """
+        self.name = name
+        self.address = address
+        self.port = port
+        self.username = username
+        self.password = password
+        self.askpass = askpass
+        self._proc = None
+        self._reader = None
+        self._handlers = {}
+        self._counter = 0
+
+    def _command(self):
+        if self.address is None:
+            return ["bash"], None
+        argv = [
+            "ssh",
+            "-T",
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            "UserKnownHostsFile=/dev/null",
+            "-o",
+            "ServerAliveInterval=10",
+            "-p",
+            str(self.port),
+            "-l",
+            self.username,
+            self.address,
+            "bash",
+        ]
+        env = None
+        if self.password is not None and self.askpass:
+            env = dict(
+                os.environ,
+                SSH_ASKPASS=self.askpass,
+                SSH_ASKPASS_REQUIRE="force",
+                DISPLAY=os.environ.get("DISPLAY", ":0"),
+                NETPERF_ASKPASS=self.password,
+            )
+        return argv, env
+
+    async def open(self, timeout=60):
+        argv, env = self._command()
+        # no controlling terminal, so ssh asks the password by SSH_ASKPASS
+        self._proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env,
+            start_new_session=True,
+        )
+        self._reader = asyncio.ensure_future(self._read())
+        status, output = await self.execute("true", timeout)
+        if status:
+            raise ConnectionError(
+                "Failed to open the shell of %s: %s" % (self.name, output)
+            )
+
+    async def _read(self):
+        while True:
+            line = await self._proc.stdout.readline()
+            if not line:
+                break
+            tag, _, text = line.decode(errors="replace").rstrip("\r\n").partition(" ")
+            handler = self._handlers.get(tag.partition(".")[0])
+            if handler is not None:
+                handler(tag, text)
+            else:
+                LOG_JOB.debug("%s: %s", self.name, line.rstrip())
+        # tell the waiters that the connection is lost
+        for job, handler in list(self._handlers.items()):
+            handler(job, None)
+
+    def _tag(self):
+        self._counter += 1
+        return "@%d" % self._counter
+
+    def _send(self, line):
+        if self._proc is None or self._proc.stdout.at_eof():
+            raise ConnectionError("Shell of %s is closed" % self.name)
+        self._proc.stdin.write(line.encode() + b"\n")
+
+    async def execute(self, cmd, timeout=120):
+        """
+        Execute a command in the shell
+
+        :param cmd: shell command
+        :param timeout: timeout of the command
+        :return: tuple of (exit status, output)
+        """
+        tag = self._tag()
+        output = []
+        done = asyncio.get_event_loop().create_future()
+
+        def handler(line_tag, text):
+            if done.done():
+                return
+            if text is None:
+                done.set_exception(ConnectionError("Lost the shell of %s" % self.name))
+            elif line_tag == tag:
+                output.append(text)
+            else:
+                done.set_result(int(text))
+
+        self._handlers[tag] = handler
+        try:
+            self._send(
+                "{ %s ; } 2>&1 </dev/null | sed 's/^/%s /'; echo %s.rc ${PIPESTATUS[0]}"
+                % (cmd, tag, tag)
+            )
+            status = await asyncio.wait_for(done, timeout)
+        finally:
+            del self._handlers[tag]
+        return status, "\n".join(output)
+
+    def spawn(self, cmd, count, handler):
+        """
+        Start sessions of a command in background, every output line of a
+        session is passed to handler(tag, text) with the tag "<job>.<n>",
+        the last line is "__exit <status>", text is None if the connection
+        is lost
+
+        :param cmd: shell command of a session
+        :param count: number of sessions
+        :param handler: callable of the output lines
+        :return: the job tag
+        """
+        job = self._tag()
+        self._handlers[job] = handler
+        self._send(
+            "for i in $(seq 0 %d); do ( %s; echo __exit $? ) 2>&1 </dev/null"
+            ' | sed -u "s/^/%s.$i /" & done' % (count - 1, cmd, job)
+        )
+        return job
+
+    def forget(self, job):
+        """Stop passing the output lines of a job"""
+        self._handlers.pop(job, None)
+
+    async def close(self, timeout=10):
+        if self._proc is None:
+            return
+        try:
+            self._send("exit")
+            await asyncio.wait_for(self._proc.wait(), timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            if self._proc.returncode is None:
+                self._proc.kill()
+                await self._proc.wait()
+        if self._reader is not None:
+            await self._reader
+        self._proc = None
+
+
+class _Session(object):
+    def __init__(self, client, tag):
+        self.client = client
+        self.tag = tag
+        self.started = None
+        self.status = None
+        self.interim = []
+
+
+class NetperfOrchestrator(object):
+    """Run netperf sessions on clients by an asyncio event loop"""
+
+    def __init__(self, clients, host="localhost", host_intr_pattern=None):
+        """
+        :param clients: list of dict of the arguments of ClientShell
+        :param host: "localhost" or a shell session of the host
+        :param host_intr_pattern: regex of the host interrupts counted,
+                                  all interrupts if None
+        """
+        self._loop = asyncio.new_event_loop()
+        self._tmpdir = tempfile.mkdtemp(prefix="netperf_async_")
+        askpass = os.path.join(self._tmpdir, "askpass")
+        with open(askpass, "w") as script:
+            script.write(_ASKPASS)
+        os.chmod(askpass, 0o700)
+        self.clients = [ClientShell(askpass=askpass, **client) for client in clients]
+        self.host = host
+        self.host_intr_pattern = host_intr_pattern
+
+    def open(self, timeout=60):
+        """Open the shells of all the clients"""
+        self._loop.run_until_complete(
+            _gather(*[client.open(timeout) for client in self.clients])
+        )
+        LOG_JOB.info(
+            "Opened the shells of clients: %s",
+            ", ".join(client.name for client in self.clients),
+        )
+
+    def close(self):
+        try:
+            self._loop.run_until_complete(
+                _gather(
+                    *[client.close() for client in self.clients],
+                    return_exceptions=True,
+                )
+            )
+        finally:
+            self._loop.close()
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def execute(self, cmd, timeout=120):
+        """
+        Execute a command on all the clients
+
+        :return: list of tuple of (exit status, output)
+        """
+        return self._loop.run_until_complete(
+            _gather(*[client.execute(cmd, timeout) for client in self.clients])
+        )
+
+    def _read_interrupts(self):
+        """
+        :return: sum of the host interrupts matching the pattern
+        """
+        if self.host == "localhost":
+            with open("/proc/interrupts") as stat:
+                content = stat.read()
+        else:
+            content = netperf_base.ssh_cmd(self.host, "cat /proc/interrupts")
+        lines = content.strip().splitlines()
+        ncpu = len(lines[0].split())
+        total = 0
+        for line in lines[1:]:
+            fields = line.split()
+            if self.host_intr_pattern and not re.search(
+                self.host_intr_pattern, " ".join(fields[ncpu + 1 :])
+            ):
+                continue
+            total += sum(int(f) for f in fields[1 : ncpu + 1] if f.isdigit())
+        return total
+
+    async def _sample_host(self, duration):
+        """
+        Sample mpstat and the interrupts of the host during duration
+
+        :return: tuple of (last line of mpstat, interrupts)
+        """
+        cmd = "mpstat 1 %d |tail -n 1" % duration
+        if self.host != "localhost":
+            # a shell session runs one command at a time
+            def sample():
+                begin = self._read_interrupts()
+                mpstat = netperf_base.ssh_cmd(self.host, cmd, timeout=duration + 60)
+                return mpstat, self._read_interrupts() - begin
+
+            return await self._loop.run_in_executor(None, sample)
+
+        begin = self._read_interrupts()
+        proc = await asyncio.create_subprocess_shell(
+            cmd, stdout=asyncio.subprocess.PIPE
+        )
+        output, _ = await proc.communicate()
+        return output.decode(), self._read_interrupts() - begin
+
+    async def _run(self, cmd, sessions, duration, start_timeout, kill_cmd, state, log):
+        loop = self._loop
+        total = int(sessions)
+        nclient = len(self.clients)
+        counts = [total // nclient + (n < total % nclient) for n in range(nclient)]
+        runs = {}
+        all_up = asyncio.Event()
+        all_exited = asyncio.Event()
+        progress = {"up": 0, "exited": 0}
+
+        def handler(client, tag, text):
+            now = loop.time()
+            if text is None:
+                # connection lost, every session of the job is gone
+                for session in runs.values():
+                    if (
+                        session.client is client
+                        and session.tag.startswith(tag + ".")
+                        and session.status is None
+                    ):
+                        session.status = -1
+                        progress["exited"] += 1
+            else:
+                session = runs.get((client.name, tag))
+                if session is None:
+                    return
+                if log is not None:
+                    log.write("%s%s %s\n" % (client.name, tag, text))
+                match = INTERIM_RE.search(text)
+                if match:
+                    session.interim.append(
+                        (now, float(match.group(1)), float(match.group(2)))
+                    )
+                elif session.started is None and "MIGRATE" in text:
+                    session.started = now
+                    progress["up"] += 1
+                elif text.startswith("__exit ") and session.status is None:
+                    session.status = int(text.split()[1])
+                    progress["exited"] += 1
+            if progress["up"] + progress["exited"] >= total:
+                all_up.set()
+            if progress["exited"] >= total:
+                all_exited.set()
+
+        jobs = []
+        for client, count in zip(self.clients, counts):
+            if not count:
+                continue
+            job = client.spawn(cmd, count, functools.partial(handler, client))
+            jobs.append((client, job))
+            for n in range(count):
+                tag = "%s.%d" % (job, n)
+                runs[(client.name, tag)] = _Session(client, tag)
+
+        result = None
+        try:
+            await asyncio.wait_for(all_up.wait(), start_timeout)
+            if progress["exited"]:
+                LOG_JOB.debug("%d netperf sessions exited early", progress["exited"])
+            else:
+                LOG_JOB.debug("All %d netperf sessions started", total)
+                result = await self._measure(runs, duration, state)
+        except asyncio.TimeoutError:
+            LOG_JOB.debug(
+                "Only %d of %d netperf sessions started", progress["up"], total
+            )
+        finally:
+            await asyncio.gather(
+                *[client.execute(kill_cmd) for client, _ in jobs],
+                return_exceptions=True,
+            )
+            try:
+                await asyncio.wait_for(all_exited.wait(), 30)
+            except asyncio.TimeoutError:
+                LOG_JOB.warning("Some netperf sessions did not exit after killed")
+            for client, job in jobs:
+                client.forget(job)
+        return result
+
+    async def _measure(self, runs, duration, state):
+        loop = self._loop
+        started = [session.started for session in runs.values()]
+        start_state = None
+        if state is not None:
+            start_state = await loop.run_in_executor(None, state)
+        begin = loop.time()
+        mpstat, host_intr = await self._sample_host(duration)
+        end = loop.time()
+        end_state = None
+        if state is not None:
+            end_state = await loop.run_in_executor(None, state)
+
+        throughput = 0.0
+        missing = 0
+        for session in runs.values():
+            window = [v for v in session.interim if begin <= v[0] <= end]
+            elapsed = sum(v[2] for v in window)
+            if not elapsed:
+                missing += 1
+                continue
+            throughput += sum(v[1] * v[2] for v in window) / elapsed
+        if missing:
+            LOG_JOB.warning("%d netperf sessions reported no interim result", missing)
+        return {
+            "thu": throughput,
+            "mpstat": mpstat,
+            "host_intr": host_intr,
+            "start_spread": max(started) - min(started),
+            "start_state": start_state,
+            "end_state": end_state,
+        }
+
+    def run(
+        self,
+        cmd,
+        sessions,
+        duration,
+        start_timeout,
+        kill_cmd="killall netperf",
+        state=None,
+        log=None,
+    ):
+        """
+        Run netperf sessions on the clients, the sessions are spread over
+        the clients, the measurement begins when all of them started
+
+        :param cmd: netperf command line with the -D option
+        :param sessions: total number of sessions
+        :param duration: seconds of the measurement
+        :param start_timeout: seconds to wait for all sessions to start
+        :param kill_cmd: command to stop the sessions of a client
+        :param state: callable returning the guest counters, it is called
+                      in a worker thread before and after the measurement
+        :param log: file object to save the tagged output of the sessions
+        :return: dict of thu, mpstat, host_intr, start_spread in seconds,
+                 start_state and end_state, None if not all the sessions
+                 started in time
+        """
+        start = time.time()
+        result = self._loop.run_until_complete(
+            self._run(cmd, sessions, duration, start_timeout, kill_cmd, state, log)
+        )
+        LOG_JOB.debug("Netperf sessions finished in %.1fs", time.time() - start)
+        return result
@@ -26,19 +26,22 @@ def record_env_version(test, params, host, server_ctl, fd, test_duration):
     """
     Get host kernel/qemu/guest kernel version
 
+    :return: dict of host_ver, guest_ver and qemu_ver
     """
     ver_cmd = params.get("ver_cmd", "rpm -q qemu-kvm")
     guest_ver_cmd = params.get("guest_ver_cmd", "uname -r")
+    qemu_ver = ssh_cmd(host, ver_cmd).strip()
+    guest_ver = ssh_cmd(server_ctl, guest_ver_cmd).strip()
+    host_ver = os.uname()[2]
 
-    test.write_test_keyval({"kvm-userspace-ver": ssh_cmd(host, ver_cmd).strip()})
-    test.write_test_keyval(
-        {"guest-kernel-ver": ssh_cmd(server_ctl, guest_ver_cmd).strip()}
-    )
+    test.write_test_keyval({"kvm-userspace-ver": qemu_ver})
+    test.write_test_keyval({"guest-kernel-ver": guest_ver})
     test.write_test_keyval({"session-length": test_duration})
-    fd.write("### kvm-userspace-ver : %s\n" % ssh_cmd(host, ver_cmd).strip())
-    fd.write("### guest-kernel-ver : %s\n" % ssh_cmd(server_ctl, guest_ver_cmd).strip())
-    fd.write("### kvm_version : %s\n" % os.uname()[2])
+    fd.write("### kvm-userspace-ver : %s\n" % qemu_ver)
+    fd.write("### guest-kernel-ver : %s\n" % guest_ver)
+    fd.write("### kvm_version : %s\n" % host_ver)
     fd.write("### session-length : %s\n" % test_duration)
+    return {"host_ver": host_ver, "guest_ver": guest_ver, "qemu_ver": qemu_ver}
 
 
 def env_setup(test, params, session, ip, username, shell_port, password):
@@ -0,0 +1,301 @@
+"""
+Module for the structured results of netperf tests.
+
+A NetperfResult keeps the measured values of one protocol, size and
+sessions case, the throughput or transaction rate, the host and guest CPU
+usage, the host interrupts, the KVM exits and the guest counters of the
+netperf test, and derives the normalized metrics from them, e.g. the
+throughput per CPU percent and the exits per packet. NetperfResults
+writes every case as one JSON line next to the legacy table, and
+compares the cases of two runs metric by metric over aligned arrays,
+so nobody has to scrape the fixed width table anymore.
+
+Available classes:
+- NetperfResult: Result of one protocol, size and sessions case
+- NetperfResults: Results of the cases of a netperf test
+
+Available functions:
+- load_jsonl: Load the results written by NetperfResults.write_jsonl
+"""
+
+import json
+import logging
+import math
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+RR_PROTOCOLS = ("TCP_RR", "TCP_CRR", "UDP_RR")
+
+# metrics derived from the measured values, in the order of the table
+DERIVED = (
+    "thr_per_CPU",
+    "thr_per_guest_CPU",
+    "tpkt_per_exit",
+    "exits_per_pkt",
+    "intr_per_pkt",
+    "bytes_per_pkt",
+    "retrans_ratio",
+)
+
+
+def _ratio(numerator, denominator):
+    if numerator is None or not denominator:
+        return None
+    return float(numerator) / denominator
+
+
+class NetperfResult(object):
+    """Result of one protocol, size and sessions case"""
+
+    def __init__(
+        self,
+        protocol,
+        size,
+        sessions,
+        rate,
+        host_cpu=None,
+        guest_cpu=None,
+        host_intr=None,
+        exits=None,
+        counters=None,
+    ):
+        """
+        :param protocol: netperf test name, e.g. TCP_STREAM
+        :param size: message size
+        :param sessions: number of sessions
+        :param rate: throughput in 10^6bits/s, or transactions per second
+                     for the RR protocols
+        :param host_cpu: CPU usage of the host in percent
+        :param guest_cpu: CPU usage of the guest in percent
+        :param host_intr: interrupts of the host during the test
+        :param exits: KVM exits during the test
+        :param counters: dict of the guest counters, e.g. rx_pkts, tx_pkts,
+                         rx_byts, tx_byts, re_pkts and rx_intr_sum
+        """
+        self.protocol = protocol
+        self.size = int(size)
+        self.sessions = int(sessions)
+        self.rate = float(rate)
+        self.host_cpu = host_cpu
+        self.guest_cpu = guest_cpu
+        self.host_intr = host_intr
+        self.exits = exits
+        self.counters = dict(counters or {})
+
+    @classmethod
+    def from_ret(cls, protocol, size, sessions, ret, mpstat_index):
+        """
+        Create a result from the dict returned by launch_client
+
+        :param ret: dict of thu, mpstat and the counters of get_state
+        :param mpstat_index: column of the idle percent in mpstat output
+        """
+        counters = dict(ret)
+        host_cpu = 100 - float(counters.pop("mpstat").split()[mpstat_index])
+        busy = counters.pop("guest_busy", None)
+        total = counters.pop("guest_total", None)
+        guest_cpu = 100.0 * busy / total if total else None
+        for key in ("thu", "pid", "exits", "host_intr"):
+            counters.pop(key, None)
+        return cls(
+            protocol,
+            size,
+            sessions,
+            ret["thu"],
+            host_cpu=host_cpu,
+            guest_cpu=guest_cpu,
+            host_intr=ret.get("host_intr"),
+            exits=ret.get("exits"),
+            counters=counters,
+        )
+
+    @property
+    def key(self):
+        return (self.protocol, self.size, self.sessions)
+
+    @property
+    def case(self):
+        """Name of the case in the keyvals and the results database"""
+        return "%s--%s--%s" % self.key
+
+    @property
+    def is_rr(self):
+        return self.protocol in RR_PROTOCOLS
+
+    def derived(self):
+        """
+        :return: dict of the derived metrics, None if not available
+        """
+        counters = self.counters
+        pkts = None
+        if "rx_pkts" in counters and "tx_pkts" in counters:
+            pkts = counters["rx_pkts"] + counters["tx_pkts"]
+        byts = None
+        if "rx_byts" in counters and "tx_byts" in counters:
+            byts = counters["rx_byts"] + counters["tx_byts"]
+        intr = None
+        if "rx_intr_sum" in counters and "tx_intr_sum" in counters:
+            intr = counters["rx_intr_sum"] + counters["tx_intr_sum"]
+        return {
+            "thr_per_CPU": _ratio(self.rate, self.host_cpu),
+            "thr_per_guest_CPU": _ratio(self.rate, self.guest_cpu),
+            "tpkt_per_exit": _ratio(counters.get("tx_pkts"), self.exits),
+            "exits_per_pkt": _ratio(self.exits, pkts),
+            "intr_per_pkt": _ratio(intr, pkts),
+            "bytes_per_pkt": _ratio(byts, pkts),
+            "retrans_ratio": _ratio(counters.get("re_pkts"), counters.get("tx_pkts")),
+        }
+
+    def values(self):
+        """
+        :return: flat dict of all the values by their names in the legacy
+                 table, the measured values not available are left out,
+                 the derived ones are None
+        """
+        values = {"size": self.size, "sessions": self.sessions}
+        values["trans.rate" if self.is_rr else "throughput"] = self.rate
+        for name, value in (
+            ("CPU", self.host_cpu),
+            ("guest_CPU", self.guest_cpu),
+            ("host_intr", self.host_intr),
+            ("exits", self.exits),
+        ):
+            if value is not None:
+                values[name] = value
+        values.update(self.counters)
+        values.update(self.derived())
+        return values
+
+    def to_json(self):
+        return {
+            "protocol": self.protocol,
+            "size": self.size,
+            "sessions": self.sessions,
+            "rate": self.rate,
+            "host_cpu": self.host_cpu,
+            "guest_cpu": self.guest_cpu,
+            "host_intr": self.host_intr,
+            "exits": self.exits,
+            "counters": self.counters,
+            "derived": self.derived(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data["protocol"],
+            data["size"],
+            data["sessions"],
+            data["rate"],
+            host_cpu=data.get("host_cpu"),
+            guest_cpu=data.get("guest_cpu"),
+            host_intr=data.get("host_intr"),
+            exits=data.get("exits"),
+            counters=data.get("counters"),
+        )
+
+
+class NetperfResults(object):
+    """Results of the cases of a netperf test"""
+
+    def __init__(self, results=()):
+        self._results = {}
+        for result in results:
+            self.add(result)
+
+    def __len__(self):
+        return len(self._results)
+
+    def __iter__(self):
+        return iter(self._results.values())
+
+    def add(self, result):
+        """Add the result of a case, it replaces the former one of the case"""
+        self._results[result.key] = result
+
+    def get(self, protocol, size, sessions):
+        return self._results.get((protocol, int(size), int(sessions)))
+
+    def write_jsonl(self, filename, results=None):
+        """
+        Append results to a JSON lines file
+
+        :param filename: file name
+        :param results: results to write, all results if None
+        """
+        with open(filename, "a") as jsonl:
+            for result in self if results is None else results:
+                jsonl.write(json.dumps(result.to_json(), sort_keys=True) + "\n")
+        return filename
+
+    def matrix(self, metric, keys=None):
+        """
+        Get a metric of the cases as an array
+
+        :param metric: value name, as in NetperfResult.values()
+        :param keys: case keys of (protocol, size, sessions), all if None
+        :return: tuple of (keys, array of values, NaN if not available)
+        """
+        keys = list(self._results) if keys is None else list(keys)
+        values = array("d")
+        for key in keys:
+            result = self._results.get(key)
+            value = result.values().get(metric) if result else None
+            values.append(math.nan if value is None else value)
+        return keys, values
+
+    def compare(self, baseline, metrics=("throughput", "trans.rate", "thr_per_CPU")):
+        """
+        Compare metrics of the cases found in both results
+
+        :param baseline: NetperfResults object of the baseline
+        :param metrics: value names to compare
+        :return: dict of {metric: list of (key, base, new, change)}, change
+                 is relative to the base, the cases without the metric on
+                 either side are left out
+        """
+        keys = [key for key in self._results if key in baseline._results]
+        comparison = {}
+        for metric in metrics:
+            _, new = self.matrix(metric, keys)
+            _, base = baseline.matrix(metric, keys)
+            rows = [
+                (key, b, n, (n - b) / b)
+                for key, b, n in zip(keys, base, new)
+                if not (math.isnan(b) or math.isnan(n)) and b
+            ]
+            if rows:
+                comparison[metric] = rows
+        return comparison
+
+    def log_comparison(self, baseline, metrics=("throughput", "trans.rate")):
+        comparison = self.compare(baseline, metrics)
+        for metric, rows in comparison.items():
+            LOG_JOB.info("Comparison of %s with the baseline:", metric)
+            for key, base, new, change in rows:
+                LOG_JOB.info(
+                    "%-12s size %6s sessions %4s: %12.2f -> %12.2f (%+.1f%%)",
+                    key[0],
+                    key[1],
+                    key[2],
+                    base,
+                    new,
+                    change * 100,
+                )
+        return comparison
+
+
+def load_jsonl(filename):
+    """
+    Load the results written by NetperfResults.write_jsonl
+
+    :param filename: file name
+    :return: NetperfResults object
+    """
+    results = NetperfResults()
+    with open(filename) as jsonl:
+        for line in jsonl:
+            if line.strip():
+                results.add(NetperfResult.from_json(json.loads(line)))
+    return results
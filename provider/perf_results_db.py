@@ -0,0 +1,465 @@
+"""
+Module for storing performance results and checking them for regressions.
+
+The results of fio, netperf, iozone, pktgen, testpmd etc. are kept in a
+local SQLite database, every run is keyed by the test name and the
+host kernel, guest kernel and qemu versions. A set of stored runs can be
+named as a baseline, the results of a new run are compared with it by
+Welch's t-test (or a prediction interval when one side has a single
+sample), so a change is only flagged when it is both large enough and
+statistically significant.
+
+Available classes:
+- PerfResultsDB: SQLite store of performance results
+- Comparison: Result of comparing a metric with its baseline
+
+Available functions:
+- t_test: Two sided p-value of the difference of two sample means
+- get_host_versions: Get the host kernel and qemu versions
+- open_results_db: Open the results database configured by the params
+- record_results: Store the results of a test and check them with baseline
+"""
+
+import collections
+import fnmatch
+import logging
+import math
+import numbers
+import os
+import sqlite3
+import statistics
+import time
+
+from avocado.utils import process
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    test TEXT NOT NULL,
+    host_ver TEXT,
+    guest_ver TEXT,
+    qemu_ver TEXT,
+    tag TEXT,
+    time REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    kase TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id, kase, metric);
+CREATE TABLE IF NOT EXISTS baselines (
+    name TEXT NOT NULL,
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    PRIMARY KEY (name, run_id)
+);
+"""
+
+# metrics which are better when lower, in fnmatch patterns
+LOWER_IS_BETTER = ("*lat*", "CPU", "Hostcpu", "exits", "*intr*")
+
+Comparison = collections.namedtuple(
+    "Comparison",
+    [
+        "case",
+        "metric",
+        "base_mean",
+        "base_num",
+        "new_mean",
+        "new_num",
+        "change",
+        "p_value",
+        "status",
+    ],
+)
+
+
+def _betacf(a, b, x):
+    """Continued fraction of the incomplete beta function, by Lentz"""
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 301):
+        for num in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1.0 + num * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + num / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+
+def _betai(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log(1 - x)
+    )
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1 - x) / b
+
+
+def _t_p_value(t, df):
+    """Two sided p-value of Student's t distribution"""
+    return _betai(df / 2.0, 0.5, df / (df + t * t))
+
+
+def t_test(base, new):
+    """
+    Two sided p-value of the difference of two sample means
+
+    Welch's t-test is used when both sides have 2 samples at least, if
+    one side has a single sample, it is checked against the prediction
+    interval of the other side.
+
+    :param base: sequence of baseline samples
+    :param new: sequence of new samples
+    :return: p-value, None if it can not be computed
+    """
+    n1, n2 = len(base), len(new)
+    if n1 < 1 or n2 < 1 or n1 + n2 < 3:
+        return None
+    m1, m2 = statistics.fmean(base), statistics.fmean(new)
+    v1 = statistics.variance(base) if n1 > 1 else 0.0
+    v2 = statistics.variance(new) if n2 > 1 else 0.0
+    if n1 == 1 or n2 == 1:
+        # a single sample against the distribution of the other side
+        var, num = (v1, n1) if n2 == 1 else (v2, n2)
+        se2 = var * (1 + 1.0 / num)
+        df = num - 1
+    else:
+        a, b = v1 / n1, v2 / n2
+        se2 = a + b
+        df = se2 * se2 / (a * a / (n1 - 1) + b * b / (n2 - 1)) if se2 else 1
+    if se2 == 0:
+        return 1.0 if m1 == m2 else 0.0
+    return _t_p_value((m2 - m1) / math.sqrt(se2), df)
+
+
+class PerfResultsDB(object):
+    """SQLite store of performance results"""
+
+    def __init__(self, path, timeout=60):
+        """
+        :param path: path of the database file, created if not existed
+        :param timeout: seconds to wait for the lock held by other writers
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_run(self, test, host_ver="", guest_ver="", qemu_ver="", tag=""):
+        """
+        Add a run of the test
+
+        :param test: test name
+        :param host_ver: host kernel version
+        :param guest_ver: guest kernel version
+        :param qemu_ver: qemu version
+        :param tag: free form tag, e.g. nightly
+        :return: id of the run
+        """
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (test, host_ver, guest_ver, qemu_ver, tag, time) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (test, host_ver, guest_ver, qemu_ver, tag, time.time()),
+            )
+        return cursor.lastrowid
+
+    def add_results(self, run_id, results):
+        """
+        Add the results of a run
+
+        :param run_id: id of the run
+        :param results: dict of {case: {metric: value or sequence of values}},
+                        values which are not numbers (e.g. a mode, a unit
+                        or "N/A") are skipped
+        :return: number of the samples added
+        """
+        rows = []
+        skipped = set()
+        for case, metrics in results.items():
+            for metric, values in metrics.items():
+                if isinstance(values, (numbers.Number, str)) or values is None:
+                    values = [values]
+                for value in values:
+                    try:
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        skipped.add(str(metric))
+                        continue
+                    if math.isnan(value):
+                        skipped.add(str(metric))
+                        continue
+                    rows.append((run_id, str(case), str(metric), value))
+        if skipped:
+            LOG_JOB.debug(
+                "Skipped the values which are not numbers of %s",
+                ", ".join(sorted(skipped)),
+            )
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO results (run_id, kase, metric, value) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def get_runs(self, test=None, **versions):
+        """
+        Get the runs in the order of time
+
+        :param test: test name, all tests if None
+        :param versions: items of host_ver, guest_ver, qemu_ver or tag
+                         the runs must match
+        :return: list of dicts of the runs
+        """
+        query = "SELECT id, test, host_ver, guest_ver, qemu_ver, tag, time FROM runs"
+        conditions, args = [], []
+        if test is not None:
+            conditions.append("test = ?")
+            args.append(test)
+        for key in ("host_ver", "guest_ver", "qemu_ver", "tag"):
+            if key in versions:
+                conditions.append("%s = ?" % key)
+                args.append(versions[key])
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        cursor = self._conn.execute(query + " ORDER BY time, id", args)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def get_samples(self, run_ids):
+        """
+        Get the samples of the runs
+
+        :param run_ids: list of run ids
+        :return: dict of {(case, metric): list of values}
+        """
+        samples = collections.OrderedDict()
+        if not run_ids:
+            return samples
+        cursor = self._conn.execute(
+            "SELECT kase, metric, value FROM results WHERE run_id IN (%s) "
+            "ORDER BY rowid" % ",".join("?" * len(run_ids)),
+            list(run_ids),
+        )
+        for case, metric, value in cursor:
+            samples.setdefault((case, metric), []).append(value)
+        return samples
+
+    def set_baseline(self, name, run_ids):
+        """
+        Add the runs to the named baseline
+
+        :param name: baseline name
+        :param run_ids: list of run ids
+        """
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO baselines (name, run_id) VALUES (?, ?)",
+                [(name, run_id) for run_id in run_ids],
+            )
+
+    def clear_baseline(self, name):
+        with self._conn:
+            self._conn.execute("DELETE FROM baselines WHERE name = ?", (name,))
+
+    def get_baseline(self, name, test=None):
+        """
+        Get the run ids of the named baseline
+
+        :param name: baseline name
+        :param test: only the runs of the test if not None
+        :return: list of run ids
+        """
+        query = (
+            "SELECT runs.id FROM baselines JOIN runs ON runs.id = baselines.run_id "
+            "WHERE baselines.name = ?"
+        )
+        args = [name]
+        if test is not None:
+            query += " AND runs.test = ?"
+            args.append(test)
+        return [row[0] for row in self._conn.execute(query + " ORDER BY runs.id", args)]
+
+    def compare(
+        self,
+        run_ids,
+        baseline_ids,
+        threshold=0.05,
+        alpha=0.05,
+        lower_is_better=LOWER_IS_BETTER,
+    ):
+        """
+        Compare the results of runs with the baseline runs
+
+        A metric is a regression(improvement) when its mean changed to the
+        worse(better) side by more than threshold, and the change is
+        significant at the level alpha. It is "insufficient" if the change
+        exceeds threshold but its significance can not be computed.
+
+        :param run_ids: list of run ids
+        :param baseline_ids: list of baseline run ids
+        :param threshold: min relative change of mean
+        :param alpha: significance level
+        :param lower_is_better: fnmatch patterns of the metrics which are
+                                better when lower
+        :return: list of Comparison objects
+        """
+        base_samples = self.get_samples(baseline_ids)
+        comparisons = []
+        for (case, metric), new in self.get_samples(run_ids).items():
+            base = base_samples.get((case, metric))
+            if not base:
+                continue
+            base_mean, new_mean = statistics.fmean(base), statistics.fmean(new)
+            if base_mean:
+                change = (new_mean - base_mean) / abs(base_mean)
+            else:
+                change = 0.0 if new_mean == base_mean else math.copysign(1, new_mean)
+            p_value = t_test(base, new)
+            lower = any(fnmatch.fnmatchcase(metric, p) for p in lower_is_better)
+            worse = change > 0 if lower else change < 0
+            if abs(change) <= threshold:
+                status = "unchanged"
+            elif p_value is None:
+                status = "insufficient"
+            elif p_value >= alpha:
+                status = "unchanged"
+            else:
+                status = "regression" if worse else "improvement"
+            comparisons.append(
+                Comparison(
+                    case,
+                    metric,
+                    base_mean,
+                    len(base),
+                    new_mean,
+                    len(new),
+                    change,
+                    p_value,
+                    status,
+                )
+            )
+        return comparisons
+
+
+def get_host_versions(params):
+    """
+    Get the host kernel and qemu versions
+
+    :param params: Dictionary with the test parameters
+    :return: dict of host_ver and qemu_ver
+    """
+    ver_cmd = params.get("ver_cmd", "rpm -q qemu-kvm")
+    return {
+        "host_ver": os.uname()[2],
+        "qemu_ver": process.getoutput(ver_cmd, shell=True).strip(),
+    }
+
+
+def open_results_db(params):
+    """
+    Open the results database configured by param perf_results_db
+
+    :param params: Dictionary with the test parameters
+    :return: PerfResultsDB object, None if no database is configured
+    """
+    path = params.get("perf_results_db")
+    return PerfResultsDB(path) if path else None
+
+
+def record_results(test, params, results, host_ver="", guest_ver="", qemu_ver=""):
+    """
+    Store the results of a test and check them with the baseline
+
+    Nothing is done unless param perf_results_db is set. The results are
+    compared with the runs of baseline perf_baseline, then this run is
+    added to baseline perf_set_baseline if it is set. The test fails for
+    regressions when perf_regression_fail is yes.
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param results: dict of {case: {metric: value or sequence of values}}
+    :param host_ver: host kernel version
+    :param guest_ver: guest kernel version
+    :param qemu_ver: qemu version
+    :return: list of Comparison objects
+    """
+    db = open_results_db(params)
+    if db is None:
+        return []
+    name = params.get("perf_results_name", params.get("shortname", test.name))
+    versions = [
+        (v.decode() if isinstance(v, bytes) else str(v)).strip()
+        for v in (host_ver, guest_ver, qemu_ver)
+    ]
+    with db:
+        run_id = db.add_run(name, *versions, tag=params.get("perf_results_tag", ""))
+        num = db.add_results(run_id, results)
+        LOG_JOB.info("Stored %s samples of run %s in %s", num, run_id, db.path)
+
+        comparisons = []
+        baseline = params.get("perf_baseline")
+        if baseline:
+            baseline_ids = db.get_baseline(baseline, name)
+            if baseline_ids:
+                lower_is_better = params.get("perf_lower_is_better")
+                comparisons = db.compare(
+                    [run_id],
+                    baseline_ids,
+                    float(params.get("perf_regression_threshold", 0.05)),
+                    float(params.get("perf_regression_alpha", 0.05)),
+                    lower_is_better.split() if lower_is_better else LOWER_IS_BETTER,
+                )
+            else:
+                LOG_JOB.warning("No run of %s in baseline %s", name, baseline)
+        if params.get("perf_set_baseline"):
+            db.set_baseline(params["perf_set_baseline"], [run_id])
+
+    regressions = []
+    for item in comparisons:
+        if item.status == "unchanged":
+            continue
+        msg = "%s %s: %.2f -> %.2f (%+.2f%%, p=%s)" % (
+            item.case,
+            item.metric,
+            item.base_mean,
+            item.new_mean,
+            item.change * 100,
+            "%.4f" % item.p_value if item.p_value is not None else "n/a",
+        )
+        LOG_JOB.info("%s %s", item.status, msg)
+        if item.status == "regression":
+            regressions.append(msg)
+    if regressions and params.get("perf_regression_fail", "no") == "yes":
+        test.fail("Performance regressions against %s: %s" % (baseline, regressions))
+    return comparisons
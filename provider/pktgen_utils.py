@@ -246,6 +246,7 @@ def run_tests_for_category(
     :param vm: VM instance
     :param session_serial: Session serial for VM
     :param interface: Network interface for the test
+    :return: dict of {"script--category--size--threads--burst": {"mpps": mpps}}
     """
 
     timeout = float(params.get("pktgen_test_timeout", "240"))
@@ -265,6 +266,7 @@ def run_tests_for_category(
 
     pktgen_config = PktgenConfig()
     pktgen_runner = PktgenRunner()
+    perf_results = {}
     if vp_vdpa:
         pktgen_config.vp_vdpa_bind(session_serial)
 
@@ -357,3 +359,6 @@ def run_tests_for_category(
                             params.get("format_fbase", "2"),
                         )
                         result_file.write(("%s\n" % line))
+                        key = "--".join((script, pkt_cate, size, threads, burst))
+                        perf_results[key] = {"mpps": float(pkt_cate_r)}
+    return perf_results
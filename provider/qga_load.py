@@ -0,0 +1,504 @@
+"""
+Module for loading the qemu guest agent and profiling it.
+
+The agent commands are sent by cmd_raw() of the agent, so no response is
+logged in the load loop, and the latency of every command is kept in
+array.array. An operation made of several commands, e.g. guest-exec and
+the polling of guest-exec-status, is timed as a whole. The memory usage
+of the agent process in guest can be sampled at a fixed cadence while
+commands are running, the slope of the samples is fitted by least
+squares, so slow leaks are found from many samples instead of from two
+noisy ones.
+
+Available classes:
+- QGALoad: Send a mix of agent commands from concurrent callers
+- MemorySampler: Sample the memory usage of a guest process in background
+
+Available functions:
+- parse_commands: Parse the weighted command mix from a param string
+- command_op: Operation sending one agent command
+- file_read_op: Operation reading a guest file in chunks, over and over
+- file_write_op: Operation writing a guest file in chunks, over and over
+- exec_op: Operation running a guest program until it exits
+- percentile: Percentile of sorted samples
+- linear_fit: Least squares fit of a line
+"""
+
+import base64
+import json
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+
+def parse_commands(commands):
+    """
+    Parse the weighted command mix
+
+    :param commands: string like "guest-info:4 guest-ping", weight is 1
+                     if not given
+    :return: list of tuples (command, weight)
+    """
+    mix = []
+    for item in commands.split():
+        name, _, weight = item.partition(":")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+
+def _request(name, args=None):
+    cmd = {"execute": name}
+    if args:
+        cmd["arguments"] = args
+    return json.dumps(cmd) + "\n"
+
+
+def command_op(name, args=None):
+    """
+    Operation sending one agent command
+
+    An operation is called with the agent and the timeout, it returns a
+    tuple of (sent bytes, received bytes, payload bytes, failed).
+
+    :param name: command name
+    :param args: dict of the command arguments
+    """
+    data = _request(name, args)
+
+    def send(agent, timeout):
+        resp = agent.cmd_raw(data, timeout)
+        return len(data), len(json.dumps(resp)), 0, "error" in resp
+
+    return send
+
+
+def file_read_op(handle, count):
+    """
+    Operation reading count bytes of an opened guest file, the file is
+    read again from the beginning after its end
+
+    :param handle: file handle returned by guest-file-open
+    :param count: bytes of a read
+    """
+    read = _request("guest-file-read", {"handle": handle, "count": count})
+    rewind = _request("guest-file-seek", {"handle": handle, "offset": 0, "whence": 0})
+
+    def send(agent, timeout):
+        resp = agent.cmd_raw(read, timeout)
+        sent, received = len(read), len(json.dumps(resp))
+        if "error" in resp:
+            return sent, received, 0, True
+        ret = resp["return"]
+        if ret.get("eof"):
+            resp = agent.cmd_raw(rewind, timeout)
+            sent += len(rewind)
+            received += len(json.dumps(resp))
+        return sent, received, ret.get("count", 0), "error" in resp
+
+    return send
+
+
+def file_write_op(handle, content, limit):
+    """
+    Operation writing content to an opened guest file, the file is
+    written again from the beginning once limit bytes are written
+
+    :param handle: file handle returned by guest-file-open
+    :param content: bytes of a write
+    :param limit: max size of the file
+    """
+    write = _request(
+        "guest-file-write",
+        {"handle": handle, "buf-b64": base64.b64encode(content).decode()},
+    )
+    rewind = _request("guest-file-seek", {"handle": handle, "offset": 0, "whence": 0})
+    lock = threading.Lock()
+    offset = [0]
+
+    def send(agent, timeout):
+        with lock:
+            resp = agent.cmd_raw(write, timeout)
+            sent, received = len(write), len(json.dumps(resp))
+            if "error" in resp:
+                return sent, received, 0, True
+            count = resp["return"].get("count", 0)
+            offset[0] += count
+            if offset[0] + len(content) > limit:
+                resp = agent.cmd_raw(rewind, timeout)
+                sent += len(rewind)
+                received += len(json.dumps(resp))
+                offset[0] = 0
+        return sent, received, count, "error" in resp
+
+    return send
+
+
+def exec_op(path, args=None, poll_interval=0.01):
+    """
+    Operation running a guest program by guest-exec and polling
+    guest-exec-status until it exits, a non-zero exit code is a failure
+
+    :param path: program path in guest
+    :param args: list of the program arguments
+    :param poll_interval: seconds between two polls of the status
+    """
+    arguments = {"path": path, "capture-output": True}
+    if args:
+        arguments["arg"] = list(args)
+    data = _request("guest-exec", arguments)
+
+    def send(agent, timeout):
+        end_time = time.time() + timeout
+        resp = agent.cmd_raw(data, timeout)
+        sent, received = len(data), len(json.dumps(resp))
+        if "error" in resp:
+            return sent, received, 0, True
+        status = _request("guest-exec-status", {"pid": resp["return"]["pid"]})
+        while True:
+            resp = agent.cmd_raw(status, timeout)
+            sent += len(status)
+            received += len(json.dumps(resp))
+            if "error" in resp:
+                return sent, received, 0, True
+            ret = resp["return"]
+            if ret.get("exited"):
+                return sent, received, 0, ret.get("exitcode") != 0
+            if time.time() > end_time:
+                return sent, received, 0, True
+            time.sleep(poll_interval)
+
+    return send
+
+
+def percentile(values, percent):
+    """
+    Percentile of sorted samples, by linear interpolation
+
+    :param values: sorted sequence of samples
+    :param percent: percentile in [0, 100]
+    """
+    if not len(values):
+        return 0
+    pos = (len(values) - 1) * percent / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def linear_fit(xs, ys):
+    """
+    Least squares fit of y = slope * x + intercept
+
+    :param xs: sequence of x
+    :param ys: sequence of y
+    :return: tuple of (slope, intercept, r2, standard error of slope)
+    """
+    num = len(xs)
+    if num < 2:
+        return 0.0, (ys[0] if num else 0.0), 0.0, 0.0
+    mean_x, mean_y = sum(xs) / num, sum(ys) / num
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    if not sxx:
+        return 0.0, mean_y, 0.0, 0.0
+    slope = sxy / sxx
+    intercept = mean_y - slope * mean_x
+    sse = max(syy - slope * sxy, 0.0)
+    r2 = 1 - sse / syy if syy else 1.0
+    se = math.sqrt(sse / (num - 2) / sxx) if num > 2 else 0.0
+    return slope, intercept, r2, se
+
+
+class _CommandStats(object):
+    def __init__(self):
+        self.latency = array("d")
+        self.errors = 0
+        self.payload_bytes = 0
+        self.sent_bytes = 0
+        self.received_bytes = 0
+
+
+class QGALoad(object):
+    """Send a mix of agent commands from concurrent callers"""
+
+    def __init__(self, agent, commands, callers=1, timeout=60):
+        """
+        :param agent: QemuAgent object
+        :param commands: list of tuples (command, weight), or tuples
+                         (command, weight, arguments), the arguments can
+                         be an operation, see command_op()
+        :param callers: number of concurrent caller threads
+        :param timeout: timeout of a command
+        """
+        self.agent = agent
+        self.callers = callers
+        self.timeout = timeout
+        self._schedule = []
+        for item in commands:
+            name, weight = item[0], item[1]
+            args = item[2] if len(item) > 2 else None
+            operation = args if callable(args) else command_op(name, args)
+            self._schedule.extend([(name, operation)] * weight)
+        self.stats = dict((name, _CommandStats()) for name, _ in self._schedule)
+        self.completed = 0
+        self.elapsed = 0
+        self._issued = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_time = None
+        self._error = None
+
+    def _caller(self, index, count, end_time):
+        schedule = self._schedule
+        pos = index
+        while not self._stop.is_set():
+            if end_time is not None and time.time() > end_time:
+                break
+            with self._lock:
+                if count is not None and self._issued >= count:
+                    break
+                self._issued += 1
+            name, operation = schedule[pos % len(schedule)]
+            pos += 1
+            stats = self.stats[name]
+            start = time.perf_counter()
+            try:
+                sent, received, payload, failed = operation(self.agent, self.timeout)
+            except Exception as err:
+                self._error = err
+                self._stop.set()
+                break
+            latency = time.perf_counter() - start
+            with self._lock:
+                stats.latency.append(latency)
+                stats.sent_bytes += sent
+                stats.received_bytes += received
+                stats.payload_bytes += payload
+                if failed:
+                    stats.errors += 1
+                self.completed += 1
+
+    def start(self, count=None, duration=None):
+        """
+        Start the callers in background
+
+        :param count: total number of commands, no limit if None
+        :param duration: seconds to run, no limit if None
+        """
+        self._stop.clear()
+        self._issued = 0
+        self._start_time = time.time()
+        end_time = self._start_time + duration if duration else None
+        self._threads = [
+            threading.Thread(
+                target=self._caller, args=(i, count, end_time), daemon=True
+            )
+            for i in range(self.callers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the callers to finish
+
+        :raise: the error of a failed command
+        """
+        for thread in self._threads:
+            thread.join(timeout)
+        self.elapsed = time.time() - self._start_time
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+    def run(self, count=None, duration=None):
+        """Run the commands in foreground, see start()"""
+        self.start(count, duration)
+        self.wait()
+        return self.summary()
+
+    def summary(self, percents=(50, 90, 99)):
+        """
+        Get the throughput and latency of the commands
+
+        :param percents: latency percentiles
+        :return: dict of ops, elapsed, ops_per_sec, bytes_per_sec and
+                 commands: {command: {count, errors, mean, bytes, payload,
+                 p50, ...}}, latency in seconds, bytes are the ones sent
+                 and received on the channel, payload is the file data
+        """
+        elapsed = self.elapsed or (time.time() - (self._start_time or time.time()))
+        commands = {}
+        ops = 0
+        total_bytes = 0
+        with self._lock:
+            for name, stats in self.stats.items():
+                latency = sorted(stats.latency)
+                ops += len(latency)
+                total_bytes += stats.sent_bytes + stats.received_bytes
+                item = {
+                    "count": len(latency),
+                    "errors": stats.errors,
+                    "mean": sum(latency) / len(latency) if latency else 0,
+                    "bytes": stats.sent_bytes + stats.received_bytes,
+                    "payload": stats.payload_bytes,
+                }
+                for percent in percents:
+                    item["p%s" % percent] = percentile(latency, percent)
+                commands[name] = item
+        return {
+            "ops": ops,
+            "elapsed": elapsed,
+            "ops_per_sec": ops / elapsed if elapsed else 0,
+            "bytes_per_sec": total_bytes / elapsed if elapsed else 0,
+            "commands": commands,
+        }
+
+    def log_summary(self, summary=None):
+        summary = summary or self.summary()
+        LOG_JOB.info(
+            "%s commands in %.2fs by %s callers: %.1f ops/s, %.1f bytes/s",
+            summary["ops"],
+            summary["elapsed"],
+            self.callers,
+            summary["ops_per_sec"],
+            summary["bytes_per_sec"],
+        )
+        elapsed = summary["elapsed"]
+        for name, item in summary["commands"].items():
+            LOG_JOB.info(
+                "%s: %s ops, %s errors, mean %.2fms, p50 %.2fms, p99 %.2fms, "
+                "payload %.2f MB/s",
+                name,
+                item["count"],
+                item["errors"],
+                item["mean"] * 1000,
+                item.get("p50", 0) * 1000,
+                item.get("p99", 0) * 1000,
+                item["payload"] / elapsed / 1024**2 if elapsed else 0,
+            )
+        return summary
+
+
+class MemorySampler(object):
+    """
+    Sample the memory usage of a guest process in background
+
+    Every sample is kept as a tuple of (time, ops, rss, private), so the
+    values of a sample are never matched with the ones of another.
+    """
+
+    def __init__(self, session, cmd, interval=1, counter=None):
+        """
+        :param session: guest session used only by the sampler
+        :param cmd: command printing the memory usage in KB, the first
+                    number is the RSS, the optional second one is the
+                    private bytes
+        :param interval: seconds between two samples
+        :param counter: callable returning the number of commands done
+        """
+        self.session = session
+        self.cmd = cmd
+        self.interval = interval
+        self.counter = counter
+        # list of (time, ops, rss, private)
+        self.samples = []
+        # whether the command prints the private bytes, by the first sample
+        self._with_private = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._error = None
+
+    def sample(self):
+        """
+        Get one sample
+
+        :return: tuple of (rss, private), private is None if not printed
+        """
+        output = self.session.cmd_output(self.cmd)
+        values = [int(v.replace(",", "")) for v in re.findall(r"\d[\d,]*", output)]
+        if not values:
+            raise ValueError("No memory usage in '%s': %s" % (self.cmd, output))
+        return values[0], values[1] if len(values) > 1 else None
+
+    def _record(self):
+        rss, private = self.sample()
+        now = time.time() - self._start_time
+        ops = self.counter() if self.counter else 0
+        if self._with_private is None:
+            self._with_private = private is not None
+        if self._with_private and private is None:
+            LOG_JOB.debug("No private bytes in the sample at %.1fs, drop it", now)
+            return
+        self.samples.append((now, ops, rss, private))
+
+    def _column(self, index):
+        return array("d", (sample[index] for sample in self.samples))
+
+    @property
+    def times(self):
+        return self._column(0)
+
+    @property
+    def ops(self):
+        return self._column(1)
+
+    @property
+    def rss(self):
+        return self._column(2)
+
+    @property
+    def private(self):
+        """The private bytes, empty if the command prints the RSS only"""
+        return self._column(3) if self._with_private else array("d")
+
+    def _run(self):
+        next_time = time.time()
+        while not self._stop.is_set():
+            try:
+                self._record()
+            except Exception as err:
+                self._error = err
+                break
+            next_time += self.interval
+            self._stop.wait(max(next_time - time.time(), 0))
+
+    def start(self):
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling, and take the last sample
+
+        :raise: the error of sampling
+        """
+        self._stop.set()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        self._record()
+
+    def fit(self, values="rss", by="times", skip=0):
+        """
+        Fit the slope of the memory usage
+
+        :param values: "rss" or "private", there is no private sample if
+                       the command prints the RSS only
+        :param by: "times" for KB per second, "ops" for KB per command
+        :param skip: number of the first samples skipped, e.g. warm up
+        :return: tuple of (slope, intercept, r2, standard error of slope)
+        """
+        return linear_fit(getattr(self, by)[skip:], getattr(self, values)[skip:])
@@ -0,0 +1,245 @@
+"""
+Module for indexing the QMP events received by a VM monitor.
+
+vm.monitor.get_events() returns a copy of the whole event backlog, so
+filtering it on every check is O(events x polls) in long stress runs.
+QMPEventIndex reads the backlog incrementally with a cursor, and keeps
+the events indexed by event name and by data.id/data.device/
+data.node-name with bounded retention. Waiters block on a condition
+variable, which is notified whenever new events are indexed.
+
+Available classes:
+- QMPEventIndex: Incremental, indexed view of the events of a monitor
+
+Available methods:
+- get_event_index: Get the shared event index of a VM(or QSD) monitor
+"""
+
+import collections
+import logging
+import threading
+import time
+import weakref
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+# keys of the event data used to index events
+INDEX_KEYS = ("id", "device", "node-name")
+
+
+class QMPEventIndex(object):
+    """Incremental, indexed view of the events received by a monitor"""
+
+    def __init__(self, monitor, retention=10000):
+        """
+        :param monitor: QMP monitor object
+        :param retention: max number of events kept in every index
+        """
+        self._monitor = monitor
+        self._retention = retention
+        self._cond = threading.Condition()
+        self._cursor = 0
+        self._last = None
+        self._listeners = []
+        self._pump = None
+        self._pump_stop = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self._events = collections.deque(maxlen=self._retention)
+        self._by_name = dict()
+        self._by_key = dict()
+
+    def _bucket(self, index, key):
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = collections.deque(maxlen=self._retention)
+        return bucket
+
+    def _index(self, event):
+        name = event.get("event")
+        data = event.get("data") or dict()
+        self._events.append(event)
+        self._bucket(self._by_name, name).append(event)
+        keys = set(data.get(k) for k in INDEX_KEYS)
+        for key in keys:
+            if isinstance(key, str):
+                self._bucket(self._by_key, (name, key)).append(event)
+
+    def _locate_last(self, events):
+        """Get the position right after the last indexed event, or 0"""
+        for idx in range(len(events) - 1, -1, -1):
+            if events[idx] == self._last:
+                return idx + 1
+        return 0
+
+    def update(self):
+        """
+        Index the events received since the last update
+
+        :return: list of the new events
+        """
+        with self._cond:
+            events = self._monitor.get_events()
+            start = self._cursor
+            if start and (len(events) < start or events[start - 1] != self._last):
+                # events were removed by clear_event(s), reindex the backlog
+                LOG_JOB.debug("QMP event backlog changed, rebuild the index")
+                start = self._locate_last(events)
+                self._reset()
+                for event in events[:start]:
+                    self._index(event)
+            new_events = events[start:]
+            for event in new_events:
+                self._index(event)
+            self._cursor = len(events)
+            self._last = events[-1] if events else None
+            listeners = list(self._listeners)
+            if new_events:
+                self._cond.notify_all()
+
+        for event in new_events:
+            for listener in listeners:
+                listener(event)
+        return new_events
+
+    def add_listener(self, listener, replay=False):
+        """
+        Call listener(event) for every event indexed from now on
+
+        :param listener: callable object
+        :param replay: call listener for the retained events at first
+        """
+        self.update()
+        with self._cond:
+            backlog = list(self._events) if replay else []
+            self._listeners.append(listener)
+        for event in backlog:
+            listener(event)
+
+    def remove_listener(self, listener):
+        with self._cond:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    @staticmethod
+    def _match(event, condition):
+        data = event.get("data")
+        if not condition:
+            return True
+        return bool(data) and all(item in data.items() for item in condition.items())
+
+    def _candidates(self, name, condition):
+        if name is None:
+            return self._events
+        for key in INDEX_KEYS:
+            value = condition.get(key)
+            if isinstance(value, str):
+                return self._by_key.get((name, value), ())
+        return self._by_name.get(name, ())
+
+    def get_events(self, name=None, **condition):
+        """
+        Get the indexed events in the order of arrival
+
+        :param name: event name, all events if None
+        :param condition: items the event data must contain
+        :return: list of events
+        """
+        self.update()
+        with self._cond:
+            return [
+                e
+                for e in self._candidates(name, condition)
+                if self._match(e, condition)
+            ]
+
+    def get_event(self, name, **condition):
+        """
+        Get the first indexed event matching the name and condition
+
+        :return: The event dict or None
+        """
+        self.update()
+        with self._cond:
+            return self._find(name, condition)
+
+    def _find(self, name, condition):
+        for event in self._candidates(name, condition):
+            if self._match(event, condition):
+                return event
+        return None
+
+    def wait_for_event(self, name, timeout, interval=0.1, **condition):
+        """
+        Block until an event matching the name and condition is received
+
+        :param name: event name
+        :param timeout: blocked timeout
+        :param interval: max interval between two checks of the monitor,
+                         the wait ends earlier when new events are indexed
+        :param condition: items the event data must contain
+        :return: The event dict or None
+        """
+        end_time = time.time() + timeout
+        while True:
+            if self._pump is None:
+                self.update()
+            with self._cond:
+                event = self._find(name, condition)
+                remaining = end_time - time.time()
+                if event is not None or remaining <= 0:
+                    return event
+                self._cond.wait(min(interval, remaining))
+
+    def start(self, interval=0.1):
+        """
+        Index events in a background thread, so waiters are woken up
+        as soon as the events are read from the monitor
+        """
+        if self._pump is not None:
+            return
+        self._pump_stop.clear()
+        self._pump = threading.Thread(
+            target=self._pump_events, args=(interval,), daemon=True
+        )
+        self._pump.start()
+
+    def stop(self):
+        """Stop the background thread started by start()"""
+        if self._pump is None:
+            return
+        self._pump_stop.set()
+        self._pump.join()
+        self._pump = None
+
+    def _pump_events(self, interval):
+        while not self._pump_stop.is_set():
+            try:
+                self.update()
+            except Exception as err:
+                LOG_JOB.debug("Failed to index QMP events: %s", err)
+                break
+            self._pump_stop.wait(interval)
+
+
+_event_indexes = weakref.WeakKeyDictionary()
+_event_indexes_lock = threading.Lock()
+
+
+def get_event_index(vm):
+    """
+    Get the event index shared by all the users of the VM monitor, a new
+    index is created when the monitor is recreated, e.g. VM restarted
+
+    :param vm: VM or QSD object
+    :return: QMPEventIndex object
+    """
+    monitor = vm.monitor
+    with _event_indexes_lock:
+        index = _event_indexes.get(monitor)
+        if index is None:
+            # a weak proxy, or the index would keep the monitor alive
+            index = QMPEventIndex(weakref.proxy(monitor))
+            _event_indexes[monitor] = index
+        return index
@@ -34,19 +34,43 @@ qsd.start_daemon()
 qsd.monitor.cmd("query-block-exports")
 # Stop the QSD
 qsd.stop_daemon()
+
+With qsd_pool = yes, the QSD is served by a warm daemon of QsdPool, which
+keeps the daemons running between tests, keyed by the capability set of
+the binary and the command lines. The images are attached to it over QMP
+when started and detached when stopped, instead of starting and killing a
+process every time. The idle daemons are stopped by QsdPool().drain(),
+which register_pool_drain() schedules at the end of the test unless
+qsd_pool_drain = no keeps them warm for the next test.
+
+Available classes:
+- QsdDaemonDev: QSD daemon device
+- QsdPool: Warm QSD daemons kept running between tests
+- QsdPoolSlot: A warm QSD daemon of the pool
+
+Available functions:
+- get_binary_info: Get the version and the help of a QSD binary
+- find_qsd_pids: Find the QSD processes using a monitor socket
+- open_pidfd: Open a pidfd of a process
+- pid_alive: Check whether a process is alive
+- drain_qsd_pool: Stop the idle daemons of the QSD pool
+- register_pool_drain: Drain the QSD pool at the end of the test
 """
 
 import copy
+import fcntl
+import hashlib
 import json
 import logging
 import os
 import re
+import select
 import signal
 import subprocess
 from enum import Enum, auto
 
 from avocado.utils import process
-from virttest import data_dir, qemu_monitor, qemu_storage, utils_misc
+from virttest import data_dir, funcatexit, qemu_monitor, qemu_storage, utils_misc
 from virttest.qemu_capabilities import Capabilities
 from virttest.qemu_devices import qdevices
 from virttest.qemu_devices.qdevices import QDaemonDev, QUnixSocketBus
@@ -69,6 +93,127 @@ class QsdError(Exception):
     pass
 
 
+# {real path of binary: [mtime, size, version, help]}
+_BINARY_INFO = {}
+
+
+def _binary_info_file():
+    return os.path.join(data_dir.get_data_dir(), "qsd", "binary_info.json")
+
+
+def _load_binary_infos():
+    try:
+        with open(_binary_info_file()) as cache:
+            return json.load(cache)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_binary_info(path, info):
+    filename = _binary_info_file()
+    tmp_file = "%s.%d" % (filename, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        infos = _load_binary_infos()
+        infos[path] = info
+        with open(tmp_file, "w") as cache:
+            json.dump(infos, cache)
+        # replace the file at once for the readers in other tests
+        os.replace(tmp_file, filename)
+    except (IOError, OSError) as e:
+        LOG_JOB.warning("Failed to cache the info of %s: %s", path, e)
+
+
+def get_binary_info(binary):
+    """
+    Get the version and the help of a QSD binary, they are probed once per
+    binary and cached in memory and in the QSD data dir, the cache is
+    dropped when the binary changes
+
+    :param binary: path of the QSD binary
+    :return: tuple of (version, help text)
+    """
+    path = os.path.realpath(binary)
+    stamp = None
+    if os.path.exists(path):
+        stamp = [os.path.getmtime(path), os.path.getsize(path)]
+        info = _BINARY_INFO.get(path) or _load_binary_infos().get(path)
+        if info and info[:2] == stamp:
+            _BINARY_INFO[path] = info
+            return info[2], info[3]
+
+    version = process.run(
+        "%s -V" % binary, verbose=False, ignore_status=True, shell=True
+    ).stdout_text.split()[2]
+    qsd_help = process.run(
+        "%s -h" % binary, verbose=False, ignore_status=True, shell=True
+    ).stdout_text
+    if stamp:
+        _BINARY_INFO[path] = stamp + [version, qsd_help]
+        _save_binary_info(path, _BINARY_INFO[path])
+    return version, qsd_help
+
+
+def find_qsd_pids(sock_path):
+    """
+    Find the QSD processes using a monitor socket from /proc
+
+    :param sock_path: path of the monitor socket
+    :return: list of pids
+    """
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/comm" % entry) as comm:
+                if not comm.read().startswith("qemu-storage-d"):
+                    continue
+            with open("/proc/%s/cmdline" % entry, "rb") as cmdline:
+                args = cmdline.read().decode(errors="replace")
+        except (IOError, OSError):
+            # the process exited
+            continue
+        if sock_path in args:
+            pids.append(int(entry))
+    return pids
+
+
+def open_pidfd(pid):
+    """
+    Open a pidfd of a process, it refers to the process even if the pid is
+    reused after the process exited
+
+    :param pid: process id
+    :return: file descriptor, None if pidfd is not supported
+    """
+    if pid is None or not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def pid_alive(pid, pidfd=None):
+    """
+    Check whether a process is alive
+
+    :param pid: process id
+    :param pidfd: pidfd of the process, /proc/<pid>/stat is checked if None
+    """
+    if pidfd is not None:
+        # a pidfd gets readable when the process exits
+        return not select.select([pidfd], [], [], 0)[0]
+    try:
+        with open("/proc/%d/stat" % pid) as stat:
+            data = stat.read()
+    except (IOError, OSError):
+        return False
+    # state is the field following the comm in parentheses, Z is a zombie
+    return data[data.rindex(")") + 2] != "Z"
+
+
 def add_vubp_into_boot(img_name, params, addr=15, opts=""):
     """Add vhost-user-blk-pci device into boot command line"""
     devs = create_vubp_devices(None, img_name, params)
@@ -190,6 +335,203 @@ def unplug_vubp_devices(vm, img_name, params, bus=None):
                 LOG_JOB.info("Ignore device %s Can not be found", dev.get_qid())
 
 
+def _nbd_server_args(nbd_server):
+    # --nbd-server takes a flat SocketAddress, nbd-server-start the legacy one
+    args = dict(nbd_server)
+    addr = dict(args["addr"])
+    args["addr"] = {"type": addr.pop("type"), "data": addr}
+    return args
+
+
+class QsdPoolSlot(object):
+    """A warm QSD daemon of the pool, it is used by the holder of its lock"""
+
+    monitor_id = "qsd_monitor_pool"
+
+    def __init__(self, path):
+        """
+        :param path: directory of the slot
+        """
+        self.path = path
+        self.sock_path = os.path.join(path, "monitor.sock")
+        self.pidfile = os.path.join(path, "qsd.pid")
+        self.logfile = os.path.join(path, "qsd.log")
+        self.pid = None
+        self._lock = None
+
+    def lock(self):
+        """
+        Lock the slot, the lock is released by the system if the holder
+        terminates, so a daemon is never left locked by a crashed test
+
+        :return: True if locked, False if locked by another holder
+        """
+        fd = os.open(os.path.join(self.path, "lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            return False
+        self._lock = fd
+        return True
+
+    def unlock(self):
+        fd, self._lock = self._lock, None
+        if fd is not None:
+            os.close(fd)
+
+    def get_pid(self):
+        """:return: pid of the daemon of the slot, None if not running"""
+        pids = find_qsd_pids(self.sock_path)
+        return pids[0] if pids else None
+
+    def start(self, qsd, timeout=30):
+        """
+        Start a daemon without images in the slot, it is detached from the
+        test so it keeps running when the test finishes
+
+        :param qsd: QsdDaemonDev object of the binary and the command lines
+        :param timeout: timeout of the monitor socket to get ready
+        """
+        if os.path.exists(self.sock_path):
+            os.unlink(self.sock_path)
+        cmd = "%s --chardev socket,server=on,wait=off,path=%s,id=%s" % (
+            qsd.binary,
+            self.sock_path,
+            self.monitor_id,
+        )
+        cmd += " --monitor chardev=%s,mode=control " % self.monitor_id
+        for line in qsd.qsd_params.get("qsd_cmd_lines", "").split(";"):
+            cmd += line
+        if qsd.check_capability(Flags.PIDFILE):
+            cmd += " --pidfile %s" % self.pidfile
+        LOG_JOB.info("Start pooled QSD: %s", cmd.replace(" --", " \\\n --"))
+
+        if qsd.check_capability(Flags.DAEMONIZE):
+            ret = subprocess.call(cmd + " --daemonize", shell=True)
+            if ret:
+                raise QsdError("Failed run pooled QSD daemonize: %d" % ret)
+        else:
+            # run it in background of a shell, so it is not a child of the test
+            subprocess.call(
+                "%s </dev/null >>%s 2>&1 &" % (cmd, self.logfile),
+                shell=True,
+                start_new_session=True,
+            )
+            if not utils_misc.wait_for(
+                lambda: os.path.exists(self.sock_path), timeout, step=0.1
+            ):
+                raise QsdError("Pooled QSD is not ready, see %s" % self.logfile)
+        # the parent of --daemonize may be still exiting
+        pids = utils_misc.wait_for(
+            lambda: len(find_qsd_pids(self.sock_path)) == 1, timeout, step=0.1
+        )
+        if not pids:
+            raise QsdError("Can not find pooled QSD of %s" % self.sock_path)
+        self.pid = self.get_pid()
+
+
+class QsdPool(object):
+    """
+    Warm QSD daemons kept running between tests, keyed by capability set,
+    i.e. the binary, its capabilities and the QSD command lines
+    """
+
+    def __init__(self, basedir=None, size=2):
+        """
+        :param basedir: directory of the pool
+        :param size: max number of daemons of a capability set
+        """
+        if basedir is None:
+            basedir = os.path.join(data_dir.get_data_dir(), "qsd", "pool")
+        self.basedir = basedir
+        self.size = size
+
+    @staticmethod
+    def capability_key(qsd):
+        """:return: key of the capability set of a QsdDaemonDev object"""
+        caps = [flag.name for flag in Flags if qsd.check_capability(flag)]
+        data = [
+            os.path.realpath(qsd.binary),
+            qsd.qsd_version,
+            caps,
+            qsd.qsd_params.get("qsd_cmd_lines", ""),
+        ]
+        # keep it short for the socket paths
+        return hashlib.sha1(json.dumps(data).encode()).hexdigest()[:12]
+
+    def acquire(self, qsd):
+        """
+        Lock an idle daemon of the capability set of a QSD, the daemon is
+        started if not running yet
+
+        :param qsd: QsdDaemonDev object
+        :return: locked QsdPoolSlot object, None if all daemons are in use
+        """
+        key = self.capability_key(qsd)
+        for index in range(self.size):
+            path = os.path.join(self.basedir, key, str(index))
+            os.makedirs(path, exist_ok=True)
+            slot = QsdPoolSlot(path)
+            if not slot.lock():
+                continue
+            try:
+                slot.pid = slot.get_pid()
+                if slot.pid is not None and not os.path.exists(slot.sock_path):
+                    LOG_JOB.info("Pooled QSD %s lost its monitor, stop it", path)
+                    utils_misc.kill_process_tree(slot.pid, signal.SIGKILL, timeout=60)
+                    slot.pid = None
+                if slot.pid is None:
+                    slot.start(qsd)
+                else:
+                    LOG_JOB.info("Reuse pooled QSD %s (PID %s)", path, slot.pid)
+            except Exception:
+                slot.unlock()
+                raise
+            return slot
+        LOG_JOB.info("All pooled QSD of %s are in use", key)
+        return None
+
+    def drain(self):
+        """Stop the idle daemons of the pool"""
+        if not os.path.isdir(self.basedir):
+            return
+        for key in os.listdir(self.basedir):
+            for index in os.listdir(os.path.join(self.basedir, key)):
+                slot = QsdPoolSlot(os.path.join(self.basedir, key, index))
+                if not slot.lock():
+                    continue
+                try:
+                    pid = slot.get_pid()
+                    if pid is not None:
+                        LOG_JOB.info("Stop pooled QSD %s (PID %s)", slot.path, pid)
+                        utils_misc.kill_process_tree(pid, signal.SIGTERM, timeout=60)
+                finally:
+                    slot.unlock()
+
+
+def drain_qsd_pool():
+    """Stop the idle daemons of the QSD pool"""
+    QsdPool().drain()
+
+
+def register_pool_drain(env, params):
+    """
+    Drain the QSD pool at the end of the test if any QSD of the test is
+    pooled, unless qsd_pool_drain = no keeps the daemons for the next test
+
+    :param env: Dictionary with test environment
+    :param params: Dictionary with the test parameters
+    """
+    pooled = [
+        name
+        for name in params.objects("qsd_namespaces")
+        if params.object_params(name).get("qsd_pool", "no") == "yes"
+    ]
+    if pooled and params.get("qsd_pool_drain", "yes") == "yes":
+        funcatexit.register(env, params.get("type"), drain_qsd_pool)
+
+
 class QsdDaemonDev(QDaemonDev):
     # Default data struct of raw image data.
     raw_image_data = {
@@ -236,12 +578,7 @@ class QsdDaemonDev(QDaemonDev):
         self.binary = binary
         self.sock_path = sock_path
         self.qsd_monitor_id = qsd_monitor_id
-        self.qsd_version = process.run(
-            "%s -V" % binary, verbose=False, ignore_status=True, shell=True
-        ).stdout_text.split()[2]
-        self.__qsd_help = process.run(
-            "%s -h" % binary, verbose=False, ignore_status=True, shell=True
-        ).stdout_text
+        self.qsd_version, self.__qsd_help = get_binary_info(binary)
 
         LOG_JOB.info(self.qsd_version)
         self.caps = Capabilities()
@@ -250,6 +587,9 @@ class QsdDaemonDev(QDaemonDev):
         self.daemonize = False
         self.pidfile = None
         self.pid = None
+        self._pidfd = None
+        self.pool_slot = None
+        self._pool_objects = set()
 
     def _remove_images(self):
         for img in self.images.values():
@@ -355,26 +695,137 @@ class QsdDaemonDev(QDaemonDev):
 
     def get_pid(self):
         """Get QSD pid"""
-        if self.daemonize:
+        if self.daemonize or self.pool_slot:
             return self.pid
         if self.daemon_process:
             return self.daemon_process.get_pid()
 
+    def _qom_objects(self):
+        objects = self.monitor.cmd("qom-list", {"path": "/objects"})
+        return set(o["name"] for o in objects if o["type"].startswith("child<"))
+
+    def _attach_image(self, img_info):
+        """Attach an image to the running QSD over QMP"""
+        for node in ("protocol", "format", "filter"):
+            if node != "filter" or img_info["filter"]["driver"]:
+                self.monitor.cmd("blockdev-add", img_info[node])
+        if img_info["nbd-server"]["addr"]:
+            self.monitor.cmd(
+                "nbd-server-start", _nbd_server_args(img_info["nbd-server"])
+            )
+        self.monitor.cmd("block-export-add", img_info["export"])
+
+    def _start_pooled(self, pool):
+        """
+        Start the QSD on a warm daemon of the pool
+
+        :return: False if all the daemons of the pool are in use
+        """
+        slot = pool.acquire(self)
+        if slot is None:
+            return False
+        self.pool_slot = slot
+        self.sock_path = slot.sock_path
+        self.qsd_params["monitor_filename"] = slot.sock_path
+        if self.check_capability(Flags.PIDFILE):
+            self.pidfile = slot.pidfile
+        self.pid = slot.pid
+        self._pidfd = open_pidfd(self.pid)
+        try:
+            self.monitor = qemu_monitor.QMPMonitor(self, self.name, self.qsd_params)
+            self._pool_objects = self._qom_objects()
+            for img in self.qsd_params.get("qsd_images", "").split():
+                params = self.qsd_params.object_params(img)
+                self._attach_image(self._fulfil_image_props(img, params))
+        except Exception:
+            self._release_pooled()
+            raise
+        LOG_JOB.info("Started QSD %s on pooled PID %s", self.name, self.pid)
+        return True
+
+    def _reset_pooled(self):
+        """
+        Detach the exports, block nodes and objects added since the QSD
+        started on the pooled daemon
+
+        :return: True if the daemon is as clean as acquired
+        """
+        monitor = self.monitor
+        if monitor.cmd("query-block-jobs"):
+            return False
+        for export in monitor.cmd("query-block-exports"):
+            monitor.cmd("block-export-del", {"id": export["id"]})
+        # the exports are deleted after their clients disconnect
+        if not utils_misc.wait_for(
+            lambda: not monitor.cmd("query-block-exports"), timeout=30, step=0.2
+        ):
+            return False
+        try:
+            monitor.cmd("nbd-server-stop")
+        except qemu_monitor.QMPCmdError:
+            # the NBD server is not running
+            pass
+        nodes = None
+        while True:
+            named = [
+                node["node-name"]
+                for node in monitor.cmd("query-named-block-nodes", {"flat": True})
+                if not node["node-name"].startswith("#")
+            ]
+            if not named:
+                break
+            if named == nodes:
+                # nothing could be deleted
+                return False
+            nodes = named
+            for node in nodes:
+                try:
+                    monitor.cmd("blockdev-del", {"node-name": node})
+                except qemu_monitor.QMPCmdError:
+                    # it is still used by another node
+                    pass
+        for obj in self._qom_objects() - self._pool_objects:
+            monitor.cmd("object-del", {"id": obj})
+        return self._qom_objects() == self._pool_objects
+
+    def _release_pooled(self):
+        """Return the pooled daemon if it is clean, otherwise stop it"""
+        try:
+            clean = False
+            if self.is_daemon_alive() and self.monitor:
+                try:
+                    clean = self._reset_pooled()
+                except Exception as e:
+                    LOG_JOB.warning("Failed to reset pooled QSD: %s", e)
+            if clean:
+                LOG_JOB.info("Return QSD %s to the pool", self.name)
+                self.monitor.close()
+                self.monitor = None
+            else:
+                LOG_JOB.info("Pooled QSD of %s is not reusable, stop it", self.name)
+                self._destroy()
+        finally:
+            self.pool_slot.unlock()
+            self.pool_slot = None
+
     def start_daemon(self):
         """Start the QSD daemon in background."""
         params = self.qsd_params.object_params(self.name)
-        # check exist QSD
-        get_pid_cmd = "ps -e ww|grep qemu-storage-d|grep %s|" % self.sock_path
-        get_pid_cmd += "grep -v grep|awk '{print $1}'"
-        pid = process.system_output(get_pid_cmd, shell=True).decode()
+        if params.get("qsd_pool", "no") == "yes":
+            pool = QsdPool(size=params.get_numeric("qsd_pool_size", 2))
+            if self._start_pooled(pool):
+                return
 
-        if pid:
+        # check exist QSD
+        pids = find_qsd_pids(self.sock_path)
+        if pids:
             if params.get("qsd_force_create", "yes") == "yes":
                 # Kill exist QSD
-                LOG_JOB.info("Find running QSD:%s, force killing", pid)
-                utils_misc.kill_process_tree(int(pid), 9, timeout=60)
+                LOG_JOB.info("Find running QSD:%s, force killing", pids)
+                for pid in pids:
+                    utils_misc.kill_process_tree(pid, 9, timeout=60)
             else:
-                raise QsdError("Find running QSD:%s" % pid)
+                raise QsdError("Find running QSD:%s" % pids)
 
         # QSD monitor
         qsd_cmd = "%s --chardev socket,server=on,wait=off,path=%s,id=%s" % (
@@ -442,31 +893,29 @@ class QsdDaemonDev(QDaemonDev):
                 self.daemon_process.get_pid(),
             )
 
-        pid = process.system_output(get_pid_cmd, shell=True).decode()
+        pids = find_qsd_pids(self.sock_path)
+        pid = pids[0] if pids else None
 
         if not pid:
             LOG_JOB.info("Can not Find running QSD %s ", self.name)
 
         if self.pidfile:
-            file_pid = process.system_output(
-                "cat %s" % self.pidfile, shell=True
-            ).decode()
-            if file_pid != pid:
+            with open(self.pidfile) as pidfile:
+                file_pid = pidfile.read().strip()
+            if file_pid != str(pid):
                 raise QsdError("Find mismatch pid: %s %s" % (pid, file_pid))
 
         self.pid = pid
+        self._pidfd = open_pidfd(pid)
 
         monitor = qemu_monitor.QMPMonitor(self, self.name, self.qsd_params)
         monitor.info_block()
         self.monitor = monitor
 
     def is_daemon_alive(self):
-        if self.daemonize:
-            check_pid_cmd = "ps -q %s" % self.pid
+        if self.daemonize or self.pool_slot:
             if self.pid:
-                return (
-                    process.system(check_pid_cmd, shell=True, ignore_status=True) == 0
-                )
+                return pid_alive(self.pid, self._pidfd)
             return False
 
         return super(QsdDaemonDev, self).is_daemon_alive()
@@ -514,9 +963,15 @@ class QsdDaemonDev(QDaemonDev):
 
     def stop_daemon(self):
         try:
-            self._destroy()
-            super(QsdDaemonDev, self).stop_daemon()
+            if self.pool_slot:
+                self._release_pooled()
+            else:
+                self._destroy()
+                super(QsdDaemonDev, self).stop_daemon()
         finally:
+            if self._pidfd is not None:
+                os.close(self._pidfd)
+                self._pidfd = None
             self._remove_images()
 
     def check_capability(self, flag):
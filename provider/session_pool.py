@@ -0,0 +1,257 @@
+"""
+Module for pooling the shell sessions logged in to a guest.
+
+Every vm.wait_for_login() pays for a full remote login, multi-step tests
+often log in again for every single command. GuestSessionPool keeps the
+released sessions and leases them again after a cheap health check, a
+session is dropped when it died, e.g. the guest rebooted, or when the
+qemu process of the VM changed. The number of concurrent logins to a VM
+is limited, so sshd does not drop connections under its MaxStartups.
+
+Available classes:
+- GuestSessionPool: Pool of the shell sessions of a VM
+
+Available functions:
+- get_session_pool: Get the shared session pool of a VM
+"""
+
+import contextlib
+import logging
+import threading
+import time
+import weakref
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+
+class GuestSessionPool(object):
+    """Pool of the shell sessions logged in to a VM"""
+
+    def __init__(
+        self,
+        vm,
+        login_timeout=360,
+        max_logins=2,
+        max_idle=2,
+        max_sessions=0,
+        health_timeout=5,
+    ):
+        """
+        :param vm: VM object
+        :param login_timeout: timeout of a login
+        :param max_logins: max number of concurrent logins to the VM
+        :param max_idle: max number of idle sessions kept in the pool
+        :param max_sessions: max number of leased sessions, 0 for no limit
+        :param health_timeout: timeout of the health check of a session
+        """
+        # a weak proxy, or the shared pool would keep the VM alive
+        self.vm = weakref.proxy(vm)
+        self.login_timeout = login_timeout
+        self.max_idle = max_idle
+        self.health_timeout = health_timeout
+        self._idle = []
+        self._leased = dict()
+        self._lock = threading.Lock()
+        self._logins = threading.BoundedSemaphore(max_logins)
+        self._leases = None
+        if max_sessions:
+            self._leases = threading.BoundedSemaphore(max_sessions)
+        self._vm_pid = self._get_vm_pid()
+        self.login_time = array("d")
+        self.lease_count = 0
+        self.reuse_count = 0
+        self.drop_count = 0
+
+    def _get_vm_pid(self):
+        try:
+            return self.vm.get_pid()
+        except Exception:
+            return None
+
+    def _login(self):
+        with self._logins:
+            start = time.time()
+            session = self.vm.wait_for_login(timeout=self.login_timeout)
+            elapsed = time.time() - start
+        with self._lock:
+            self.login_time.append(elapsed)
+        LOG_JOB.debug("Logged in to %s in %.2fs", self.vm.name, elapsed)
+        return session
+
+    def _is_healthy(self, session):
+        if not session.is_alive():
+            return False
+        token = "session-pool-%s" % id(session)
+        try:
+            output = session.cmd_output("echo %s" % token, timeout=self.health_timeout)
+        except Exception as err:
+            LOG_JOB.debug("Session health check failed: %s", err)
+            return False
+        return token in output
+
+    def _close(self, session):
+        # the instance attribute replaced close() when leasing
+        session.__dict__.pop("close", None)
+        try:
+            session.close()
+        except Exception as err:
+            LOG_JOB.debug("Failed to close session: %s", err)
+
+    def _drop_stale(self):
+        """Drop the idle sessions if the qemu process of the VM changed"""
+        pid = self._get_vm_pid()
+        with self._lock:
+            if pid == self._vm_pid:
+                return
+            LOG_JOB.debug("VM %s restarted, drop idle sessions", self.vm.name)
+            self._vm_pid = pid
+            stale, self._idle = self._idle, []
+            self.drop_count += len(stale)
+        for session in stale:
+            self._close(session)
+
+    def acquire(self, timeout=None):
+        """
+        Lease a healthy session, log in if no idle session can be reused,
+        session.close() of the leased session releases it to the pool.
+
+        :param timeout: timeout to wait for a lease if max_sessions is
+                        reached, None to wait forever
+        :return: ShellSession object
+        """
+        self.vm.verify_alive()
+        if self._leases is not None:
+            if not self._leases.acquire(timeout=timeout):
+                raise RuntimeError(
+                    "Timeout to lease a session of %s in %ss" % (self.vm.name, timeout)
+                )
+        try:
+            self._drop_stale()
+            session = None
+            while True:
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+                if candidate is None:
+                    session = self._login()
+                    break
+                if self._is_healthy(candidate):
+                    session = candidate
+                    with self._lock:
+                        self.reuse_count += 1
+                    break
+                with self._lock:
+                    self.drop_count += 1
+                self._close(candidate)
+        except Exception:
+            if self._leases is not None:
+                self._leases.release()
+            raise
+
+        with self._lock:
+            self.lease_count += 1
+            self._leased[id(session)] = session
+        session.close = lambda *args, **kwargs: self.release(session)
+        return session
+
+    def release(self, session):
+        """
+        Give back a leased session, it is closed if it died or the pool
+        is full
+
+        :param session: session leased by acquire()
+        """
+        with self._lock:
+            if self._leased.pop(id(session), None) is None:
+                return
+            keep = len(self._idle) < self.max_idle and session.is_alive()
+            if keep:
+                self._idle.append(session)
+        if self._leases is not None:
+            self._leases.release()
+        if not keep:
+            self._close(session)
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        """Context manager of a leased session"""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def invalidate(self):
+        """Close the idle sessions, e.g. after the guest rebooted"""
+        with self._lock:
+            stale, self._idle = self._idle, []
+            self.drop_count += len(stale)
+        for session in stale:
+            self._close(session)
+
+    def close(self):
+        """Close all sessions, including the leased ones"""
+        self.invalidate()
+        with self._lock:
+            leased = list(self._leased.values())
+            self._leased.clear()
+        for session in leased:
+            if self._leases is not None:
+                self._leases.release()
+            self._close(session)
+
+    def stats(self):
+        """
+        Get the counters of the pool
+
+        :return: dict of leases, logins, reuses, drops, reuse_rate,
+                 login_avg and login_max in seconds
+        """
+        with self._lock:
+            logins = len(self.login_time)
+            return {
+                "leases": self.lease_count,
+                "logins": logins,
+                "reuses": self.reuse_count,
+                "drops": self.drop_count,
+                "reuse_rate": (
+                    self.reuse_count / self.lease_count if self.lease_count else 0
+                ),
+                "login_avg": sum(self.login_time) / logins if logins else 0,
+                "login_max": max(self.login_time) if logins else 0,
+            }
+
+    def report(self):
+        stats = self.stats()
+        LOG_JOB.info(
+            "Sessions of %s: %s leases, %s logins(avg %.2fs, max %.2fs), "
+            "reuse rate %.1f%%, %s dropped",
+            self.vm.name,
+            stats["leases"],
+            stats["logins"],
+            stats["login_avg"],
+            stats["login_max"],
+            stats["reuse_rate"] * 100,
+            stats["drops"],
+        )
+        return stats
+
+
+_session_pools = weakref.WeakKeyDictionary()
+_session_pools_lock = threading.Lock()
+
+
+def get_session_pool(vm, **kwargs):
+    """
+    Get the session pool shared by all the users of the VM
+
+    :param vm: VM object
+    :param kwargs: arguments of GuestSessionPool used when it is created
+    :return: GuestSessionPool object
+    """
+    with _session_pools_lock:
+        pool = _session_pools.get(vm)
+        if pool is None:
+            pool = GuestSessionPool(vm, **kwargs)
+            _session_pools[vm] = pool
+        return pool
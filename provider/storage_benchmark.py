@@ -24,6 +24,8 @@ from avocado import TestError
 from virttest import data_dir, utils_misc
 from virttest.remote import scp_to_remote
 
+from provider.fio_stream import iter_session_fio_json
+
 LOG_JOB = logging.getLogger("avocado.test")
 
 GIT_DOWNLOAD = "git"
@@ -441,6 +443,32 @@ class Fio(StorageBenchmark):
         cmd = " ".join((self.cfg.fio_path, cmd_options))
         return super(Fio, self).run(cmd, timeout)
 
+    def iter_json(self, cmd_options, timeout=1800):
+        """
+        Run fio test inside guest, yield the JSON reports as they arrive,
+        e.g. every interval with --status-interval.
+
+        :param cmd_options: fio command options, --output-format=json is
+                            appended if it's not set
+        :type cmd_options: str
+        :return: generator of the fio JSON objects, closing it before fio
+                 finished interrupts fio
+        """
+        if "--output-format" not in cmd_options:
+            cmd_options += " --output-format=json"
+        cmd = " ".join((self.cfg.fio_path, cmd_options))
+        return iter_session_fio_json(self.session, cmd, timeout)
+
+    def run_json(self, cmd_options, timeout=1800):
+        """
+        Run fio test inside guest, return the list of fio JSON objects.
+
+        :param cmd_options: fio command options
+        :type cmd_options: str
+        :rtype: list
+        """
+        return list(self.iter_json(cmd_options, timeout))
+
 
 def generate_instance(params, vm, name):
     """
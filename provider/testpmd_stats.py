@@ -0,0 +1,300 @@
+"""
+Module for analyzing the port statistics of testpmd sampled during a run.
+
+A single "show port stats all" at the end of a run reports the rate of
+the last interval only, which may still be in the warm-up or hit a
+hiccup. PortStatsSeries keeps the cumulative counters of the ports, and
+of their queues read from "show port xstats all", sampled at a fixed
+interval. The rates are computed from the counter deltas, the warm-up
+is detected as the samples before the rolling mean settles, and the
+steady-state Mpps, the jitter and the drop rate are computed over the
+rest. zero_loss_search() finds the highest offered load without loss by
+a binary search over a measure callable.
+
+Available classes:
+- PortStatsSeries: Time series of the counters of testpmd ports
+
+Available functions:
+- parse_port_stats: Parse the output of "show port stats all"
+- parse_xstats: Parse the per queue counters of "show port xstats all"
+- detect_warmup: Index of the first sample of the steady state
+- zero_loss_search: Binary search of the highest rate without loss
+"""
+
+import json
+import logging
+import re
+import statistics
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+_PORT_RE = re.compile(r"NIC statistics for port (\d+)")
+_XSTATS_PORT_RE = re.compile(r"NIC extended statistics for port (\d+)")
+_COUNTER_RE = re.compile(r"\b([RT]X-[a-z]+):\s+(\d+)")
+_QUEUE_RE = re.compile(r"\b(rx|tx)_q(\d+)_(\w+):\s+(\d+)")
+
+# counters of the packets lost, by direction
+DROP_COUNTERS = {
+    "rx": ("rx_missed", "rx_errors", "rx_nombuf"),
+    "tx": ("tx_errors",),
+}
+_QUEUE_PACKETS = ("packets", "good_packets")
+_QUEUE_DROPS = ("errors", "dropped", "missed")
+
+
+def _split_ports(output, pattern):
+    chunks = pattern.split(output)
+    # chunks: [head, port, body, port, body, ...]
+    return [(int(chunks[i]), chunks[i + 1]) for i in range(1, len(chunks) - 1, 2)]
+
+
+def parse_port_stats(output):
+    """
+    Parse the output of "show port stats all"
+
+    :param output: testpmd output
+    :return: dict of {port: {counter: value}}, the counters are named
+             like rx_packets, rx_missed and tx_errors
+    """
+    stats = {}
+    for port, body in _split_ports(output, _PORT_RE):
+        stats[port] = dict(
+            (name.lower().replace("-", "_"), int(value))
+            for name, value in _COUNTER_RE.findall(body)
+        )
+    return stats
+
+
+def parse_xstats(output):
+    """
+    Parse the per queue counters of "show port xstats all"
+
+    :param output: testpmd output
+    :return: dict of {port: {(direction, queue): {packets, drops}}}
+    """
+    stats = {}
+    for port, body in _split_ports(output, _XSTATS_PORT_RE):
+        queues = stats.setdefault(port, {})
+        for direction, queue, name, value in _QUEUE_RE.findall(body):
+            counters = queues.setdefault((direction, int(queue)), {})
+            if name in _QUEUE_PACKETS:
+                # prefer the good packets if the driver reports both
+                if name == "good_packets" or "packets" not in counters:
+                    counters["packets"] = int(value)
+            elif name in _QUEUE_DROPS:
+                counters["drops"] = counters.get("drops", 0) + int(value)
+    return stats
+
+
+def detect_warmup(rates, window=3, tolerance=0.05):
+    """
+    Find the first sample of the steady state, i.e. every rolling mean of
+    window samples from it on is within tolerance of the steady rate, the
+    median of the second half of the samples
+
+    :param rates: sequence of rates
+    :param window: number of samples of the rolling mean
+    :param tolerance: relative deviation allowed from the steady rate
+    :return: index of the first steady sample
+    """
+    num = len(rates)
+    if num <= window:
+        return 0
+    steady = statistics.median(rates[num // 2 :])
+    band = abs(steady) * tolerance
+    start = num // 2
+    for index in range(num - window, -1, -1):
+        mean = sum(rates[index : index + window]) / window
+        if abs(mean - steady) > band:
+            break
+        start = index
+    return min(start, num // 2)
+
+
+class PortStatsSeries(object):
+    """Time series of the cumulative counters of testpmd ports"""
+
+    def __init__(self):
+        self.times = array("d")
+        self.ports = {}
+        self.queues = {}
+
+    def add(self, when, stats, xstats=None):
+        """
+        Add a sample
+
+        :param when: time of the sample in seconds
+        :param stats: dict returned by parse_port_stats()
+        :param xstats: dict returned by parse_xstats()
+        """
+        index = len(self.times)
+        self.times.append(when)
+        for port, counters in stats.items():
+            series = self.ports.setdefault(port, {})
+            for name, value in counters.items():
+                # a counter appearing late is zero before
+                series.setdefault(name, array("d", [0] * index)).append(value)
+        for port, queues in (xstats or {}).items():
+            for queue, counters in queues.items():
+                series = self.queues.setdefault((port,) + queue, {})
+                for name, value in counters.items():
+                    series.setdefault(name, array("d", [0] * index)).append(value)
+
+    def __len__(self):
+        return len(self.times)
+
+    def rates(self, counters):
+        """
+        Get the rates of a counter between the samples
+
+        :param counters: array of the cumulative values of the counter
+        :return: array of the rates per second
+        """
+        rates = array("d")
+        for i in range(1, len(self.times)):
+            elapsed = self.times[i] - self.times[i - 1]
+            rates.append((counters[i] - counters[i - 1]) / elapsed if elapsed else 0)
+        return rates
+
+    def _steady(self, packets, drops, window, tolerance):
+        rates = self.rates(packets)
+        if not rates:
+            return None
+        warmup = detect_warmup(rates, window, tolerance)
+        steady = rates[warmup:]
+        mean = sum(steady) / len(steady)
+        jitter = statistics.pstdev(steady) / mean if mean else 0
+        first, last = warmup, len(self.times) - 1
+        passed = packets[last] - packets[first]
+        lost = sum(c[last] - c[first] for c in drops)
+        return {
+            "mpps": mean / 10**6,
+            "min_mpps": min(steady) / 10**6,
+            "max_mpps": max(steady) / 10**6,
+            "jitter": jitter,
+            "drop_rate": lost / (passed + lost) if passed + lost else 0,
+            "warmup": self.times[warmup] - self.times[0],
+            "samples": len(steady),
+        }
+
+    def steady_state(self, direction="rx", window=3, tolerance=0.05):
+        """
+        Get the steady state of every port and queue
+
+        :param direction: "rx" or "tx"
+        :param window: number of samples of the rolling mean of warm-up
+        :param tolerance: relative deviation of the steady state
+        :return: dict of ports: {port: stats} and queues: {(port, queue):
+                 stats}, stats is a dict of mpps, min_mpps, max_mpps,
+                 jitter (coefficient of variation), drop_rate, warmup in
+                 seconds and samples
+        """
+        result = {"ports": {}, "queues": {}}
+        for port, series in self.ports.items():
+            packets = series.get("%s_packets" % direction)
+            if packets is None:
+                continue
+            drops = [series[c] for c in DROP_COUNTERS[direction] if c in series]
+            stats = self._steady(packets, drops, window, tolerance)
+            if stats:
+                result["ports"][port] = stats
+        for (port, queue_dir, queue), series in self.queues.items():
+            if queue_dir != direction or "packets" not in series:
+                continue
+            drops = [series["drops"]] if "drops" in series else []
+            stats = self._steady(series["packets"], drops, window, tolerance)
+            if stats:
+                result["queues"][(port, queue)] = stats
+        return result
+
+    def log_steady_state(self, direction="rx", window=3, tolerance=0.05):
+        result = self.steady_state(direction, window, tolerance)
+        for kind, items in (("port", result["ports"]), ("queue", result["queues"])):
+            for name, stats in sorted(items.items()):
+                LOG_JOB.info(
+                    "%s %s %s: %.3f Mpps(%.3f-%.3f), jitter %.2f%%, drop %.4f%%, "
+                    "warm-up %.1fs",
+                    direction,
+                    kind,
+                    name,
+                    stats["mpps"],
+                    stats["min_mpps"],
+                    stats["max_mpps"],
+                    stats["jitter"] * 100,
+                    stats["drop_rate"] * 100,
+                    stats["warmup"],
+                )
+        return result
+
+    def to_json(self):
+        return {
+            "times": list(self.times),
+            "ports": dict(
+                (str(port), dict((k, list(v)) for k, v in series.items()))
+                for port, series in self.ports.items()
+            ),
+            "queues": dict(
+                ("%s/%s/%s" % key, dict((k, list(v)) for k, v in series.items()))
+                for key, series in self.queues.items()
+            ),
+        }
+
+    def save(self, filename):
+        with open(filename, "w") as output:
+            json.dump(self.to_json(), output)
+        return filename
+
+    @classmethod
+    def from_lines(cls, lines, prefix="PORT_STATS"):
+        """
+        Load the samples printed as "<prefix> <time> <json of the port
+        counters>" lines, e.g. by start_testpmd.py
+
+        :param lines: iterable of lines
+        :param prefix: prefix of the sample lines
+        """
+        series = cls()
+        for line in lines:
+            if not line.startswith(prefix + " "):
+                continue
+            _, when, data = line.split(" ", 2)
+            stats = dict((int(port), c) for port, c in json.loads(data).items())
+            series.add(float(when), stats)
+        return series
+
+
+def zero_loss_search(measure, low, high, resolution=0.01, max_loss=0.0):
+    """
+    Find the highest rate between low and high without loss, the loss
+    must grow with the rate
+
+    :param measure: callable of a rate returning the loss ratio
+    :param low: lowest rate
+    :param high: highest rate
+    :param resolution: search until the interval is below this ratio of
+                       the high rate
+    :param max_loss: highest loss ratio taken as no loss
+    :return: tuple of (the rate, 0 if even low has loss, list of trials
+             (rate, loss))
+    """
+    trials = []
+
+    def passed(rate):
+        loss = measure(rate)
+        trials.append((rate, loss))
+        LOG_JOB.info("Offered %.0f pps, loss %.6f%%", rate, loss * 100)
+        return loss <= max_loss
+
+    if passed(high):
+        return high, trials
+    if not passed(low):
+        return 0, trials
+    good, bad = low, high
+    while bad - good > high * resolution:
+        rate = (good + bad) / 2.0
+        if passed(rate):
+            good = rate
+        else:
+            bad = rate
+    return good, trials
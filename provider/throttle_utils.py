@@ -2,22 +2,27 @@
 Module for IO throttling relevant interfaces.
 """
 
+import codecs
 import copy
-import json
 import logging
+import multiprocessing
 import random
 import re
 import string
-import tempfile
+from array import array
 from math import ceil
 from multiprocessing.pool import ThreadPool
+from queue import Empty
 from time import sleep
 
+from virttest import remote
 from virttest.qemu_devices.qdevices import QThrottleGroup
 from virttest.qemu_monitor import QMPCmdError
 from virttest.utils_misc import get_linux_drive_path
 from virttest.utils_version import VersionInterval
 
+from provider.fio_stream import get_job_iops, iter_session_fio_json, parse_fio_json
+
 LOG_JOB = logging.getLogger("avocado.test")
 
 
@@ -211,6 +216,116 @@ def _get_drive_path(session, params, image):
     return get_linux_drive_path(session, serial)
 
 
+def _percentile(values, percent):
+    """
+    Get the percentile of values by linear interpolation.
+
+    :param values: sorted sequence of numbers.
+    :param percent: percentile in [0, 100].
+    """
+
+    if not values:
+        return 0
+    pos = (len(values) - 1) * percent / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class IOPSSeries(object):
+    """
+    Per-interval IOPS series of fio reports, kept in array.array.
+
+    fio reports(e.g. with --status-interval) are cumulative since the
+    job started, so the IOPS of every interval is computed from the
+    difference of job_runtime and total_ios of two adjacent reports.
+    A report whose job_runtime goes backward starts a new fio run.
+    """
+
+    def __init__(self):
+        self.times = array("d")
+        self.iops = array("d")
+        self.run_starts = []
+        self._last = None
+
+    def __len__(self):
+        return len(self.iops)
+
+    def add(self, runtime, ios):
+        """
+        Add a cumulative report.
+
+        :param runtime: job runtime in milliseconds.
+        :param ios: total number of finished IOs.
+        """
+
+        if self._last is None or runtime < self._last[0]:
+            self.run_starts.append(len(self.iops))
+            self._last = (0, 0)
+        last_runtime, last_ios = self._last
+        if runtime > last_runtime:
+            self.times.append(runtime / 1000.0)
+            self.iops.append((ios - last_ios) * 1000.0 / (runtime - last_runtime))
+            self._last = (runtime, ios)
+
+    def add_fio_sample(self, sample, index=0):
+        """
+        Add a fio JSON object.
+
+        :param sample: fio JSON object.
+        :param index: job index.
+        """
+
+        job = sample["jobs"][index]
+        ios = job["read"].get("total_ios", 0) + job["write"].get("total_ios", 0)
+        self.add(job.get("job_runtime", 0), ios)
+
+    def runs(self):
+        """
+        Split the series by fio runs.
+
+        :return: list of (times, iops) arrays.
+        """
+
+        bounds = self.run_starts + [len(self.iops)]
+        return [
+            (self.times[start:end], self.iops[start:end])
+            for start, end in zip(bounds, bounds[1:])
+        ]
+
+    @staticmethod
+    def converge_index(iops, expected, band):
+        """
+        Get the index since which all samples stay in the band.
+
+        :param iops: sequence of IOPS.
+        :param expected: expected IOPS.
+        :param band: allowed relative deviation.
+        :return: the index, or None if the last sample is out of band.
+        """
+
+        idx = len(iops)
+        while idx > 0 and abs(iops[idx - 1] - expected) <= expected * band:
+            idx -= 1
+        return idx if idx < len(iops) else None
+
+    @staticmethod
+    def stats(iops, percents=(5, 50, 95)):
+        """
+        Get the statistics of IOPS.
+
+        :param iops: sequence of IOPS.
+        :param percents: percentiles to be computed.
+        :return: dict of mean and percentiles, e.g. {"mean": 1, "p50": 1}
+        """
+
+        values = sorted(iops)
+        result = {"mean": sum(values) / len(values) if values else 0}
+        for percent in percents:
+            result["p%s" % percent] = _percentile(values, percent)
+        return result
+
+
 class ThrottleTester(object):
     """
     FIO test for in throttle group disks, It contains building general fio
@@ -238,7 +353,7 @@ class ThrottleTester(object):
         "normal": {"read": 0, "write": 0, "total": 0},
     }
     # Default data struct of raw image data.
-    raw_image_data = {"name": "", "fio_option": "", "output": {}}
+    raw_image_data = {"name": "", "fio_option": "", "output": {}, "series": None}
 
     def __init__(self, test, params, vm, session, group, images=None):
         """
@@ -267,7 +382,17 @@ class ThrottleTester(object):
             },
             "expected": copy.deepcopy(ThrottleTester.raw_expected),
         }
-        self._margin = 0.3
+        self._margin = float(params.get("throttle_margin", 0.3))
+        # "endpoints" checks the first and last fio reports, "series"
+        # checks the steady state of the per-interval IOPS series
+        self._check_mode = params.get("throttle_check_mode", "endpoints")
+        self._band = float(params.get("throttle_band", self._margin))
+        self._percentiles = [
+            float(p) for p in params.get("throttle_percentiles", "5 95").split()
+        ]
+        # end the one image fio run once its IOPS series is steady
+        self._adaptive_end = params.get("throttle_adaptive_end", "no") == "yes"
+        self._steady_samples = int(params.get("throttle_steady_samples", 10))
 
     @staticmethod
     def _generate_output_by_json(output):
@@ -278,39 +403,7 @@ class ThrottleTester(object):
         :return: dict of fio command output.
         """
 
-        with tempfile.TemporaryFile(mode="w+") as tmp:
-            tmp.write(output)
-            tmp.seek(0)
-            line = tmp.readline()
-            begin_flag = False
-            block_index = 1
-            block = {}
-            data = ""
-            while line:
-                if line == "{\n":
-                    if not begin_flag:
-                        begin_flag = True
-                    else:
-                        # error
-                        break
-                if begin_flag:
-                    data += line
-                if line == "}\n":
-                    if begin_flag:
-                        begin_flag = False
-                    else:
-                        # error
-                        break
-                    block[block_index] = json.loads(data)
-                    data = ""
-                    block_index += 1
-
-                line = tmp.readline()
-
-            if begin_flag:
-                LOG_JOB.error("Wrong data format")
-                return {}
-            return block
+        return dict(enumerate(parse_fio_json(output), 1))
 
     def set_fio(self, fio):
         """
@@ -321,28 +414,96 @@ class ThrottleTester(object):
 
         self._fio = fio
 
-    def run_fio(self, *args):
+    def run_fio(self, *args, **kwargs):
         """
         Start to fio command in guest.
 
         :param args: image data,data struct refer to raw_image_data.
+        :param kwargs: adaptive: True to end fio once the IOPS of the
+                       normal run is steady.
         :return: fio command output.
         """
 
+        image_info = args[0]
+        adaptive = kwargs.get("adaptive", False)
+        output = {}
+        series = image_info["series"] = IOPSSeries()
+
+        def _add_sample(sample):
+            output[len(output) + 1] = sample
+            series.add_fio_sample(sample)
+            return adaptive and self._is_steady(series)
+
+        self._stream_fio(image_info, _add_sample)
+        image_info["output"] = output
+        return image_info["output"]
+
+    def _is_steady(self, series):
+        """
+        Check whether the IOPS of the normal fio run are steady, i.e. the
+        last throttle_steady_samples samples are in the band.
+
+        :param series: IOPSSeries object of one image.
+        """
+
+        burst = self._throttle["expected"]["burst"]
+        normal = self._throttle["expected"]["normal"]
+        expected_burst = burst["read"] + burst["write"] + burst["total"]
+        expected_normal = normal["read"] + normal["write"] + normal["total"]
+        if not expected_normal:
+            return False
+        # the first run is the burst one
+        if len(series.run_starts) < (2 if expected_burst else 1):
+            return False
+        iops = series.iops[series.run_starts[-1] :]
+        if len(iops) < self._steady_samples:
+            return False
+        idx = IOPSSeries.converge_index(
+            iops[-self._steady_samples :], expected_normal, self._band
+        )
+        if idx == 0:
+            LOG_JOB.debug("IOPS is steady in %d samples, end fio", len(iops))
+            return True
+        return False
+
+    def _fio_cmd(self, image_info):
+        """
+        Get the fio command line of an image, fio runs twice if the burst
+        IOPS is expected, the first run is the burst one.
+
+        :param image_info: image data,data struct refer to raw_image_data.
+        """
+
         if not self._fio:
             self._test.error("Please set fio first")
-        image_info = args[0]
-        fio_option = image_info["fio_option"]
-        session = self._vm.wait_for_login()
-        cmd = " ".join((self._fio.cfg.fio_path, fio_option))
+        cmd = " ".join((self._fio.cfg.fio_path, image_info["fio_option"]))
         burst = self._throttle["expected"]["burst"]
         expected_burst = burst["read"] + burst["write"] + burst["total"]
         if expected_burst:
             cmd += " && " + cmd
+        return cmd
+
+    def _stream_fio(self, image_info, on_sample):
+        """
+        Run fio command in a new guest session, call on_sample with every
+        fio JSON object as soon as it's printed.
+
+        :param image_info: image data,data struct refer to raw_image_data.
+        :param on_sample: callable object taking a fio JSON object, fio is
+                          interrupted if it returns True.
+        """
+
+        cmd = self._fio_cmd(image_info)
+        session = self._vm.wait_for_login()
         LOG_JOB.info("run_fio:%s", cmd)
-        out = session.cmd(cmd, 1800)
-        image_info["output"] = self._generate_output_by_json(out)
-        return image_info["output"]
+        samples = iter_session_fio_json(session, cmd, 1800)
+        try:
+            for sample in samples:
+                if on_sample(sample):
+                    break
+        finally:
+            samples.close()
+            session.close()
 
     def check_output(self, images):
         """
@@ -363,6 +524,9 @@ class ThrottleTester(object):
             LOG_JOB.info("Skipping checking on the empty throttle")
             return True
 
+        if self._check_mode == "series":
+            return self._check_series(images, expected_burst, expected_normal)
+
         sum_burst = 0
         sum_normal = 0
         num_images = len(images)
@@ -409,6 +573,64 @@ class ThrottleTester(object):
 
         return True
 
+    def _check_series(self, images, expected_burst, expected_normal):
+        """
+        Check the per-interval IOPS series of images, the burst IOPS is the
+        mean of the burst run, the normal IOPS must converge into the band
+        and its steady state mean and percentiles are checked.
+
+        :param images: list of participating images.
+        :param expected_burst: expected burst IOPS.
+        :param expected_normal: expected normal IOPS.
+        :return: True for succeed.
+        """
+
+        sum_burst = 0
+        normal_runs = []
+        for image in images:
+            series = self._throttle["images"][image]["series"]
+            runs = series.runs() if series else []
+            if len(runs) < (2 if expected_burst else 1):
+                self._test.error("Not enough fio runs of %s: %d" % (image, len(runs)))
+            if expected_burst:
+                sum_burst += IOPSSeries.stats(runs[0][1], [])["mean"]
+            normal_runs.append(runs[-1])
+
+        # the sum of images' IOPS in the same interval
+        length = min(len(iops) for _, iops in normal_runs)
+        if length < 2:
+            self._test.error("At lease 2 Data samples:%d" % length)
+        times = normal_runs[0][0]
+        normal = [sum(iops[i] for _, iops in normal_runs) for i in range(length)]
+
+        if expected_burst:
+            if abs(expected_burst - sum_burst) <= expected_burst * self._margin:
+                LOG_JOB.debug("Passed burst %d %d", expected_burst, sum_burst)
+            else:
+                self._test.fail("Failed burst %d %d" % (expected_burst, sum_burst))
+
+        idx = IOPSSeries.converge_index(normal, expected_normal, self._band)
+        if idx is None:
+            self._test.fail(
+                "Normal IOPS never converged to %d: %s" % (expected_normal, normal)
+            )
+        stats = IOPSSeries.stats(normal[idx:], self._percentiles)
+        LOG_JOB.debug(
+            "Normal IOPS converged in %.1fs, steady state of %d samples: %s",
+            times[idx],
+            length - idx,
+            stats,
+        )
+        if abs(expected_normal - stats["mean"]) > expected_normal * self._margin:
+            self._test.fail("Failed normal %d %d" % (expected_normal, stats["mean"]))
+        for percent in self._percentiles:
+            value = stats["p%s" % percent]
+            if abs(expected_normal - value) > expected_normal * self._band:
+                self._test.fail(
+                    "Failed normal p%s %d %d" % (percent, expected_normal, value)
+                )
+        return True
+
     def start_one_image_test(self, image):
         """
         Process one disk throttle testing.
@@ -418,7 +640,7 @@ class ThrottleTester(object):
         """
 
         LOG_JOB.debug("Start one image run_fio :%s", image)
-        self.run_fio(self._throttle["images"][image])
+        self.run_fio(self._throttle["images"][image], adaptive=self._adaptive_end)
         return self.check_output([image])
 
     def start_all_images_test(self):
@@ -455,6 +677,79 @@ class ThrottleTester(object):
 
         return ret
 
+    def worker_plan(self):
+        """
+        Get the plan of the fio commands of start() for a worker process,
+        only picklable data is in it, the worker logs in to the guest by
+        itself and must not use the QMP monitor of the VM.
+
+        :return: dict of the plan, refer to _throttle_worker
+        """
+
+        params = self._vm.params
+        login = {
+            "client": params.get("shell_client"),
+            "host": self._vm.get_address(),
+            "port": self._vm.get_port(int(params.get("shell_port"))),
+            "username": params.get("username", ""),
+            "password": params.get("password", ""),
+            "prompt": params.get("shell_prompt", r"[\#\$]\s*$"),
+            "linesep": codecs.decode(
+                params.get("shell_linesep", r"\n"), "unicode_escape"
+            ),
+            "timeout": int(params.get("login_timeout", 360)),
+            "status_test_command": params.get("status_test_command", "echo $?"),
+        }
+        phases = []
+        if self.images:
+            phases.append(("one", self.images[:1]))
+            if len(self.images) > 1:
+                phases.append(("all", self.images))
+        return {
+            "group": self.group,
+            "login": login,
+            "phases": [
+                (
+                    phase,
+                    [
+                        (img, self._fio_cmd(self._throttle["images"][img]))
+                        for img in images
+                    ],
+                )
+                for phase, images in phases
+            ],
+            "burst_empty_time": self._throttle["expected"]["burst"].get(
+                "burst_empty_time", 0
+            ),
+        }
+
+    def check_samples(self, samples):
+        """
+        Check the samples collected from _throttle_worker in the same way
+        as start() does.
+
+        :param samples: dict of
+                        {(phase, image): [(read, write, runtime, ios), ...]}
+        :return: True for succeed,test error or failure raised if failed.
+        """
+
+        phases = [("one", self.images[:1])]
+        if len(self.images) > 1:
+            phases.append(("all", self.images))
+        for phase, images in phases:
+            for image in images:
+                image_samples = samples.get((phase, image), [])
+                series = IOPSSeries()
+                for _, _, runtime, ios in image_samples:
+                    series.add(runtime, ios)
+                self._throttle["images"][image]["series"] = series
+                self._throttle["images"][image]["output"] = {
+                    idx: {"jobs": [{"read": {"iops": r}, "write": {"iops": w}}]}
+                    for idx, (r, w, _, _) in enumerate(image_samples, 1)
+                }
+            self.check_output(images)
+        return True
+
     def wait_empty_burst(self):
         """
         Wait some time to empty burst
@@ -512,6 +807,9 @@ class ThrottleTester(object):
 
         option = "--direct=1 --name=test --iodepth=1 --thread"
         option += "  --output-format=json "
+        status_interval = self._params.get("throttle_status_interval")
+        if status_interval:
+            option += " --status-interval=%s " % status_interval
 
         iops_size = attrs["iops-size"]
         iops_size = 4096 if iops_size == 0 else iops_size
@@ -684,6 +982,56 @@ class ThrottleTester(object):
         self.images.remove(image)
 
 
+def _throttle_worker(plan, queue):
+    """
+    Run the fio commands of a throttle group in a worker process.
+
+    Nothing is checked in the worker, the IOPS of every fio sample are
+    put into queue as ("sample", group, phase, image, read, write,
+    runtime, total_ios),
+    then ("done", group) or ("error", group, message) is put when
+    finished.
+
+    :param plan: dict of the plan from ThrottleTester.worker_plan, the
+                 login keyword arguments of remote.remote_login, and the
+                 list of (phase, [(image, fio command), ...]), the images
+                 of a phase run at the same time.
+    :param queue: multiprocessing queue shared with the aggregator.
+    """
+
+    group = plan["group"]
+    login = dict(plan["login"])
+    status_test_command = login.pop("status_test_command")
+
+    def _run(phase, image, cmd):
+        session = remote.remote_login(**login)
+        session.set_status_test_command(status_test_command)
+        try:
+            for sample in iter_session_fio_json(session, cmd, 1800):
+                job = sample["jobs"][0]
+                read, write = get_job_iops(sample)
+                ios = job["read"].get("total_ios", 0) + job["write"].get("total_ios", 0)
+                runtime = job.get("job_runtime", 0)
+                queue.put(("sample", group, phase, image, read, write, runtime, ios))
+        finally:
+            session.close()
+
+    try:
+        for idx, (phase, runs) in enumerate(plan["phases"]):
+            if idx and plan["burst_empty_time"]:
+                sleep(plan["burst_empty_time"])
+            pool = ThreadPool(len(runs))
+            results = [pool.apply_async(_run, (phase,) + run) for run in runs]
+            pool.close()
+            pool.join()
+            for result in results:
+                result.get()
+    except Exception as err:
+        queue.put(("error", group, str(err)))
+    else:
+        queue.put(("done", group))
+
+
 class ThrottleGroupsTester(object):
     """
     This class mainly testing multi groups parallel or specified group
@@ -702,8 +1050,15 @@ class ThrottleGroupsTester(object):
         testers.start()
     """
 
-    def __init__(self, testers):
+    def __init__(self, testers, mode="thread"):
+        """
+        :param testers: list of ThrottleTester objects.
+        :param mode: "thread" runs every tester in a thread, "process"
+                     runs the fio commands of every group in a worker
+                     process, and checks the samples streamed back.
+        """
         self.testers = testers.copy()
+        self.mode = mode
 
     @staticmethod
     def proc_wrapper(func):
@@ -731,6 +1086,9 @@ class ThrottleGroupsTester(object):
         """
         Start multi groups testing parallel.
         """
+        if self.mode == "process":
+            return self.start_processes()
+
         num = len(self.testers)
         pool = ThreadPool(num)
 
@@ -752,3 +1110,83 @@ class ThrottleGroupsTester(object):
             raise ThrottleError("Throttle testing failed,please check log.")
 
         LOG_JOB.debug("ThrottleGroupsParallelTester End")
+
+    def _collect_samples(self, queue, workers):
+        """
+        Collect the samples put by the workers until all of them end.
+
+        :param queue: multiprocessing queue shared with the workers.
+        :param workers: dict of {group: multiprocessing.Process}.
+        :return: tuple of ({group: {(phase, image): [sample, ...]}},
+                 {group: error message})
+        """
+        samples = {group: {} for group in workers}
+        errors = {}
+        running = set(workers)
+        while running:
+            try:
+                msg = queue.get(timeout=1)
+            except Empty:
+                for group in list(running):
+                    if not workers[group].is_alive():
+                        errors[group] = "worker exited with %s" % (
+                            workers[group].exitcode
+                        )
+                        running.discard(group)
+                continue
+
+            kind, group = msg[0], msg[1]
+            if kind == "sample":
+                phase, image = msg[2:4]
+                samples[group].setdefault((phase, image), []).append(msg[4:])
+            else:
+                if kind == "error":
+                    errors[group] = msg[2]
+                running.discard(group)
+        return samples, errors
+
+    def start_processes(self):
+        """
+        Start multi groups testing parallel in worker processes, and check
+        the results of every group with the samples they streamed back.
+        """
+        # the workers are spawned, not forked, so they don't inherit the
+        # threads, monitor sockets and sessions of the test process
+        ctx = multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        workers = {}
+        for tester in self.testers:
+            LOG_JOB.debug("Start worker of tester :%s", tester.group)
+            workers[tester.group] = ctx.Process(
+                target=_throttle_worker,
+                args=(tester.worker_plan(), queue),
+                daemon=True,
+            )
+            workers[tester.group].start()
+
+        try:
+            samples, errors = self._collect_samples(queue, workers)
+        finally:
+            for worker in workers.values():
+                worker.join(timeout=60)
+                if worker.is_alive():
+                    worker.terminate()
+
+        success = True
+        for tester in self.testers:
+            group = tester.group
+            if group in errors:
+                LOG_JOB.error("Worker of %s failed: %s", group, errors[group])
+                success = False
+                continue
+            try:
+                tester.check_samples(samples[group])
+            except Exception as e:
+                LOG_JOB.exception(e)
+                LOG_JOB.error("Find unexpected result on %s", group)
+                success = False
+
+        if not success:
+            raise ThrottleError("Throttle testing failed,please check log.")
+
+        LOG_JOB.debug("ThrottleGroupsProcessTester End")
@@ -5,6 +5,7 @@ import time
 from virttest import data_dir, error_context, graphical_console
 
 from provider import input_event_proxy
+from provider.input_tests import check_input_latency, event_latency
 
 
 def get_keycode_cfg(filename):
@@ -41,10 +42,13 @@ def key_tap_test(test, params, vm):
             key_lst = [key_check_cfg[key]]
         key_num = len(key_lst)
         key_event_lst = list()
+        received = []
 
         while not events_queue.empty():
             events = events_queue.get()
             key_event_lst.append((events["keyCode"], events["type"]))
+            received.append(events)
+        latencies.append(event_latency(received, sent))
 
         if len(key_event_lst) < 2 * key_num:
             test.fail("Reveived key events %s were not enough" % key_event_lst)
@@ -81,8 +85,10 @@ def key_tap_test(test, params, vm):
     listener = input_event_proxy.EventListener(vm)
 
     console = graphical_console.GraphicalConsole(vm)
+    latencies = []
     for key in key_check_cfg.keys():
         error_context.context("Send %s key tap to guest" % key, test.log.info)
+        sent = time.time()
         console.key_tap(key)
         error_context.context(
             "Check %s key tap event receivedcorrect in guest" % key, test.log.info
@@ -92,3 +98,4 @@ def key_tap_test(test, params, vm):
 
     listener.clear_events()
     listener.cleanup()
+    check_input_latency(test, params, latencies)
@@ -15,20 +15,56 @@ class BaseStoragePool(object):
         self._helper = None
         self._capacity = None
         self._available = None
-        self._volumes = set()
+        # volumes keyed by id, the hash of a volume changes with its info
+        self._volumes = dict()
+        # {attr: {str(value): [volumes]}}, built on the first lookup by attr
+        self._indexes = dict()
+        # {attr: {id(volume): str(value)}}, values the volumes are indexed by
+        self._indexed_values = dict()
+        # {attr: set(id(volume))}, volumes to be reindexed on next lookup
+        self._changed_volumes = dict()
 
     @property
     def capacity(self):
         if self._capacity is None:
-            self._capacity = self.helper.capacity
+            self.refresh_capacity()
         return self._capacity
 
     @property
     def available(self):
         if self._available is None:
-            self._available = self.helper.available
+            self.refresh_capacity()
         return self._available
 
+    @classmethod
+    def refresh_capacities(cls, pools):
+        """
+        Refresh the capacity and available size of the pools
+
+        :param pools: list of pools of this class
+        """
+        for pool in pools:
+            pool.set_capacity(pool.helper.capacity, pool.helper.available)
+
+    def refresh_capacity(self):
+        self.refresh_capacities([self])
+
+    def set_capacity(self, capacity, available):
+        self._capacity = capacity
+        self._available = available
+
+    def invalidate_capacity(self):
+        """Get the capacity and available size again on next access"""
+        self._capacity = None
+        self._available = None
+
+    def invalidate(self):
+        """Drop the cached capacity and volume indexes"""
+        self.invalidate_capacity()
+        self._indexes.clear()
+        self._indexed_values.clear()
+        self._changed_volumes.clear()
+
     @classmethod
     def pool_define_by_params(cls, name, params):
         inst = cls(name)
@@ -60,6 +96,7 @@ class BaseStoragePool(object):
         """Destroy storage pools"""
         self.stop()
         self._volumes.clear()
+        self.invalidate()
 
     def find_sources(self):
         raise NotImplementedError
@@ -98,22 +135,58 @@ class BaseStoragePool(object):
         :return:  StorageVolume object or None
         :raise:
         """
+        volumes = self._get_index(attr).get(str(val))
+        return volumes[0] if volumes else None
 
-        matched_volumes = list(
-            filter(lambda x: str(getattr(x, attr)) == str(val), self.get_volumes())
-        )
-        return matched_volumes[0] if matched_volumes else None
+    def _get_index(self, attr):
+        """
+        Get the index of volumes by attr, only the volumes changed since
+        the last lookup are indexed again, so the lazy attributes are got
+        when looking up as a scan of all volumes does.
+        """
+        index = self._indexes.get(attr)
+        if index is None:
+            index = self._indexes[attr] = dict()
+            self._indexed_values[attr] = dict()
+            changed = list(self._volumes)
+        else:
+            changed = self._changed_volumes[attr]
+        self._changed_volumes[attr] = set()
+        values = self._indexed_values[attr]
+        for vid in changed:
+            old = values.pop(vid, None)
+            if old is not None:
+                index[old] = [v for v in index[old] if id(v) != vid]
+                if not index[old]:
+                    del index[old]
+            volume = self._volumes.get(vid)
+            if volume is not None:
+                values[vid] = str(getattr(volume, attr))
+                index.setdefault(values[vid], []).append(volume)
+        return index
+
+    def volume_changed(self, volume):
+        """Reindex the volume on next lookup, e.g. its name or path changed"""
+        for changed in self._changed_volumes.values():
+            changed.add(id(volume))
 
     def get_volumes(self):
-        return self._volumes
+        return list(self._volumes.values())
 
     def add_volume(self, volume):
-        self._volumes.add(volume)
+        self._volumes[id(volume)] = volume
+        self.volume_changed(volume)
+
+    def discard_volume(self, volume):
+        """Drop the volume from the pool, if it is in it"""
+        if self._volumes.pop(id(volume), None) is not None:
+            self.volume_changed(volume)
 
     def acquire_volume(self, volume):
         if volume.is_allocated:
             return
         self.create_volume(volume)
+        self.invalidate_capacity()
         self.refresh()
 
     def info(self):
@@ -126,7 +199,7 @@ class BaseStoragePool(object):
         out["capacity"] = str(self.capacity)
         out["available"] = str(self.available)
         out["helper"] = str(self.helper)
-        out["volumes"] = list(map(str, self._volumes))
+        out["volumes"] = list(map(str, self._volumes.values()))
         return out
 
     def __str__(self):
@@ -15,6 +15,16 @@ class DirectoryPool(base.BaseStoragePool):
             self._helper = fscli.FsCli(self.target.path)
         return self._helper
 
+    @classmethod
+    def refresh_capacities(cls, pools):
+        """Refresh the capacity of all directory pools by one df"""
+        pools = [p for p in pools if os.path.isdir(p.target.path)]
+        if not pools:
+            return
+        paths = [p.target.path for p in pools]
+        for pool, sizes in zip(pools, fscli.FsCli.get_capacities(paths)):
+            pool.set_capacity(*sizes)
+
     def find_sources(self):
         return self.helper.list_files()
 
@@ -53,7 +63,8 @@ class DirectoryPool(base.BaseStoragePool):
 
     def remove_volume(self, volume):
         self.helper.remove_file(volume.path)
-        self._volumes.discard(volume)
+        self.discard_volume(volume)
+        self.invalidate_capacity()
 
     def get_volume_path_by_param(self, params):
         image_name = params.get("image_name", self.name)
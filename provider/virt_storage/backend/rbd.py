@@ -45,7 +45,8 @@ class RBDPool(base.BaseStoragePool):
 
     def remove_volume(self, volume):
         self.helper.remove_image(volume.path)
-        self._volumes.discard(volume)
+        self.discard_volume(volume)
+        self.invalidate_capacity()
 
     def get_volume_path_by_param(self, params):
         image_name = params.get("image_name", self.name)
@@ -68,14 +68,25 @@ class FsCli(object):
             self._is_export = os.path.isdir(self.dir_path)
         return self._is_export
 
+    @staticmethod
+    def get_capacities(paths):
+        """
+        Get the size and available size of the filesystems by one df
+
+        :param paths: list of paths on the filesystems
+        :return: list of tuples (size, available) in bytes
+        """
+        cmd = "df -k --output=size,avail %s" % " ".join(paths)
+        output = process.system_output(cmd, shell=True).decode()
+        return [
+            tuple(int(v) * 1024 for v in line.split())
+            for line in output.splitlines()[1:]
+        ]
+
     @property
     def capacity(self):
-        cmd = "df -k --output=size %s |tail -n1" % self.dir_path
-        output = process.system_output(cmd, shell=True)
-        return int(output) * 1024
+        return self.get_capacities([self.dir_path])[0][0]
 
     @property
     def available(self):
-        cmd = "df -k --output=avail %s |tail -n1" % self.dir_path
-        output = process.system_output(cmd, shell=True)
-        return int(output) * 1024
+        return self.get_capacities([self.dir_path])[0][1]
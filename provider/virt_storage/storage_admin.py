@@ -1,5 +1,4 @@
 import logging
-from functools import reduce
 
 from . import exception
 from .backend import directory, rbd
@@ -15,6 +14,8 @@ class StoragePoolAdmin(object):
     }
 
     __pools = set()
+    __pools_by_name = dict()
+    __pools_by_path = dict()
 
     @classmethod
     def _find_storage_driver(cls, backend_type):
@@ -42,6 +43,8 @@ class StoragePoolAdmin(object):
         pool.refresh()
         state.register_pool_state_machine(pool)
         cls.__pools.add(pool)
+        cls.__pools_by_name[pool.name] = pool
+        cls.__pools_by_path.setdefault(pool.target.path, pool)
         return pool
 
     @classmethod
@@ -53,10 +56,7 @@ class StoragePoolAdmin(object):
     @classmethod
     def list_volumes(cls):
         """List all volumes in host"""
-        out = reduce(
-            lambda x, y: x.union(y), [p.get_volumes() for p in sp_admin.list_pools()]
-        )
-        return list(out)
+        return [v for p in cls.list_pools() for v in p.get_volumes()]
 
     @classmethod
     def list_pools(cls):
@@ -64,10 +64,7 @@ class StoragePoolAdmin(object):
 
     @classmethod
     def find_pool_by_name(cls, name):
-        for pool in cls.__pools:
-            if pool.name == name:
-                return pool
-        return None
+        return cls.__pools_by_name.get(name)
 
     @staticmethod
     def find_pool_by_volume(volume):
@@ -75,12 +72,10 @@ class StoragePoolAdmin(object):
 
     @classmethod
     def find_pool_by_path(cls, path):
-        try:
-            pools = list(filter(lambda x: x.target.path == path, cls.list_pools()))
-            return pools[0]
-        except IndexError:
+        pool = cls.__pools_by_path.get(path)
+        if pool is None:
             LOG_JOB.warning("no storage pool with matching path '%s'", path)
-        return None
+        return pool
 
     @staticmethod
     def start_pool(pool):
@@ -96,8 +91,23 @@ class StoragePoolAdmin(object):
 
     @staticmethod
     def refresh_pool(pool):
+        pool.invalidate()
         return pool.refresh()
 
+    @classmethod
+    def refresh_pools_capacity(cls, pools=None):
+        """
+        Refresh the capacity and available size of pools in bulk, e.g. by
+        one df for all directory pools
+
+        :param pools: list of pools, all pools if None
+        """
+        groups = dict()
+        for pool in cls.list_pools() if pools is None else pools:
+            groups.setdefault(type(pool), []).append(pool)
+        for driver, lst in groups.items():
+            driver.refresh_capacities(lst)
+
     @classmethod
     def release_volume(cls, volume):
         pool = cls.find_pool_by_volume(volume)
@@ -151,20 +161,25 @@ class StoragePoolAdmin(object):
         pool = cls.find_pool_by_volume(volume)
         pool.remove_volume(volume)
 
+    @classmethod
+    def _get_volume_by_attr(cls, attr, val):
+        for pool in cls.list_pools():
+            volume = getattr(pool, "get_volume_by_%s" % attr)(val)
+            if volume is not None:
+                return volume
+        return None
+
     @classmethod
     def get_volume_by_name(cls, name):
-        volumes = list(filter(lambda x: x.name == name, cls.list_volumes()))
-        return volumes[0] if volumes else None
+        return cls._get_volume_by_attr("name", name)
 
     @classmethod
     def get_volume_by_path(cls, path):
-        volumes = list(filter(lambda x: x.path == path, cls.list_volumes()))
-        return volumes[0] if volumes else None
+        return cls._get_volume_by_attr("path", path)
 
     @classmethod
     def get_volume_by_url(cls, url):
-        volumes = list(filter(lambda x: x.url == url, cls.list_volumes()))
-        return volumes[0] if volumes else None
+        return cls._get_volume_by_attr("url", url)
 
 
 sp_admin = StoragePoolAdmin()
@@ -0,0 +1,246 @@
+"""
+Module for measuring the throughput of virtio-serial ports from the host.
+
+Every port is driven by its own thread on the host socket of the port.
+The payload is allocated once and sent by socket.sendmsg() on slices of
+a memoryview, the received data is read by socket.recv_into() into a
+preallocated buffer, so no bytes object is created per send or receive.
+The bytes done by every port are sampled at fixed time slices, and the
+CPU time of the threads of QEMU and of this process is read from
+/proc/<pid>/task/<tid>/stat to get the CPU cost per byte.
+
+Available classes:
+- PortStream: Send to or receive from the host socket of a port
+- ThreadCPU: CPU time of the threads of processes
+
+Available functions:
+- run_streams: Run port streams for a while and get their throughput
+- measure_latency: Round trip time of small messages echoed by the guest
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from array import array
+
+LOG_JOB = logging.getLogger("avocado.test")
+
+MB = 1024.0**2
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+class PortStream(threading.Thread):
+    """Send to or receive from the host socket of a port in a loop"""
+
+    def __init__(self, name, sock, direction, buf_len, exit_event):
+        """
+        :param name: port name
+        :param sock: connected host socket of the port
+        :param direction: "send" or "recv"
+        :param buf_len: bytes of the buffer
+        :param exit_event: event to stop the stream
+        """
+        super(PortStream, self).__init__(name="PortStream-%s" % name, daemon=True)
+        self.port_name = name
+        self.sock = sock
+        self.direction = direction
+        self.buffer = bytearray(os.urandom(buf_len))
+        self.exit_event = exit_event
+        self.bytes = 0
+        self.error = None
+
+    def _send(self, view):
+        offset = 0
+        while not self.exit_event.is_set():
+            try:
+                sent = self.sock.sendmsg([view[offset:]])
+            except socket.timeout:
+                continue
+            self.bytes += sent
+            offset += sent
+            if offset >= len(view):
+                offset = 0
+
+    def _recv(self, view):
+        while not self.exit_event.is_set():
+            try:
+                self.bytes += self.sock.recv_into(view)
+            except socket.timeout:
+                continue
+
+    def run(self):
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0.1)
+        try:
+            with memoryview(self.buffer) as view:
+                if self.direction == "send":
+                    self._send(view)
+                else:
+                    self._recv(view)
+        except Exception as err:
+            self.error = err
+            LOG_JOB.error("%s failed: %s", self.name, err)
+        finally:
+            self.sock.settimeout(timeout)
+
+
+class ThreadCPU(object):
+    """CPU time of the threads of processes"""
+
+    def __init__(self, pids):
+        """
+        :param pids: dict of {label: pid}
+        """
+        self.pids = pids
+
+    @staticmethod
+    def _read(pid):
+        threads = {}
+        task_dir = "/proc/%s/task" % pid
+        for tid in os.listdir(task_dir):
+            try:
+                with open(os.path.join(task_dir, tid, "stat")) as stat:
+                    data = stat.read()
+            except IOError:
+                # the thread exited
+                continue
+            # comm is in parentheses and may contain spaces
+            comm = data[data.index("(") + 1 : data.rindex(")")]
+            fields = data[data.rindex(")") + 2 :].split()
+            # utime and stime are the 14th and 15th fields of stat
+            threads[tid] = (comm, (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS)
+        return threads
+
+    def sample(self):
+        """
+        :return: dict of {label: {tid: (thread name, CPU seconds)}}
+        """
+        return dict((label, self._read(pid)) for label, pid in self.pids.items())
+
+    @staticmethod
+    def delta(before, after):
+        """
+        Get the CPU seconds used between two samples
+
+        :return: dict of {label: {thread name: CPU seconds}}, the threads
+                 of the same name are summed up
+        """
+        used = {}
+        for label, threads in after.items():
+            names = used.setdefault(label, {})
+            for tid, (comm, seconds) in threads.items():
+                begin = before.get(label, {}).get(tid, (comm, 0))[1]
+                names[comm] = names.get(comm, 0) + seconds - begin
+        return used
+
+
+def run_streams(streams, duration, slices=100, cpu=None):
+    """
+    Run the port streams for a while and get their throughput, the streams
+    keep running until their exit event is set, so the guest can be
+    stopped first
+
+    :param streams: list of PortStream objects not started yet
+    :param duration: seconds to run
+    :param slices: number of the time slices sampled
+    :param cpu: ThreadCPU object, CPU is not measured if None
+    :return: dict of ports: {port: {mbps, min, median, max}}, aggregate
+             MB/s, bytes, elapsed and cpu: {label: {total, per_byte,
+             threads}}, per_byte is in nanoseconds
+    """
+    time_slice = float(duration) / slices
+    samples = dict((stream.port_name, array("d")) for stream in streams)
+    before = cpu.sample() if cpu else None
+    start = time.time()
+    for stream in streams:
+        stream.start()
+    next_time = start
+    for _ in range(slices):
+        next_time += time_slice
+        time.sleep(max(next_time - time.time(), 0))
+        for stream in streams:
+            samples[stream.port_name].append(stream.bytes)
+    elapsed = time.time() - start
+    after = cpu.sample() if cpu else None
+
+    ports = {}
+    total = 0
+    for stream in streams:
+        done = samples[stream.port_name]
+        rates = sorted(
+            (done[i] - (done[i - 1] if i else 0)) / time_slice / MB
+            for i in range(len(done))
+        )
+        ports[stream.port_name] = {
+            "mbps": done[-1] / elapsed / MB,
+            "min": rates[0],
+            "median": rates[len(rates) // 2],
+            "max": rates[-1],
+        }
+        total += done[-1]
+
+    result = {
+        "ports": ports,
+        "aggregate": total / elapsed / MB,
+        "bytes": total,
+        "elapsed": elapsed,
+        "cpu": {},
+    }
+    if cpu:
+        for label, threads in ThreadCPU.delta(before, after).items():
+            used = sum(threads.values())
+            result["cpu"][label] = {
+                "total": used,
+                "per_byte": used * 1e9 / total if total else 0,
+                "threads": threads,
+            }
+    return result
+
+
+def measure_latency(sock, size, count, timeout=10):
+    """
+    Measure the round trip time of small messages echoed by the guest
+
+    :param sock: connected host socket of a port looped back in guest
+    :param size: bytes of a message
+    :param count: number of messages
+    :param timeout: timeout of a round trip
+    :return: dict of count, min, p50, p99, max and mean in microseconds
+    """
+    message = memoryview(bytearray(os.urandom(size)))
+    buf = bytearray(size)
+    view = memoryview(buf)
+    rtt = array("d")
+    old_timeout = sock.gettimeout()
+    sock.settimeout(timeout)
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            sent = 0
+            while sent < size:
+                sent += sock.sendmsg([message[sent:]])
+            received = 0
+            while received < size:
+                received += sock.recv_into(view[received:])
+            rtt.append((time.perf_counter() - start) * 1e6)
+            if buf != message:
+                raise ValueError("Echoed message is corrupted")
+    finally:
+        sock.settimeout(old_timeout)
+    values = sorted(rtt)
+    return {
+        "count": len(values),
+        "min": values[0],
+        "p50": _percentile(values, 50),
+        "p99": _percentile(values, 99),
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
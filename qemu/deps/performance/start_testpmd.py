@@ -1,5 +1,7 @@
+import json
 import locale
 import logging
+import re
 import subprocess
 import sys
 import time
@@ -15,8 +17,11 @@ nic2 = sys.argv[5]
 cores = int(sys.argv[6])
 queues = int(sys.argv[7])
 running_time = int(sys.argv[8])
+# seconds between two samples of the port counters, 0 to sample none
+sample_interval = float(sys.argv[9]) if len(sys.argv) > 9 else 0
 
 ENCODING = locale.getpreferredencoding()
+COUNTER_RE = re.compile(r"\b([RT]X-[a-z]+):\s+(\d+)")
 
 
 class TestPMD(object):
@@ -94,6 +99,20 @@ class TestPMD(object):
     def set_vlan_1(self):
         self.command("vlan set strip on 1")
 
+    def sample_port_stats(self):
+        """Print the port counters as a PORT_STATS line"""
+        self.proc.sendline("show port stats all")
+        self.proc.expect("testpmd>")
+        output = to_text(self.proc.before)
+        stats = {}
+        chunks = re.split(r"NIC statistics for port (\d+)", output)
+        for i in range(1, len(chunks) - 1, 2):
+            stats[chunks[i]] = dict(
+                (name.lower().replace("-", "_"), int(value))
+                for name, value in COUNTER_RE.findall(chunks[i + 1])
+            )
+        print("PORT_STATS %.3f %s" % (time.time(), json.dumps(stats)))
+
     def command(self, cmd):
         self.proc.sendline(cmd)
         self.proc.expect("testpmd>")
@@ -109,7 +128,14 @@ class TestPMD(object):
 
 
 def start_testpmd(
-    nic1_driver, nic2_driver, whitelist_option, nic1, nic2, cores, queues
+    nic1_driver,
+    nic2_driver,
+    whitelist_option,
+    nic1,
+    nic2,
+    cores,
+    queues,
+    sample_interval=0,
 ):
     my_testpmd = TestPMD()
     my_testpmd.launch(
@@ -132,6 +158,12 @@ def start_testpmd(
     # testmpd will quit after running_time
     start_time = time.time()
     end_time = start_time + running_time
+    if sample_interval:
+        next_time = start_time
+        while time.time() < end_time:
+            my_testpmd.sample_port_stats()
+            next_time += sample_interval
+            time.sleep(max(next_time - time.time(), 0))
     while time.time() < end_time:
         time.sleep(10)
         print("time.time=%s" % time.time)
@@ -159,4 +191,13 @@ def to_text(data):
     return data
 
 
-start_testpmd(nic1_driver, nic2_driver, whitelist_option, nic1, nic2, cores, queues)
+start_testpmd(
+    nic1_driver,
+    nic2_driver,
+    whitelist_option,
+    nic1,
+    nic2,
+    cores,
+    queues,
+    sample_interval,
+)
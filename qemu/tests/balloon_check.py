@@ -8,7 +8,7 @@ from virttest import error_context, qemu_monitor, utils_misc, utils_test
 from virttest.utils_numeric import normalize_data_size
 from virttest.utils_test.qemu import MemoryBaseTest
 
-from provider import win_driver_utils
+from provider import balloon_tracker, perf_results_db, win_driver_utils
 
 
 class BallooningTest(MemoryBaseTest):
@@ -18,6 +18,8 @@ class BallooningTest(MemoryBaseTest):
 
     def __init__(self, test, params, env):
         self.test_round = 0
+        self.tracker = None
+        self.balloon_rates = {"inflate": [], "deflate": []}
         super(BallooningTest, self).__init__(test, params, env)
 
         self.vm = env.get_vm(params["main_vm"])
@@ -202,36 +204,104 @@ class BallooningTest(MemoryBaseTest):
         """
         self.env["balloon_test"] = 0
         error_context.context("Change VM memory to %s" % new_mem, self.test.log.info)
+        self.tracker = self.start_tracker()
         try:
-            self.vm.balloon(new_mem)
-            self.env["balloon_test"] = 1
-        except Exception as e:
-            if (
-                self.params.get("illegal_value_check", "no") == "no"
-                and new_mem != self.get_ballooned_memory()
-            ):
-                raise exceptions.TestFail(
-                    "Balloon memory fail with error message: %s" % e
-                )
-        if new_mem > self.ori_mem:
-            compare_mem = self.ori_mem
-        elif new_mem == 0:
-            compare_mem = self.pre_mem
-        elif new_mem <= 100:
-            self._balloon_post_action()
-            compare_mem = self.get_ballooned_memory()
-        else:
-            compare_mem = new_mem
+            try:
+                self.vm.balloon(new_mem)
+                self.env["balloon_test"] = 1
+            except Exception as e:
+                if (
+                    self.params.get("illegal_value_check", "no") == "no"
+                    and new_mem != self.get_ballooned_memory()
+                ):
+                    raise exceptions.TestFail(
+                        "Balloon memory fail with error message: %s" % e
+                    )
+            if new_mem > self.ori_mem:
+                compare_mem = self.ori_mem
+            elif new_mem == 0:
+                compare_mem = self.pre_mem
+            elif new_mem <= 100:
+                self._balloon_post_action()
+                compare_mem = self.get_ballooned_memory()
+            else:
+                compare_mem = new_mem
 
-        balloon_timeout = float(self.params.get("balloon_timeout", 480))
-        status = utils_misc.wait_for(
-            (lambda: compare_mem == self.get_ballooned_memory()), balloon_timeout
-        )
-        if status is None:
+            balloon_timeout = float(self.params.get("balloon_timeout", 480))
+            if self.tracker:
+                completed = self.tracker.wait(compare_mem, balloon_timeout)
+                self._report_tracker(completed)
+                status = completed is not None
+            else:
+                status = utils_misc.wait_for(
+                    (lambda: compare_mem == self.get_ballooned_memory()),
+                    balloon_timeout,
+                )
+        finally:
+            if self.tracker:
+                self.tracker.stop()
+                self.tracker = None
+        if not status:
             raise exceptions.TestFail(
                 "Failed to balloon memory to expect value during %ss" % balloon_timeout
             )
 
+    def start_tracker(self):
+        """
+        Start tracking a balloon change by BALLOON_CHANGE events, unless
+        balloon_event_tracking is no or the monitor is not QMP
+
+        :return: BalloonTracker object or None
+        """
+        monitor = self.vm.monitor
+        if (
+            self.params.get("balloon_event_tracking", "yes") != "yes"
+            or not monitor
+            or monitor.protocol != "qmp"
+        ):
+            return None
+        guest_cmd = self.params.get("balloon_guest_mem_cmd")
+        session = None
+        if guest_cmd:
+            # a session used only by the tracker thread
+            sessions = self.sessions.setdefault("balloon_tracker", [])
+            if not sessions or not sessions[0].is_responsive():
+                for old in sessions:
+                    old.close()
+                login_timeout = float(self.params.get("login_timeout", 600))
+                sessions[:] = [self.vm.wait_for_login(timeout=login_timeout)]
+            session = sessions[0]
+        tracker = balloon_tracker.BalloonTracker(
+            self.vm,
+            float(self.params.get("balloon_sample_interval", 0.2)),
+            session,
+            guest_cmd,
+        )
+        tracker.start()
+        return tracker
+
+    def _report_tracker(self, completed):
+        """
+        Log the speed of the tracked balloon change
+
+        :param completed: seconds to complete the change, None if it did not
+        """
+        summary = self.tracker.summary(completed)
+        change = "inflate" if summary["rate"] < 0 else "deflate"
+        self.test.log.info(
+            "Balloon %s from %dMB to %dMB in %.2fs(%s), %.1f MB/s, "
+            "%s BALLOON_CHANGE events",
+            change,
+            summary["initial"],
+            summary["final"],
+            summary["elapsed"],
+            "completed" if completed is not None else "timeout",
+            abs(summary["rate"]),
+            summary["events"],
+        )
+        if completed is not None and summary["final"] != summary["initial"]:
+            self.balloon_rates[change].append(abs(summary["rate"]))
+
     def run_balloon_sub_test(self, test, params, env, test_tag):
         """
         Run subtest after ballooned memory. Set up the related parameters
@@ -281,6 +351,21 @@ class BallooningTest(MemoryBaseTest):
         """
         self.test.log.info("Wait until guest memory don't change")
         threshold = int(self.params.get("guest_stable_threshold", 100))
+        tracker = self.tracker or self.start_tracker()
+        if tracker:
+            try:
+                ret = tracker.wait(
+                    None,
+                    float(timeout),
+                    float(self.params.get("balloon_quiet_time", 3)),
+                    threshold,
+                )
+            finally:
+                if tracker is not self.tracker:
+                    tracker.stop()
+            if ret is None:
+                self.test.log.warning("guest memory is not stable after %ss", timeout)
+            return
         is_stable = self._mem_state(threshold)
         ret = utils_misc.wait_for(
             lambda: next(is_stable),
@@ -635,6 +720,13 @@ def run(test, params, env):
                 test.fail("Balloon test failed %s" % tag)
         if quit_after_test:
             return
+    rates = dict(
+        ("%s_rate" % change, values)
+        for change, values in balloon_test.balloon_rates.items()
+        if values
+    )
+    if rates:
+        perf_results_db.record_results(test, params, {"balloon": rates})
     try:
         balloon_test.reset_memory()
         if (
@@ -1,8 +1,6 @@
-import copy
 import itertools
 import json
 import re
-import statistics as st
 import time
 
 from avocado.utils import process
@@ -10,6 +8,9 @@ from virttest import env_process, utils_disk
 from virttest.utils_misc import get_linux_drive_path
 from virttest.utils_windows.drive import get_disk_props_by_serial_number
 
+from provider import perf_results_db
+from provider.fio_results import FioResults
+from provider.fio_stream import get_job_iops, parse_fio_json
 from provider.storage_benchmark import generate_instance
 
 
@@ -103,49 +104,26 @@ def run(test, params, env):
         return fio_filename
 
     def preprocess_fio_data(results):
-        """Init FIO result data structure
+        """Init FIO test data structure
         {"images"=["img1",],
          "fio_items"=[]
          "fio_opts"=""
          "img1"={
-             "filename": "",
-             "global_options": {},
-             "jobs": {
-                 "job1":{
-                     "iops_avg":0,
-                     lat_avg:0,
-                     "bw":[],
-                     "iops":[],
-                     "lat":[],
-                     "job_runtime":0,
-                     "options":{},
-                     "job_cmd":""
-
-                 },
-                 "job2":{}
-
-             },
-             "results":[]
              "cmd": "",
              "cmds":[],
              "location": "",
-             "disk_name":""
              }
 
          }
-
+        The fio results of images are collected in fio_results.
         """
         results["images"] = params["compare_images"].split()
         opts = preprocess_fio_opts(results)
         for img in results["images"]:
             results[img] = {
-                "filename": "",
-                "global_options": {},
-                "jobs": {},
                 "cmd": "",
                 "cmds": [],
                 "location": "",
-                "results": [],
             }
             results[img]["location"] = params.get("fio_cmd_location_%s" % img, "vm")
             # guest fio
@@ -204,119 +182,42 @@ def run(test, params, env):
                     time.sleep(fio_interval)
 
     def parse_fio_result(cmd_output, img, results, record=False):
-        # if record:
-        #     logger.debug(cmd_output)
         try:
-            json_output = json.loads(cmd_output)
-            img_result = results[img]
-            if record:
-                img_result["results"].append(copy.deepcopy(json_output))
-            if "directory" in json_output["global options"]:
-                filename = json_output["global options"]["directory"]
-            else:
-                filename = json_output["global options"]["filename"]
-            if img_result.get("filename"):
-                if filename != img_result["filename"]:
-                    test.fail("Wrong data %s %s" % (filename, img_result["filename"]))
-            else:
-                # init global info
-                global_options = copy.deepcopy(json_output["global options"])
-                img_result["filename"] = filename
-                img_result["global_options"] = global_options
-                img_result["jobs"] = {}
-                if os_type == "linux":
-                    disk_name = "unknown"
-                    if json_output.get("disk_util"):
-                        disk_name = json_output["disk_util"][0]["name"]
-                    img_result["disk_name"] = disk_name
-
-            jobs = img_result["jobs"]
-            for job in json_output["jobs"]:
-                jobname = job["jobname"]
-                if jobname not in jobs:
-                    # init job info
-                    logger.debug("Add job: %s %s", filename, jobname)
-                    jobs[jobname] = {
-                        "options": job["job options"].copy(),
-                        "iops": [],
-                        "iops_avg": 0,
-                        "lat": [],
-                        "lat_avg": 0,
-                        "job_runtime": 0,
-                        "bw": [],
-                    }
-                read = int(job["read"]["iops"])
-                write = int(job["write"]["iops"])
-                iops = read + write
-                bw = int(job["read"]["bw"]) + int(job["write"]["bw"])
-                lat = int(job["read"]["lat_ns"]["mean"]) + int(
-                    job["write"]["lat_ns"]["mean"]
-                )
-                logger.debug(
-                    "Get %s %s  runtime:%s IOPS read:%s write:%s sum:%s",
-                    filename,
-                    jobname,
-                    job["job_runtime"],
-                    read,
-                    write,
-                    iops,
-                )
-                img_result["jobs"][jobname]["iops"].append(iops)
-                img_result["jobs"][jobname]["lat"].append(lat)
-                img_result["jobs"][jobname]["bw"].append(bw)
-                img_result["jobs"][jobname]["job_runtime"] = job["job_runtime"]
-
-            return img_result
-
+            json_output = parse_fio_json(cmd_output)[-1]
+            keep_raw = record and fio_keep_raw
+            return fio_results.add_output(img, json_output, keep_raw)
+        except ValueError as err:
+            test.fail(str(err))
         except Exception as err:
             logger.error("Exception:%s %s", err, cmd_output)
             raise err
 
-    def remove_maximum_deviation(alist):
-        if not alist:
-            return -1
-        average = sum(alist) * 1.0 / len(alist)
-        max_deviation = 0
-        pos = 0
-        for i, a in enumerate(alist):
-            if abs(a - average) > max_deviation:
-                max_deviation = abs(a - average)
-                pos = i
-        return alist.pop(pos)
-
     def compare_fio_result(results):
         # preprocess data to smooth data
+        drop_num = 0
+        if run_times > 3:
+            # Discard the samples farthest from the median
+            drop_num = round(run_times * (1 - sampling_rate))
+            logger.debug("Drop %s sample data...", drop_num)
+        summary = fio_results.summarize(drop_num)
         for img in results["images"]:
-            jobs = results[img]["jobs"]
-            for key in jobs.keys():
-                job = jobs[key]
-                raw_iops = job["iops"]
-                raw_lat = job["lat"]
-                logger.debug("%s raw %s iops:%s", img, key, raw_iops)
-                job["sample_iops"] = raw_iops.copy()
-                job["sample_lat"] = raw_lat.copy()
-                iops = job["sample_iops"]
-                lat = job["sample_lat"]
-
-                # Discard maximum deviation
-                if run_times > 3:
-                    drop_num = round(run_times * (1 - sampling_rate))
-                    logger.debug("Drop %s sample data...", drop_num)
-                    for i in range(drop_num):
-                        remove_maximum_deviation(iops)
-                        remove_maximum_deviation(lat)
-                sample_num = len(iops)
-                iops_avg = int(sum(iops) / sample_num)
-                job["iops_avg"] = iops_avg
-                job["iops_std"] = 0 if sample_num == 1 else st.stdev(iops)
-                job["iops_dispersion"] = round(job["iops_std"] / iops_avg, 6)
-                job["lat_avg"] = int(sum(lat) / sample_num)
+            jobs = summary[img]
+            for key, job in jobs.items():
+                logger.debug(
+                    "%s raw %s iops:%s",
+                    img,
+                    key,
+                    fio_results.images[img].jobs[key].iops.tolist(),
+                )
                 logger.debug(
-                    "%s smooth %s iops:%s AVG:%s lat:%s V:%s%%",
+                    "%s smooth %s iops:%s AVG:%s median:%s MAD:%s CI:%s lat:%s V:%s%%",
                     img,
                     key,
-                    iops,
-                    iops_avg,
+                    job["sample_iops"],
+                    job["iops_avg"],
+                    job["iops_median"],
+                    job["iops_mad"],
+                    job["iops_ci"],
                     job["lat_avg"],
                     job["iops_dispersion"] * 100,
                 )
@@ -326,14 +227,14 @@ def run(test, params, env):
         for idx in range(len(results["images"]) - 1):
             obj1_name = results["images"][idx]
             obj2_name = results["images"][idx + 1]
-            obj1_jobs = results[obj1_name]["jobs"]
-            obj2_jobs = results[obj2_name]["jobs"]
+            obj1_jobs = summary[obj1_name]
+            obj2_jobs = summary[obj2_name]
 
             for key in obj1_jobs.keys():
                 obj1_job = obj1_jobs[key]
                 obj2_job = obj2_jobs[key]
-                obj1_avg = obj1_job["iops_avg"]
-                obj2_avg = obj2_job["iops_avg"]
+                obj1_avg = obj1_job[compare_metric]
+                obj2_avg = obj2_job[compare_metric]
                 obj1_v = obj1_job["iops_dispersion"]
                 obj2_v = obj2_job["iops_dispersion"]
                 if (obj1_v > dispersion) or (obj2_v > dispersion):
@@ -380,15 +281,35 @@ def run(test, params, env):
         if warning_result:
             logger.warning("Get Warning :%s", warning_result)
 
+    def record_fio_results():
+        """store the samples of all fio jobs in the results database"""
+        if not params.get("perf_results_db"):
+            return
+        perf_results = {}
+        for img, image in fio_results.images.items():
+            for name, job in image.jobs.items():
+                perf_results["%s--%s" % (img, name)] = {
+                    "iops": job.iops,
+                    "bw": job.bw,
+                    "lat": job.lat,
+                }
+        default_cmd = "ver" if os_type == "windows" else "uname -r"
+        guest_ver = session.cmd_output(params.get("guest_ver_cmd", default_cmd))
+        perf_results_db.record_results(
+            test,
+            params,
+            perf_results,
+            guest_ver=guest_ver,
+            **perf_results_db.get_host_versions(params),
+        )
+
     def get_disk_iops(disk):
         cmd = host_test_cmd % disk
         logger.debug(cmd)
         cmd_output = process.getoutput(cmd)
         try:
-            json_output = json.loads(cmd_output)
-            job = json_output["jobs"][0]
-            read = int(job["read"]["iops"])
-            write = int(job["write"]["iops"])
+            read, write = get_job_iops(parse_fio_json(cmd_output)[-1])
+            read, write = int(read), int(write)
             iops = read + write
             logger.debug("Find read:%s write:%s total:%s", read, write, iops)
             return iops
@@ -554,6 +475,10 @@ def run(test, params, env):
     run_times = params.get_numeric("run_times", 1)
     fio_dir = params["fio_dir"]
     test_results = {}
+    fio_results = FioResults(params["compare_images"].split())
+    fio_keep_raw = params.get("fio_keep_raw", "no") == "yes"
+    # iops_avg, iops_median or iops_trimmed_mean
+    compare_metric = params.get("fio_compare_metric", "iops_avg")
     host_test_cmd = params["host_test_cmd"]
     host_test_file = fio_dir + "/test.img"
     check_host_iops_req = params.get_numeric("check_host_iops_req", 0)
@@ -614,4 +539,5 @@ def run(test, params, env):
         logger.debug("Execute host deinit: %s", host_deinit_operation)
         execute_operation("host", host_deinit_operation)
 
+    record_fio_results()
     compare_fio_result(test_results)
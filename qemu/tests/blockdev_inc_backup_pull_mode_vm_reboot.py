@@ -59,7 +59,7 @@ class BlockdevIncBackupPullModeRebootVMTest(BlockdevLiveBackupBaseTest):
             if not ret[1]:
                 self.test.fail("Failed to hotplug '%s'" % dev)
 
-    def generate_data_file(self, tag, filename=None):
+    def generate_data_files(self, tags, filename=None):
         """
         No need to create files, just start vm from the target,
         also note that, currently, creating a file may cause
@@ -41,12 +41,13 @@ class BlkdevIncXptInconBitmap(BlockdevBaseTest):
             **extra_options,
         )
 
-    def prepare_data_disk(self, tag):
+    def prepare_data_disks(self, filename=None):
         """
-        Override this function, only make fs and mount it
-        :param tag: image tag
+        Override this function, only make fs and mount them
+        :param filename: unused, no temp file is created
         """
-        self.format_data_disk(tag)
+        for tag in self.params.objects("source_images"):
+            self.format_data_disk(tag)
 
     def gen_inc_files(self):
         return list(map(self.generate_data_file, self.src_img_tags))
@@ -2,12 +2,15 @@ import math
 import os
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import aexpect
 from avocado.utils import process
 from virttest import data_dir, env_process, utils_misc, utils_test
 from virttest.staging import utils_memory
 
+from provider import ksm_sampler, perf_results_db
+
 
 def run(test, params, env):
     """
@@ -37,6 +40,14 @@ def run(test, params, env):
                    3) Verifies all pages
                    4) Fills memory with the same number (S2)
                    5) Changes the last 96B (S3)
+    Concurrent mode - uses multiple VMs like serial mode, fills all guests
+                   at the same time and samples the KSM counters of host.
+                   0) Prints out the setup and initialize guest(s)
+                   1) Fills all guests with the same number (S1)
+                   2) Fills all guests with another number (S1)
+                   3) Optionally fills all guests with random numbers (S2)
+                   The merge rate and the time to steady state of every
+                   scenario are reported.
 
     Scenarios:
     S1) Fill all vms with the same value (all pages should be merged into 1)
@@ -55,7 +66,9 @@ def run(test, params, env):
     :param cfg: ksm_parallel_ratio - number of workers (parallel mode only)
     :param cfg: ksm_host_reserve - override memory reserve on host in MB
     :param cfg: ksm_guest_reserve - override memory reserve on guests in MB
-    :param cfg: ksm_mode - test mode {serial, parallel}
+    :param cfg: ksm_mode - test mode {serial, parallel, concurrent}
+    :param cfg: ksm_pages_to_scan - pages_to_scan of KSM
+    :param cfg: ksm_sleep_millisecs - sleep_millisecs of KSM
     :param cfg: ksm_perf_ratio - performance ratio, increase it when your
                                  machine is too slow
     """
@@ -447,6 +460,114 @@ def run(test, params, env):
         session.close()
         vm.destroy(gracefully=False)
 
+    def fill_concurrent():
+        """
+        Fill the memory of all guests concurrently, sample the KSM counters
+        of host meanwhile, and report the merge rate and the time to the
+        steady state of every scenario.
+        """
+        interval = float(params.get("ksm_sample_interval", 0.1))
+        tolerance = float(params.get("ksm_steady_tolerance", 0.01))
+        steady_scans = int(params.get("ksm_steady_scans", 1))
+        steady_timeout = float(
+            params.get("ksm_steady_timeout", fill_base_timeout * vmsc * perf_ratio)
+        )
+        merge_ratio = float(params.get("ksm_merge_ratio", 0.9))
+        scenarios = [
+            ("S1_merge", "mem.value_fill(%d)" % skeys[0], skeys[0]),
+            ("S1_remerge", "mem.value_fill(%d)" % skeys[1], skeys[1]),
+        ]
+        if params.get("ksm_concurrent_split") == "yes":
+            scenarios.append(("S2_split", "mem.static_random_fill()", None))
+
+        def run_all(func):
+            futures = [executor.submit(func, i) for i in range(vmsc)]
+            return [future.result() for future in futures]
+
+        def init_guest(i):
+            lsessions[i].cmd("swapoff -a", timeout=300)
+            _start_allocator(lvms[i], lsessions[i], 60 * perf_ratio)
+            cmd = "mem = MemFill(%d, %s, %s)" % (ksm_size, skeys[i], dkeys[i])
+            _execute_allocator(cmd, lvms[i], lsessions[i], 60 * perf_ratio)
+
+        test.log.info("Phase 1: start the allocators on %d guests", vmsc)
+        executor = ThreadPoolExecutor(max_workers=vmsc)
+        sampler = ksm_sampler.KSMSampler(interval)
+        sampler.start()
+        results = {}
+        try:
+            run_all(init_guest)
+            test.log.info("Phase 1: PASS")
+
+            for name, cmd, value in scenarios:
+                test.log.info("Phase %s: '%s' on all guests", name, cmd)
+                start = sampler.mark(name)
+                run_all(
+                    lambda i: _execute_allocator(
+                        cmd, lvms[i], lsessions[i], fill_base_timeout * 2 * perf_ratio
+                    )
+                )
+                filled = sampler.now()
+                steady = sampler.wait_steady(
+                    filled, steady_timeout, tolerance, steady_scans
+                )
+                if steady is None:
+                    test.log.debug(utils_test.get_memory_info(lvms))
+                    test.fail(
+                        "KSM did not reach steady state in %ss after %s"
+                        % (steady_timeout, name)
+                    )
+                average, peak = sampler.merge_rate(start, steady)
+                shm = get_ksmstat()
+                test.log.info(
+                    "%s: filled in %.1fs, steady after %.1fs, merge rate "
+                    "%.0f pages/s (peak %.0f), sharing %dMB, unshared %d pages, "
+                    "%d full scans",
+                    name,
+                    filled - start,
+                    steady - start,
+                    average,
+                    peak,
+                    shm,
+                    sampler.value("pages_unshared"),
+                    sampler.value("full_scans") - sampler.value("full_scans", start),
+                )
+                results[name] = {
+                    "merge_rate": average,
+                    "peak_merge_rate": peak,
+                    "fill_latency": filled - start,
+                    "steady_latency": steady - start,
+                }
+                if value is None:
+                    continue
+                if shm < ksm_size * vmsc * merge_ratio:
+                    test.fail(
+                        "Only %dMB shared after %s, expected %dMB"
+                        % (shm, name, ksm_size * vmsc * merge_ratio)
+                    )
+                run_all(
+                    lambda i: _execute_allocator(
+                        "mem.value_check(%d)" % value,
+                        lvms[i],
+                        lsessions[i],
+                        mem / 200 * 50 * perf_ratio,
+                    )
+                )
+                test.log.info("Phase %s: PASS", name)
+        finally:
+            sampler.stop()
+            executor.shutdown()
+            sampler.save(os.path.join(test.outputdir, "ksm_samples.csv"))
+
+        perf_results_db.record_results(
+            test, params, results, **perf_results_db.get_host_versions(params)
+        )
+        test.log.debug(utils_test.get_memory_info(lvms))
+        test.log.debug("Cleaning up...")
+        for i in range(0, vmsc):
+            lsessions[i].cmd_output("die()", 20)
+            lvms[i].destroy(gracefully=False)
+
     # Main test code
     test.log.info("Starting phase 0: Initialization")
     if process.run("ps -C ksmtuned", ignore_status=True).exit_status == 0:
@@ -454,8 +575,16 @@ def run(test, params, env):
         process.run("killall ksmtuned")
     new_ksm = False
     if os.path.exists("/sys/kernel/mm/ksm/run"):
-        process.run("echo 50 > /sys/kernel/mm/ksm/sleep_millisecs", shell=True)
-        process.run("echo 5000 > /sys/kernel/mm/ksm/pages_to_scan", shell=True)
+        process.run(
+            "echo %s > /sys/kernel/mm/ksm/sleep_millisecs"
+            % params.get("ksm_sleep_millisecs", 50),
+            shell=True,
+        )
+        process.run(
+            "echo %s > /sys/kernel/mm/ksm/pages_to_scan"
+            % params.get("ksm_pages_to_scan", 5000),
+            shell=True,
+        )
         process.run("echo 1 > /sys/kernel/mm/ksm/run", shell=True)
 
         e_up = "/sys/kernel/mm/transparent_hugepage/enabled"
@@ -465,6 +594,8 @@ def run(test, params, env):
         if os.path.exists(e_rh):
             process.run("echo 'never' > %s" % e_rh, shell=True)
         new_ksm = True
+    elif params["ksm_mode"] == "concurrent":
+        test.cancel("Concurrent mode needs the KSM counters in sysfs")
     else:
         try:
             process.run("modprobe ksm")
@@ -506,7 +637,7 @@ def run(test, params, env):
     vmsc = int(overcommit) + 1
     vmsc = max(vmsc, max_vms)
 
-    if params["ksm_mode"] == "serial":
+    if params["ksm_mode"] in ("serial", "concurrent"):
         max_alloc = vmsc
         if _host_reserve:
             # First round of additional guest reserves
@@ -657,7 +788,15 @@ def run(test, params, env):
                 "VM %s seems to be dead; Test requires aliving VM" % lvms[i].name
             )
 
-        lsessions.append(lvms[i].wait_for_login(timeout=360))
+        if params["ksm_mode"] != "concurrent":
+            lsessions.append(lvms[i].wait_for_login(timeout=360))
+
+    if params["ksm_mode"] == "concurrent":
+        # log in to the other guests while they boot
+        with ThreadPoolExecutor(max_workers=vmsc) as executor:
+            lsessions.extend(
+                executor.map(lambda vm: vm.wait_for_login(timeout=360), lvms[1:])
+            )
 
     # Let guests rest a little bit :-)
     pause = vmsc * 2 * perf_ratio
@@ -684,3 +823,7 @@ def run(test, params, env):
         separate_first_guest()
         split_guest()
         test.log.info("KSM test serial mode: PASS")
+    elif params["ksm_mode"] == "concurrent":
+        test.log.info("Starting KSM test concurrent mode")
+        fill_concurrent()
+        test.log.info("KSM test concurrent mode: PASS")
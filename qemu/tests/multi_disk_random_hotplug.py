@@ -21,6 +21,7 @@ from virttest import (
 from virttest.qemu_monitor import Monitor
 from virttest.remote import LoginTimeoutError
 
+from provider import guest_disk_watcher
 from provider.block_devices_plug import BlockDevicesPlug
 from provider.storage_benchmark import generate_instance
 
@@ -302,16 +303,22 @@ def run(test, params, env):
                 stress_session.sendline(stress_cmd)
 
         rp_times = int(params.get("repeat_times", 1))
-        queues = params.get("multi_disk_type") == "parallel"
+        multi_disk_type = params.get("multi_disk_type")
         timeout = params.get_numeric("plug_timeout", 300)
         interval_time_unplug = params.get_numeric("interval_time_unplug", 0)
-        if queues:  # parallel
+        if multi_disk_type == "parallel":
             hotplug, unplug = "hotplug_devs_threaded", "unplug_devs_threaded"
+        elif multi_disk_type == "batch":
+            hotplug, unplug = "hotplug_devs_batch", "unplug_devs_serial"
         else:  # serial
             hotplug, unplug = "hotplug_devs_serial", "unplug_devs_serial"
 
         context_msg = "Running sub test '%s' %s"
         plug = BlockDevicesPlug(vm)
+        if params.get("plug_watch_events", "no") == "yes":
+            funcatexit.register(
+                env, params.get("type"), guest_disk_watcher.stop_disk_watcher, vm
+            )
         for iteration in range(rp_times):
             error_context.context(
                 "Hotplugging/unplugging devices, iteration %d" % iteration,
@@ -0,0 +1,136 @@
+import os
+
+from virttest import error_context, utils_misc, utils_numeric
+
+from provider.nbd_export_bench import (
+    get_bench_address,
+    log_bench_results,
+    run_client_bench,
+    run_qemu_img_bench,
+)
+from provider.nbd_image_export import InternalNBDExportImage, QemuNBDExportImage
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Benchmark the NBD export of a local image
+
+    1) Create a local image
+    2) Export it with qemu-nbd, or with the internal NBD server of the VM
+       on the iothread given by block_export_iothread
+    3) Drive the export by a local NBD client, NBDBenchClient or qemu-img
+       bench, for every block size and depth
+    4) Report MB/s, IOPS and the latency percentiles of every case
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+
+    def _config_name():
+        if export_type == "internal":
+            server = "internal(iothread=%s,fixed=%s)" % (
+                image_params.get("block_export_iothread") or "main",
+                image_params.get("block_export_fixed_iothread", "no"),
+            )
+        else:
+            server = "qemu-nbd"
+        return "%s/%s/%s%s" % (
+            server,
+            address["type"],
+            client,
+            "/tls" if tls_dir else "",
+        )
+
+    def _bench(block_size, depth):
+        if client == "qemu_img":
+            return run_qemu_img_bench(
+                utils_misc.get_qemu_img_binary(params),
+                address,
+                export_name,
+                block_size,
+                depth,
+                params.get_numeric("nbd_bench_count", 100000),
+                write,
+                tls_dir,
+                params.get_numeric("nbd_bench_timeout", 600),
+            )
+        return run_client_bench(
+            address,
+            export_name,
+            block_size,
+            depth,
+            params.get_numeric("nbd_bench_duration", 10, float),
+            write,
+            params.get("nbd_bench_pattern", "seq"),
+            tls_dir,
+        )
+
+    tag = params["local_image_tag"]
+    image_params = params.object_params(tag)
+    export_type = params.get("nbd_export_type", "qemu_nbd")
+    client = params.get("nbd_bench_client", "python")
+    write = params.get("nbd_bench_rw", "read") == "write"
+    tls_dir = None
+    if image_params.get("nbd_server_tls_creds"):
+        tls_dir = image_params["nbd_client_tls_creds"]
+        if not os.path.exists(os.path.join(tls_dir, "ca-cert.pem")):
+            test.cancel("No TLS credentials of the client in %s" % tls_dir)
+
+    if export_type == "internal":
+        vm = env.get_vm(params["main_vm"])
+        vm.verify_alive()
+        nbd_export = InternalNBDExportImage(vm, params, tag)
+        nbd_export.create_image()
+        nbd_export.hotplug_tls()
+        nbd_export.hotplug_image()
+    else:
+        nbd_export = QemuNBDExportImage(params, tag)
+        nbd_export.create_image()
+
+    error_context.context("Export image %s" % tag, test.log.info)
+    nbd_export.export_image()
+    try:
+        if export_type == "internal":
+            export_name = nbd_export.get_export_name()
+        else:
+            export_name = image_params.get("nbd_export_name", "")
+        address = get_bench_address(image_params)
+        config = _config_name()
+
+        results = []
+        for size in params.objects("nbd_bench_block_sizes"):
+            block_size = int(float(utils_numeric.normalize_data_size(size, "B")))
+            for depth in map(int, params.objects("nbd_bench_depths")):
+                error_context.context(
+                    "Benchmark %s: %s %d bytes x %d"
+                    % (config, "write" if write else "read", block_size, depth),
+                    test.log.info,
+                )
+                result = _bench(block_size, depth)
+                result.update(
+                    config=config,
+                    rw="write" if write else "read",
+                    block_size=block_size,
+                    depth=depth,
+                )
+                results.append(result)
+    finally:
+        nbd_export.stop_export()
+
+    log_bench_results(results, os.path.join(test.resultsdir, "nbd_bench.jsonl"))
+    min_mbps = params.get_numeric("nbd_bench_min_mbps", 0, float)
+    slow = [r for r in results if r["mbps"] < min_mbps]
+    if slow:
+        test.fail(
+            "Throughput of %s is below %s MB/s: %s"
+            % (
+                config,
+                min_mbps,
+                ", ".join(
+                    "%dB x %d: %.2f" % (r["block_size"], r["depth"], r["mbps"])
+                    for r in slow
+                ),
+            )
+        )
@@ -120,12 +120,17 @@ def run(test, params, env):
     mq_port = params.get("mq_port", 5000)
     wait_response_timeout = params.get_numeric("wait_response_timeout", 1800)
 
-    mq_publisher = message_queuing.MQPublisher(mq_port, other_options="--broker")
+    mq_backend = params.get("mq_backend", "nc")
 
     host = "127.0.0.1"
 
-    test.log.info("host:%s port:%s", host, mq_port)
-    client = message_queuing.MQClient(host, mq_port)
+    test.log.info("host:%s port:%s backend:%s", host, mq_port, mq_backend)
+    if mq_backend == "socket":
+        mq_publisher = message_queuing.MQSocketPublisher(mq_port, broker=True)
+        client = message_queuing.MQSocketClient(host, mq_port)
+    else:
+        mq_publisher = message_queuing.MQPublisher(mq_port, other_options="--broker")
+        client = message_queuing.MQClient(host, mq_port)
     time.sleep(2)
 
     client.register_msg("resize", _on_resize)
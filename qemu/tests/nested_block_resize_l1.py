@@ -73,8 +73,12 @@ def run(test, params, env):
 
     host = params.get("mq_publisher")
     mq_port = params.get("mq_port", 5000)
-    test.log.info("host:%s port:%s", host, mq_port)
-    client = message_queuing.MQClient(host, mq_port)
+    mq_backend = params.get("mq_backend", "nc")
+    test.log.info("host:%s port:%s backend:%s", host, mq_port, mq_backend)
+    if mq_backend == "socket":
+        client = message_queuing.MQSocketClient(host, mq_port)
+    else:
+        client = message_queuing.MQClient(host, mq_port)
     time.sleep(2)
     cmd_dd = params["cmd_dd"] % guest_path
     error_context.context("Do dd writing test on the data disk.", test.log.info)
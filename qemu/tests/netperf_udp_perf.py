@@ -6,7 +6,7 @@ import time
 from avocado.utils import process
 from virttest import error_context, remote, virt_vm
 
-from provider import netperf_base
+from provider import netperf_base, perf_results_db
 
 LOG_JOB = logging.getLogger("avocado.test")
 
@@ -150,7 +150,10 @@ def start_test(
         params = {}
 
     fd = open("%s/netperf-udp-perf.result.%s.RHS" % (resultsdir, time.time()), "w")
-    netperf_base.record_env_version(test, params, host, server_ctl, fd, test_duration)
+    versions = netperf_base.record_env_version(
+        test, params, host, server_ctl, fd, test_duration
+    )
+    perf_results = {}
 
     error_context.context("Start Netserver on guest", LOG_JOB.info)
     netperf_version = params.get("netperf_version", "2.6.0")
@@ -236,6 +239,11 @@ def start_test(
             prefix = "%s--%s" % (i, j)
             for key in key_list:
                 test.write_test_keyval({"%s--%s" % (prefix, key): ret[key]})
+            perf_results[prefix] = {
+                key: ret[key]
+                for key in key_list
+                if key not in ("burst_time", "numbers_per_burst")
+            }
 
             LOG_JOB.info(row)
             fd.write(row + "\n")
@@ -247,3 +255,4 @@ def start_test(
             netperf_base.ssh_cmd(client, "rm -f %s" % fname)
 
     fd.close()
+    perf_results_db.record_results(test, params, perf_results, **versions)
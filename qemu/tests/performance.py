@@ -9,6 +9,8 @@ import six
 from avocado.utils import download, process
 from virttest import data_dir, utils_misc, utils_test
 
+from provider import perf_results_db
+
 
 def cmd_runner_monitor(test, vm, monitor_cmd, test_cmd, guest_path, timeout=300):
     """
@@ -343,6 +345,7 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
     no_table_results = {}
     thread_tag = params.get("thread_tag", "thread")
     order_list = []
+    perf_results = {}
     for prefix in results_files:
         marks = params.get("marks", "").split()
         case_infos = prefix.split("--")
@@ -408,6 +411,7 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
             if mark_tag not in no_table_list and mark_tag not in order_list:
                 order_list.append(mark_tag)
             test.write_perf_keyval({"%s-%s" % (prefix_perf, mark_tag): perf_value})  # pylint: disable=E0606
+            perf_results.setdefault(prefix_perf, {})[mark_tag] = perf_value
         # start analyze the mpstat results
         if params.get("mpstat") == "yes":
             guest_cpu_infos = mpstat_ana(results_files[prefix][1])
@@ -430,6 +434,10 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
             tmp_dic["SUMKbps_per_Hostcpu"] = sum_kbps / tmp_dic["Hostcpu"]
             order_list.append("SUMKbps_per_Hostcpu")
 
+    perf_results_db.record_results(
+        test, params, perf_results, host_ver, guest_ver, kvm_ver
+    )
+
     sum_marks = params.get("sum_marks", "").split()
     sum_matrix = {}
     order_line = ""
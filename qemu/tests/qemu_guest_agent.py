@@ -4,12 +4,12 @@ import logging
 import os
 import random
 import re
+import statistics
 import string
 import time
 
 import aexpect
 from aexpect.exceptions import ShellTimeoutError
-from avocado.core import exceptions
 from avocado.utils import genio, process
 from avocado.utils import path as avo_path
 from virttest import (
@@ -26,6 +26,7 @@ from virttest import (
 from virttest.utils_version import VersionInterval
 from virttest.utils_windows import virtio_win
 
+from provider import perf_results_db, qga_load, session_pool
 from provider.win_driver_installer_test import (
     run_installer_with_interaction,
     uninstall_gagent,
@@ -95,18 +96,37 @@ class QemuGuestAgentTest(BaseVirtTest):
         BaseVirtTest.__init__(self, test, params, env)
 
         self._open_session_list = []
+        self._session_pools = []
         self.gagent = None
         self.vm = None
         self.gagent_install_cmd = params.get("gagent_install_cmd")
         self.gagent_uninstall_cmd = params.get("gagent_uninstall_cmd")
 
     def _get_session(self, params, vm):
+        """
+        Get a session of the VM, leased from the session pool of the VM
+        if gagent_session_pool is yes, session.close() gives it back.
+        """
         if not vm:
             vm = self.vm
         vm.verify_alive()
         timeout = int(params.get("login_timeout", 360))
-        session = vm.wait_for_login(timeout=timeout)
-        return session
+        if params.get("gagent_session_pool", "no") != "yes":
+            return vm.wait_for_login(timeout=timeout)
+        pool = session_pool.get_session_pool(
+            vm,
+            login_timeout=timeout,
+            max_logins=int(params.get("session_pool_max_logins", 2)),
+            max_idle=int(params.get("session_pool_max_idle", 2)),
+        )
+        if pool not in self._session_pools:
+            self._session_pools.append(pool)
+        return pool.acquire()
+
+    def _invalidate_sessions(self):
+        """Drop the idle pooled sessions, e.g. the guest is going to reboot"""
+        for pool in self._session_pools:
+            pool.invalidate()
 
     def _cleanup_open_session(self):
         try:
@@ -435,6 +455,9 @@ class QemuGuestAgentTest(BaseVirtTest):
 
     def cleanup(self, test, params, env):
         self._cleanup_open_session()
+        for pool in self._session_pools:
+            pool.report()
+            pool.close()
 
 
 class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
@@ -557,6 +580,7 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
             vm = self.env.get_vm(self.params["main_vm"])
             vm.verify_alive()
             self.vm = vm
+        self._invalidate_sessions()
         self.gagent.shutdown(shutdown_mode)
 
     def __gagent_check_serial_output(self, pattern):
@@ -945,8 +969,7 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
         :param params: Dictionary with the test parameters
         :param env: Dictionary with test environment.
         """
-        timeout = float(params.get("login_timeout", 240))
-        session = self.vm.wait_for_login(timeout=timeout)
+        session = self._get_session(params, self.vm)
         get_guest_time_cmd = params["get_guest_time_cmd"]
         error_context.context("get the time of the guest", LOG_JOB.info)
         nanoseconds_time = self.gagent.get_time()
@@ -982,8 +1005,7 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
         :param params: Dictionary with the test parameters
         :param env: Dictionary with test environment.
         """
-        timeout = float(params.get("login_timeout", 240))
-        session = self.vm.wait_for_login(timeout=timeout)
+        session = self._get_session(params, self.vm)
         get_guest_time_cmd = params["get_guest_time_cmd"]
         error_context.context("get the time of the guest", LOG_JOB.info)
         guest_time_before = session.cmd_output(get_guest_time_cmd)
@@ -1131,69 +1153,220 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
             test.fail("The guest time sync failed.")
 
     @error_context.context_aware
-    def _get_mem_used(self, session, cmd):
+    def gagent_check_memory_leak(self, test, params, env):
         """
-        get memory usage of the process
+        Run a mix of agent commands at high rate, sample the memory usage
+        of qemu-ga at a fixed cadence meanwhile, then check the slope of the
+        memory usage per command fitted by linear regression.
 
-        :param session: use for sending cmd
-        :param cmd: get details of the process
+        :param test: kvm test object
+        :param params: Dictionary with the test parameters
+        :param env: Dictionary with test environment.
         """
+        test_commands = params.get("test_commands", params.get("test_command"))
+        commands = qga_load.parse_commands(test_commands or "guest-info")
+        repeats = int(params.get("repeats", 1))
+        duration = float(params.get("test_duration", 0)) or None
+        callers = int(params.get("test_callers", 1))
+        interval = float(params.get("memory_sample_interval", 1))
+        warmup = int(params.get("memory_leak_warmup", 2))
+        # KB per 1000 commands
+        max_slope = float(params.get("memory_leak_slope", 0.5))
+        confidence = float(params.get("memory_leak_confidence", 0.95))
+        sample_cmd = params.get("memory_sample_cmd")
+        if not sample_cmd:
+            sample_cmd = (
+                "awk '/^(VmRSS|RssAnon):/ {print $2}' /proc/$(pidof qemu-ga)/status"
+            )
 
-        output = session.cmd_output(cmd)
-        LOG_JOB.info("The process details: %s", output)
+        load = qga_load.QGALoad(self.gagent, commands, callers)
+        session = self._get_session(params, self.vm)
+        sampler = qga_load.MemorySampler(
+            session, sample_cmd, interval, lambda: load.completed
+        )
+        error_context.context(
+            "Sample the memory usage of qemu-ga every %ss while running %s"
+            % (interval, commands),
+            LOG_JOB.info,
+        )
+        sampler.start()
         try:
-            memory_usage = int(output.split(" ")[-2].replace(",", ""))
-            return memory_usage
-        except Exception:
-            raise exceptions.TestError(
-                "Get invalid memory usage by cmd '%s' (%s)" % (cmd, output)
+            load.start(repeats, duration)
+            load.wait()
+        finally:
+            sampler.stop()
+            session.close()
+        self.vm.verify_alive()
+        load.log_summary()
+
+        z = statistics.NormalDist().inv_cdf(confidence)
+        for values in ("rss", "private"):
+            samples = len(getattr(sampler, values))
+            if values == "private" and not samples:
+                # the private memory is not printed by memory_sample_cmd
+                continue
+            if samples < warmup + 3:
+                test.error(
+                    "Only %s samples of qemu-ga %s, at least %s are needed, "
+                    "run the commands longer or sample them more often"
+                    % (samples, values, warmup + 3)
+                )
+            slope, _, r2, se = sampler.fit(values, "ops", warmup)
+            slope, se = slope * 1000, se * 1000
+            per_sec = sampler.fit(values, "times", warmup)[0]
+            LOG_JOB.info(
+                "qemu-ga %s: %s samples, %.3f(+-%.3f) KB per 1000 commands, "
+                "%.3f KB/s, r2 %.2f",
+                values,
+                samples,
+                slope,
+                se,
+                per_sec,
+                r2,
             )
+            if slope - z * se > max_slope:
+                test.fail(
+                    "qemu-ga %s grows %.3f KB per 1000 commands, more than "
+                    "%s at confidence %s" % (values, slope, max_slope, confidence)
+                )
 
     @error_context.context_aware
-    def gagent_check_memory_leak(self, test, params, env):
+    def gagent_check_benchmark(self, test, params, env):
         """
-        repeat execute "guest-info" command to guest agent, check memory
-        usage of the qemu-ga
+        Measure the throughput and latency of agent commands, every command
+        is run in a tight loop by one caller, then in concurrent bursts by
+        several callers, guest-file-read is run with every chunk size.
+
+        QemuAgent serializes the commands by a lock polled every 50ms, so
+        the latencies of several callers mostly measure the wait for the
+        lock, they are reported as p50/p99_lat_contended, only the
+        latencies of one caller are the ones of qemu-ga.
 
         :param test: kvm test object
         :param params: Dictionary with the test parameters
         :param env: Dictionary with test environment.
         """
+        bench_commands = params.get(
+            "bench_commands",
+            "guest-ping guest-info guest-get-fsinfo guest-file-write "
+            "guest-file-read guest-exec",
+        ).split()
+        callers_list = [int(n) for n in params.get("bench_callers", "1 4").split()]
+        duration = float(params.get("bench_duration", 10))
+        timeout = float(params.get("bench_cmd_timeout", 60))
+        bench_file = params.get("bench_file", "/tmp/qga_bench.dat")
+        # guest-file-write has its own file, so the data read is kept
+        write_file = bench_file + ".write"
+        file_size = int(params.get("bench_file_size", 64 * 1024**2))
+        read_chunks = [
+            int(n) for n in params.get("bench_read_chunks", "4096 1048576").split()
+        ]
+        write_chunk = int(params.get("bench_write_chunk", 65536))
+        exec_args = params.get("bench_exec_args", "").split()
+        exec_path = params.get("bench_exec_path", "true")
 
-        timeout = float(params.get("login_timeout", 240))
-        test_command = params.get("test_command", "guest-info")
-        memory_usage_cmd = params.get(
-            "memory_usage_cmd", "tasklist | findstr /I qemu-ga.exe"
+        session = self._get_session(params, self.vm)
+        self._open_session_list.append(session)
+        # guest-exec and guest-file-* are blocked by default in linux guest
+        change_bl = any(
+            cmd == "guest-exec" or cmd.startswith("guest-file-")
+            for cmd in bench_commands
         )
-        session = self.vm.wait_for_login(timeout=timeout)
-        error_context.context(
-            "get the memory usage of qemu-ga before run '%s'" % test_command,
-            LOG_JOB.info,
+        if change_bl:
+            self._change_bl(session)
+
+        handles = []
+        cases = []
+        try:
+            for cmd in bench_commands:
+                if cmd == "guest-file-write":
+                    handle = self.gagent.guest_file_open(write_file, mode="wb")
+                    handles.append(handle)
+                    operation = qga_load.file_write_op(
+                        handle, os.urandom(write_chunk), file_size
+                    )
+                    cases.append(("%s-%s" % (cmd, write_chunk), cmd, operation))
+                elif cmd == "guest-file-read":
+                    error_context.context(
+                        "Fill %s with %s bytes" % (bench_file, file_size),
+                        LOG_JOB.info,
+                    )
+                    handle = self.gagent.guest_file_open(bench_file, mode="wb")
+                    fill = qga_load.file_write_op(
+                        handle, os.urandom(1024**2), file_size
+                    )
+                    for _ in range(max(file_size // 1024**2, 1)):
+                        if fill(self.gagent, timeout)[3]:
+                            test.error("Failed to fill %s" % bench_file)
+                    self.gagent.guest_file_close(handle)
+                    for chunk in read_chunks:
+                        handle = self.gagent.guest_file_open(bench_file, mode="rb")
+                        handles.append(handle)
+                        operation = qga_load.file_read_op(handle, chunk)
+                        cases.append(("%s-%s" % (cmd, chunk), cmd, operation))
+                elif cmd == "guest-exec":
+                    operation = qga_load.exec_op(exec_path, exec_args)
+                    cases.append((cmd, cmd, operation))
+                else:
+                    cases.append((cmd, cmd, None))
+
+            results = {}
+            failures = []
+            for case, cmd, operation in cases:
+                for callers in callers_list:
+                    error_context.context(
+                        "Run %s by %s callers for %ss" % (case, callers, duration),
+                        LOG_JOB.info,
+                    )
+                    load = qga_load.QGALoad(
+                        self.gagent, [(cmd, 1, operation)], callers, timeout
+                    )
+                    summary = load.log_summary(load.run(duration=duration))
+                    item = summary["commands"][cmd]
+                    lat = "lat" if callers == 1 else "lat_contended"
+                    results["%s--%s" % (case, callers)] = {
+                        "ops_per_sec": summary["ops_per_sec"],
+                        "bytes_per_sec": summary["bytes_per_sec"],
+                        "payload_per_sec": item["payload"] / summary["elapsed"],
+                        "p50_%s" % lat: item["p50"],
+                        "p99_%s" % lat: item["p99"],
+                    }
+                    if item["errors"]:
+                        failures.append(
+                            "%s by %s callers: %s of %s failed"
+                            % (case, callers, item["errors"], item["count"])
+                        )
+            self.vm.verify_alive()
+        finally:
+            for handle in handles:
+                self.gagent.guest_file_close(handle)
+            session.cmd_output("%s %s %s" % (params["cmd_del"], bench_file, write_file))
+            if change_bl:
+                self._change_bl_back(session)
+
+        LOG_JOB.info(
+            "%-32s %10s %10s %10s %12s", "case", "ops/s", "p50(ms)", "p99(ms)", "MB/s"
         )
-        memory_usage_before = self._get_mem_used(session, memory_usage_cmd)
-        session.close()
-        repeats = int(params.get("repeats", 1))
-        for i in range(repeats):
-            error_context.context(
-                "execute '%s' %s times" % (test_command, i + 1), LOG_JOB.info
+        for case, result in results.items():
+            lat = "lat" if "p50_lat" in result else "lat_contended"
+            LOG_JOB.info(
+                "%-32s %10.1f %10.2f %10.2f %12.2f%s",
+                case,
+                result["ops_per_sec"],
+                result["p50_%s" % lat] * 1000,
+                result["p99_%s" % lat] * 1000,
+                result["bytes_per_sec"] / 1024**2,
+                "" if lat == "lat" else " *",
             )
-            return_msg = self.gagent.guest_info()
-            LOG_JOB.info(str(return_msg))
-        self.vm.verify_alive()
-        error_context.context(
-            "get the memory usage of qemu-ga after run '%s'" % test_command,
-            LOG_JOB.info,
+        LOG_JOB.info(
+            "* the latencies of several callers include the wait for the "
+            "agent lock, which is polled every 50ms"
         )
-        session = self.vm.wait_for_login(timeout=timeout)
-        memory_usage_after = self._get_mem_used(session, memory_usage_cmd)
-        session.close()
-        # less than 500K is acceptable.
-        if memory_usage_after - memory_usage_before > 500:
-            test.fail(
-                "The memory usages are different, "
-                "before run command is %skb and "
-                "after run command is %skb" % (memory_usage_before, memory_usage_after)
-            )
+        versions = perf_results_db.get_host_versions(params)
+        versions["guest_ver"] = str(self.gagent.guest_info()["version"])
+        perf_results_db.record_results(test, params, results, **versions)
+        if failures:
+            test.fail("Agent commands failed: %s" % "; ".join(failures))
 
     @error_context.context_aware
     def gagent_check_fstrim(self, test, params, env):
@@ -1278,8 +1451,7 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
 
         self.initialize(test, params, env)
         self.setup(test, params, env)
-        timeout = float(params.get("login_timeout", 240))
-        session = self.vm.wait_for_login(timeout=timeout)
+        session = self._get_session(params, self.vm)
         device_name = get_guest_discard_disk(session)
         self.gagent_setsebool_value("on", params, self.vm)
 
@@ -4,7 +4,7 @@ import json
 
 from virttest import error_context
 
-from provider.qsd import QsdDaemonDev
+from provider.qsd import QsdDaemonDev, register_pool_drain
 
 
 # This decorator makes the test function aware of context strings
@@ -43,6 +43,7 @@ def run(test, params, env):
 
     logger = test.log
     qsd = None
+    register_pool_drain(env, params)
     try:
         key_maps = {"driver": "drv", "detect-zeroes": "detect_zeroes"}
         qsd_name = params["qsd_namespaces"]
@@ -2,7 +2,7 @@
 
 from virttest import error_context
 
-from provider.qsd import QsdDaemonDev
+from provider.qsd import QsdDaemonDev, register_pool_drain
 
 
 @error_context.context_aware
@@ -16,6 +16,7 @@ def run(test, params, env):
 
     logger = test.log
     qsd = None
+    register_pool_drain(env, params)
     try:
         qsd_name = params["qsd_namespaces"]
         qsd = QsdDaemonDev(qsd_name, params)
@@ -63,7 +63,9 @@ def run(test, params, env):
             tester.set_fio(fio)
             testers.append(tester)
         error_context.context("Start groups testing:%s" % groups, test.log.info)
-        groups_tester = ThrottleGroupsTester(testers)
+        groups_tester = ThrottleGroupsTester(
+            testers, params.get("throttle_groups_mode", "thread")
+        )
         groups_tester.start()
 
     def fio_on_vms():
@@ -147,7 +147,9 @@ def run(test, params, env):
         testers.append(tester)
 
     error_context.context("Start groups testing:%s" % groups, test.log.info)
-    groups_tester = ThrottleGroupsTester(testers)
+    groups_tester = ThrottleGroupsTester(
+        testers, params.get("throttle_groups_mode", "thread")
+    )
 
     repeat_test = params.get_numeric("repeat_test", 1)
     for repeat in range(repeat_test):
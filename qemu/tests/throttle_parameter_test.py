@@ -49,6 +49,8 @@ def run(test, params, env):
         testers.append(tester)
 
     error_context.context("Start groups testing:%s" % groups, test.log.info)
-    groups_tester = ThrottleGroupsTester(testers)
+    groups_tester = ThrottleGroupsTester(
+        testers, params.get("throttle_groups_mode", "thread")
+    )
 
     groups_tester.start()
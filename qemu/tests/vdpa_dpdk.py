@@ -6,7 +6,7 @@ import six
 from avocado.utils import process
 from virttest import remote, utils_misc, utils_net, utils_sriov
 
-from provider import dpdk_utils, vdpa_utils
+from provider import dpdk_utils, testpmd_stats, vdpa_utils
 
 LOG_JOB = logging.getLogger("avocado.test")
 
@@ -63,6 +63,19 @@ def run(test, params, env):
     base = params.get("format_base", "12")
     fbase = params.get("format_fbase", "2")
     add_flows = params.get("vdpa_ovs_add_flows", "yes") == "yes"
+    sampling = None
+    if float(params.get("dpdk_sample_interval", 0)):
+        sampling = {
+            "interval": float(params["dpdk_sample_interval"]),
+            "duration": float(params.get("dpdk_sample_duration", 30)),
+            "xstats": params.get("dpdk_sample_xstats", "no") == "yes",
+            "window": int(params.get("dpdk_warmup_window", 3)),
+            "tolerance": float(params.get("dpdk_warmup_tolerance", 0.05)),
+            "zero_loss": params.get("dpdk_zero_loss_search", "no") == "yes",
+            "resolution": float(params.get("dpdk_search_resolution", 0.01)),
+            "max_loss": float(params.get("dpdk_max_loss", 0)),
+            "trial": float(params.get("dpdk_trial_duration", 10)),
+        }
 
     session = vm.wait_for_login(timeout=login_timeout, restart_network=True)
 
@@ -88,6 +101,9 @@ def run(test, params, env):
     record_line = ""
     for record in record_list.split():
         record_line += "%s|" % format_result(record, base, fbase)
+    if sampling:
+        for record in ("jitter", "drop_rate"):
+            record_line += "%s|" % format_result(record, base, fbase)
 
     for nic_index, nic in enumerate(vm.virtnet):
         if nic.nettype == "vdpa":
@@ -128,7 +144,10 @@ def run(test, params, env):
 
     for forward in forward_mode.split():
         result_file.write("Category:%s\n" % forward)
-        result_file.write("%s\n" % record_line.rstrip("|"))
+        header = record_line
+        if sampling and sampling["zero_loss"] and forward == "rxonly":
+            header += "%s|" % format_result("zero_loss_mpps", base, fbase)
+        result_file.write("%s\n" % header.rstrip("|"))
         for pkts in dpdk_pkts.split():
             for queue in dpdk_queues.split():
                 LOG_JOB.info(
@@ -137,7 +156,7 @@ def run(test, params, env):
                     pkts,
                     queue,
                 )
-                pps = run_test(
+                pps, details = run_test(
                     forward,
                     guest,
                     host if forward == "rxonly" else None,
@@ -145,6 +164,7 @@ def run(test, params, env):
                     queue,
                     pkts,
                     mac if forward == "rxonly" else None,  # pylint: disable=E0606
+                    sampling,
                 )
                 time.sleep(2)
                 mpps = "%.2f" % (float(pps) / (10**6))
@@ -152,13 +172,35 @@ def run(test, params, env):
                 line += "%s|" % format_result(queue, base, fbase)
                 line += "%s|" % format_result(pps, base, fbase)
                 line += "%s|" % format_result(mpps, base, fbase)
+                if details:
+                    details["series"].save(
+                        os.path.join(
+                            test.resultsdir,
+                            "dpdk_stats.%s.%s.%s.json" % (forward, pkts, queue),
+                        )
+                    )
+                    steady = details["steady"]
+                    if steady is None:
+                        line += "%s|" % format_result("NA", base, fbase) * 2
+                    else:
+                        line += "%s|" % format_result(steady["jitter"], base, "4")
+                        line += "%s|" % format_result(steady["drop_rate"], base, "6")
+                    if "zero_loss_pps" in details:
+                        zero_loss = details["zero_loss_pps"]
+                        if zero_loss is None:
+                            line += "%s|" % format_result("NA", base, fbase)
+                        else:
+                            zero_loss /= 10**6
+                            line += "%s|" % format_result(zero_loss, base, fbase)
                 result_file.write(("%s\n" % line))
 
     result_file.close()
     session.close()
 
 
-def run_test(forward_mode, guest, host, dpdk_tool_path, queue, pkts, mac=None):
+def run_test(
+    forward_mode, guest, host, dpdk_tool_path, queue, pkts, mac=None, sampling=None
+):
     """
     Run the DPDK test for a specific forward mode.
 
@@ -169,21 +211,27 @@ def run_test(forward_mode, guest, host, dpdk_tool_path, queue, pkts, mac=None):
     :param queue: Queue number
     :param pkts: Number of packets
     :param mac: MAC address (optional)
-    :return: pps value
+    :param sampling: Dictionary of the sampling options, the port stats
+                     are read only once if None
+    :return: tuple of (pps value, dict of series, steady and
+             zero_loss_pps, None if not sampling), steady is None if
+             there is no steady state data of port 0
     """
 
-    if forward_mode == "txonly":
-        testpmd_guest = dpdk_utils.TestPMD(
-            guest["host"], guest["username"], guest["password"]
-        )
-
-    elif forward_mode == "rxonly":
+    host_queues = 16
+    if forward_mode == "rxonly":
         testpmd_host = dpdk_utils.TestPMD(
             host["host"], host["username"], host["password"]
         )
         testpmd_host.login()
         testpmd_host.launch_testpmd(
-            dpdk_tool_path, host["cpu"], host["pci"], "txonly", 16, pkts, mac=mac
+            dpdk_tool_path,
+            host["cpu"],
+            host["pci"],
+            "txonly",
+            host_queues,
+            pkts,
+            mac=mac,
         )
         testpmd_host.show_port_stats_all()
         testpmd_host.show_port_stats_all()
@@ -197,10 +245,35 @@ def run_test(forward_mode, guest, host, dpdk_tool_path, queue, pkts, mac=None):
     testpmd_guest.launch_testpmd(
         dpdk_tool_path, guest["cpu"], guest["pci"], forward_mode, queue, pkts
     )
-    testpmd_guest.show_port_stats_all()
-    time.sleep(2)
-    output = testpmd_guest.show_port_stats_all()
-    pps_value = testpmd_guest.extract_pps_value(output, forward_mode)
+    details = None
+    if sampling:
+        direction = "tx" if forward_mode == "txonly" else "rx"
+        series = testpmd_guest.sample_port_stats(
+            sampling["duration"], sampling["interval"], sampling["xstats"]
+        )
+        steady = series.log_steady_state(
+            direction, sampling["window"], sampling["tolerance"]
+        )
+        details = {"series": series, "steady": steady.get("ports", {}).get(0)}
+        if details["steady"] is None:
+            LOG_JOB.warning(
+                "No steady state data of port 0 in %s samples, read the "
+                "port stats once instead",
+                len(series),
+            )
+            output = testpmd_guest.show_port_stats_all()
+            pps_value = testpmd_guest.extract_pps_value(output, forward_mode)
+        else:
+            pps_value = int(details["steady"]["mpps"] * 10**6)
+        if sampling["zero_loss"] and forward_mode == "rxonly":
+            details["zero_loss_pps"] = search_zero_loss(
+                testpmd_host, testpmd_guest, pkts, host_queues, sampling
+            )
+    else:
+        testpmd_guest.show_port_stats_all()
+        time.sleep(2)
+        output = testpmd_guest.show_port_stats_all()
+        pps_value = testpmd_guest.extract_pps_value(output, forward_mode)
 
     if forward_mode == "rxonly":
         testpmd_host.quit_testpmd()
@@ -208,4 +281,43 @@ def run_test(forward_mode, guest, host, dpdk_tool_path, queue, pkts, mac=None):
     testpmd_guest.quit_testpmd()
     testpmd_guest.logout()
 
-    return pps_value
+    return pps_value, details
+
+
+def search_zero_loss(testpmd_host, testpmd_guest, pkts, host_queues, sampling):
+    """
+    Search the highest rate offered by the host which the guest receives
+    without loss, by limiting the tx rate of the host queues.
+
+    :param testpmd_host: TestPMD object of the sending host
+    :param testpmd_guest: TestPMD object of the receiving guest
+    :param pkts: Packet size
+    :param host_queues: Number of the tx queues of the host
+    :param sampling: Dictionary of the sampling options
+    :return: the zero loss rate in pps, None if the rate offered by the
+             host has no steady state data
+    """
+
+    def measure(rate):
+        testpmd_host.set_tx_rate(rate, pkts, host_queues)
+        time.sleep(sampling["interval"])
+        sent = testpmd_host.port_counters()[0]["tx_packets"]
+        received = testpmd_guest.port_counters()[0]["rx_packets"]
+        time.sleep(sampling["trial"])
+        sent = testpmd_host.port_counters()[0]["tx_packets"] - sent
+        received = testpmd_guest.port_counters()[0]["rx_packets"] - received
+        return max(sent - received, 0) / float(sent) if sent else 1.0
+
+    # the unlimited rate of the host is the upper bound
+    offered = testpmd_host.sample_port_stats(
+        sampling["trial"], sampling["interval"]
+    ).steady_state("tx", sampling["window"], sampling["tolerance"])
+    if 0 not in offered["ports"]:
+        LOG_JOB.warning("No steady state data of the host port 0, skip the search")
+        return None
+    high = offered["ports"][0]["mpps"] * 10**6
+    rate, _ = testpmd_stats.zero_loss_search(
+        measure, high * 0.01, high, sampling["resolution"], sampling["max_loss"]
+    )
+    LOG_JOB.info("Zero loss rate: %.3f Mpps", rate / 10**6)
+    return rate
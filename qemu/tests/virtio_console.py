@@ -4,7 +4,6 @@ Collection of virtio_console and virtio_serialport tests.
 :copyright: 2010-2012 Red Hat Inc.
 """
 
-import array
 import logging
 import os
 import random
@@ -28,6 +27,8 @@ from virttest.qemu_devices import qcontainer, qdevices
 from virttest.utils_test.qemu import migration
 from virttest.utils_virtio_port import VirtioPortTest
 
+from provider import perf_results_db, virtio_serial_perf
+
 LOG_JOB = logging.getLogger("avocado.test")
 
 
@@ -1156,46 +1157,103 @@ def run(test, params, env):
         if err:
             test.fail("%s failed" % err[:-2])
 
-    def _process_stats(stats, scale=1.0):
-        """
-        Process the stats to human readable form.
-        :param stats: List of measured data.
-        """
-        if not stats:
-            return None
-        for i in range((len(stats) - 1), 0, -1):
-            stats[i] = stats[i] - stats[i - 1]
-            stats[i] /= scale
-        stats[0] /= scale
-        stats = sorted(stats)
-        return stats
-
     @error_context.context_aware
     def test_perf():
         """
         Tests performance of the virtio_console tunnel. First it sends the data
-        from host to guest and than back. It provides informations about
-        computer utilization and statistic informations about the throughput.
+        from host to guest and than back, on all the ports of a scenario at
+        once, then it measures the round trip time of small messages echoed by
+        guest. It provides the throughput per port and in total, and the CPU
+        time per byte of QEMU and of this process.
 
         :param cfg: virtio_console_params - semicolon separated scenarios:
                         '$console_type@$buffer_length:$test_duration;...'
         :param cfg: virtio_console_test_time - default test_duration time
+        :param cfg: virtio_console_perf_ports - number of ports used at once
+        :param cfg: virtio_console_perf_latency_size - length of the messages
+                    of the latency test, 0 to skip it
+        :param cfg: virtio_console_perf_latency_count - number of messages
         :param cfg: virtio_port_spread - how many devices per virt pci (0=all)
         """
-        from autotest.client import utils
+
+        def _check_streams(streams, direction):
+            errors = 0
+            for stream in streams:
+                if stream.error:
+                    errors += 1
+                    test.log.error(
+                        "test_perf: error occurred on %s (%s): %s",
+                        stream.port_name,
+                        direction,
+                        stream.error,
+                    )
+                elif stream.bytes == 0:
+                    errors += 1
+                    test.log.error(
+                        "test_perf: no data transferred on %s (%s)",
+                        stream.port_name,
+                        direction,
+                    )
+            return errors
+
+        def _stop_streams(streams):
+            EXIT_EVENT.set()
+            for stream in streams:
+                stream.join()
+
+        def _report(direction, result):
+            for name, port in sorted(result["ports"].items()):
+                test.log.info(
+                    "%s %s [MB/s] = %.3f (min/med/max = %.3f/%.3f/%.3f)",
+                    direction,
+                    name,
+                    port["mbps"],
+                    port["min"],
+                    port["median"],
+                    port["max"],
+                )
+            test.log.info(
+                "%s aggregate [MB/s] = %.3f on %d ports",
+                direction,
+                result["aggregate"],
+                len(result["ports"]),
+            )
+            metrics = {
+                "mbps": result["aggregate"],
+                "port_mbps": [port["mbps"] for port in result["ports"].values()],
+            }
+            for label, cpu_used in result["cpu"].items():
+                busiest = sorted(
+                    cpu_used["threads"].items(), key=lambda item: -item[1]
+                )[:3]
+                test.log.info(
+                    "%s %s CPU: %.2fs, %.3f ns/B, busiest threads: %s",
+                    direction,
+                    label,
+                    cpu_used["total"],
+                    cpu_used["per_byte"],
+                    ", ".join("%s %.2fs" % item for item in busiest),
+                )
+                metrics["%s_CPU" % label] = cpu_used["per_byte"]
+            return metrics
 
         test_params = params["virtio_console_params"]
         test_time = int(params.get("virtio_console_test_time", 60))
+        no_ports = int(params.get("virtio_console_perf_ports", 1))
+        latency_size = int(params.get("virtio_console_perf_latency_size", 64))
+        latency_count = int(params.get("virtio_console_perf_latency_count", 1000))
         no_serialports = 0
         no_consoles = 0
         if test_params.count("serialport"):
-            no_serialports = 1
-        if test_params.count("serialport"):
-            no_consoles = 1
+            no_serialports = no_ports
+        if test_params.count("console"):
+            no_consoles = no_ports
         vm, guest_worker = virtio_test.get_vm_with_worker(no_consoles, no_serialports)
         (consoles, serialports) = virtio_test.get_virtio_ports(vm)
         consoles = [consoles, serialports]
+        cpu = virtio_serial_perf.ThreadCPU({"qemu": vm.get_pid(), "host": os.getpid()})
         no_errors = 0
+        perf_results = {}
 
         for param in test_params.split(";"):
             if not param:
@@ -1215,139 +1273,109 @@ def run(test, params, env):
                 buf_len = int(param[1])
             else:
                 buf_len = 1024
+            case = "%s@%s" % (param[0], buf_len)
             param = param[0] == "serialport"
-            port = consoles[param][0]
-
-            port.open()
-
-            data = b""
-            for _ in range(buf_len):
-                data += b"%c" % random.randrange(255)
+            ports = consoles[param][:no_ports]
+            for port in ports:
+                port.open()
 
             funcatexit.register(env, params.get("type"), __set_exit_event)
 
-            time_slice = float(duration) / 100
-
-            # HOST -> GUEST
-            guest_worker.cmd(
-                'virt.loopback(["%s"], [], %d, virt.LOOP_NONE)' % (port.name, buf_len),
-                10,
-            )
-            thread = qemu_virtio_port.ThSend(port.sock, data, EXIT_EVENT)
-            stats = array.array("f", [])
-            loads = utils.SystemLoad(
-                [(os.getpid(), "autotest"), (vm.get_pid(), "VM"), 0]
-            )
+            streams = []
             try:
-                loads.start()
-                _time = time.time()
-                thread.start()
-                for _ in range(100):
-                    stats.append(thread.idx)
-                    time.sleep(time_slice)
-                _time = time.time() - _time - duration
-                test.log.info(loads.get_cpu_status_string()[:-1])
-                test.log.info(loads.get_mem_status_string()[:-1])
-                EXIT_EVENT.set()
-                thread.join()
-                if thread.ret_code:
-                    no_errors += 1
-                    test.log.error(
-                        "test_perf: error occurred in thread %s (H2G)", thread
+                # HOST -> GUEST
+                for port in ports:
+                    guest_worker.cmd(
+                        'virt.loopback(["%s"], [], %d, virt.LOOP_NONE)'
+                        % (port.name, buf_len),
+                        10,
+                    )
+                streams = [
+                    virtio_serial_perf.PortStream(
+                        port.name, port.sock, "send", buf_len, EXIT_EVENT
                     )
-                elif thread.idx == 0:
-                    no_errors += 1
-                    test.log.error("test_perf: no data sent (H2G)")
+                    for port in ports
+                ]
+                result = virtio_serial_perf.run_streams(streams, duration, cpu=cpu)
+                _stop_streams(streams)
+                no_errors += _check_streams(streams, "H2G")
 
                 # Let the guest read-out all the remaining data
-                for _ in range(60):
-                    if guest_worker._cmd(
-                        "virt.poll('%s', %s)" % (port.name, select.POLLIN), 10
-                    )[0]:
-                        break
-                    time.sleep(1)
-                else:
-                    test.fail("Unable to read-out all remaining data in 60s.")
-
-                guest_worker.safe_exit_loopback_threads([port], [])
-
-                if _time > time_slice:
-                    test.log.error(
-                        "Test ran %fs longer which is more than one time slice",
-                        _time,
-                    )
-                else:
-                    test.log.debug("Test ran %fs longer", _time)
-                stats = _process_stats(stats[1:], time_slice * 1048576)
-                test.log.debug("Stats = %s", stats)
-                test.log.info(
-                    "Host -> Guest [MB/s] (min/med/max) = %.3f/%.3f/%.3f",
-                    stats[0],
-                    stats[len(stats) / 2],
-                    stats[-1],
-                )
+                for port in ports:
+                    for _ in range(60):
+                        if guest_worker._cmd(
+                            "virt.poll('%s', %s)" % (port.name, select.POLLIN), 10
+                        )[0]:
+                            break
+                        time.sleep(1)
+                    else:
+                        test.fail("Unable to read-out all remaining data in 60s.")
 
-                del thread
+                guest_worker.safe_exit_loopback_threads(ports, [])
+                perf_results["%s--h2g" % case] = _report("Host -> Guest", result)
 
                 # GUEST -> HOST
                 EXIT_EVENT.clear()
-                stats = array.array("f", [])
+                for port in ports:
+                    guest_worker.cmd(
+                        "virt.send_loop_init('%s', %d)" % (port.name, buf_len), 30
+                    )
+                streams = [
+                    virtio_serial_perf.PortStream(
+                        port.name, port.sock, "recv", buf_len, EXIT_EVENT
+                    )
+                    for port in ports
+                ]
+                # start the senders of all ports, send_loop() starts one
                 guest_worker.cmd(
-                    "virt.send_loop_init('%s', %d)" % (port.name, buf_len), 30
+                    "[t.start() for t in virt.threads]; print('PASS: Sender start')",
+                    10,
                 )
-                thread = qemu_virtio_port.ThRecv(port.sock, EXIT_EVENT, buf_len)
-                thread.start()
-                loads.start()
-                guest_worker.cmd("virt.send_loop()", 10)
-                _time = time.time()
-                for _ in range(100):
-                    stats.append(thread.idx)
-                    time.sleep(time_slice)
-                _time = time.time() - _time - duration
-                test.log.info(loads.get_cpu_status_string()[:-1])
-                test.log.info(loads.get_mem_status_string()[:-1])
+                result = virtio_serial_perf.run_streams(streams, duration, cpu=cpu)
                 guest_worker.cmd("virt.exit_threads()", 10)
-                EXIT_EVENT.set()
-                thread.join()
-                if thread.ret_code:
-                    no_errors += 1
-                    test.log.error(
-                        "test_perf: error occurred in thread %s(G2H)", thread
+                _stop_streams(streams)
+                no_errors += _check_streams(streams, "G2H")
+                perf_results["%s--g2h" % case] = _report("Guest -> Host", result)
+
+                # Round trip of small messages
+                if latency_size:
+                    port = ports[0]
+                    EXIT_EVENT.clear()
+                    guest_worker.cmd(
+                        'virt.loopback(["%s"], ["%s"], %d, virt.LOOP_NONE)'
+                        % (port.name, port.name, latency_size),
+                        10,
                     )
-                elif thread.idx == 0:
-                    no_errors += 1
-                    test.log.error("test_perf: No data received (G2H)")
-                # Deviation is higher than single time_slice
-                if _time > time_slice:
-                    test.log.error(
-                        "Test ran %fs longer which is more than one time slice",
-                        _time,
+                    latency = virtio_serial_perf.measure_latency(
+                        port.sock, latency_size, latency_count
                     )
-                else:
-                    test.log.debug("Test ran %fs longer", _time)
-                stats = _process_stats(stats[1:], time_slice * 1048576)
-                test.log.debug("Stats = %s", stats)
-                test.log.info(
-                    "Guest -> Host [MB/s] (min/med/max) = %.3f/%.3f/%.3f",
-                    stats[0],
-                    stats[len(stats) / 2],
-                    stats[-1],
-                )
+                    guest_worker.safe_exit_loopback_threads([port], [port])
+                    test.log.info(
+                        "Round trip of %dB on %s [us] (min/p50/p99/max) = "
+                        "%.1f/%.1f/%.1f/%.1f",
+                        latency_size,
+                        port.name,
+                        latency["min"],
+                        latency["p50"],
+                        latency["p99"],
+                        latency["max"],
+                    )
+                    perf_results["%s--latency" % case] = {
+                        "p50_lat": latency["p50"],
+                        "p99_lat": latency["p99"],
+                    }
             except Exception as inst:
                 test.log.error(
                     "test_perf: Failed with %s, starting virtio_test.cleanup", inst
                 )
-                loads.stop()
                 try:
                     guest_worker.cmd("virt.exit_threads()", 10)
-                    EXIT_EVENT.set()
-                    thread.join()
+                    _stop_streams(streams)
                     raise inst
                 except Exception as inst:
                     test.log.error("test_perf: Critical failure, killing VM %s", inst)
                     EXIT_EVENT.set()
                     vm.destroy()
-                    del thread
                     raise inst
             funcatexit.unregister(env, params.get("type"), __set_exit_event)
         virtio_test.cleanup(vm, guest_worker)
@@ -1358,6 +1386,9 @@ def run(test, params, env):
             )
             test.log.error(msg)
             test.fail(msg)
+        perf_results_db.record_results(
+            test, params, perf_results, **perf_results_db.get_host_versions(params)
+        )
 
     #
     # Migration tests
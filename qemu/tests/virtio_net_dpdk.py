@@ -7,6 +7,8 @@ import six
 from avocado.utils import process
 from virttest import data_dir, error_context, remote, utils_misc, utils_test, virt_vm
 
+from provider import perf_results_db, testpmd_stats
+
 LOG_JOB = logging.getLogger("avocado.test")
 
 
@@ -269,6 +271,9 @@ def run(test, params, env):
     result_file.write("### guest-kernel-ver :%s" % guest_ver)
     result_file.write("### guest-dpdk-ver :%s" % dpdk_ver)
 
+    versions = {"host_ver": host_ver, "guest_ver": guest_ver, "qemu_ver": kvm_ver}
+    perf_results = {}
+
     # get result tested by each scenario
     for pkt_cate in category.split():
         result_file.write("Category:%s\n" % pkt_cate)
@@ -279,6 +284,7 @@ def run(test, params, env):
         cores = params.get("vcpu_sockets")
         queues = params.get("testpmd_queues")
         running_time = int(params.get("testpmd_running_time"))
+        sample_interval = float(params.get("testpmd_sample_interval", 0))
         size = 60
 
         if pkt_cate == "rx":
@@ -307,6 +313,7 @@ def run(test, params, env):
             cores,
             queues,
             running_time,
+            sample_interval,
         )
         if status is True:
             error_context.context("%s test is finished" % pkt_cate, test.log.info)
@@ -317,9 +324,26 @@ def run(test, params, env):
         vm.copy_files_from("/tmp/testpmd.log", dst)
 
         pkt_cate_r = result("%s-pps" % pkt_cate, dst)
+        metrics = {record: pkt_cate_r}
+        if sample_interval:
+            with open(dst) as log:
+                series = testpmd_stats.PortStatsSeries.from_lines(log)
+            series.save("%s.json" % dst)
+            steady = series.log_steady_state(pkt_cate)["ports"].get(0)
+            if steady:
+                # the steady state replaces the rate of the last interval
+                pkt_cate_r = steady["mpps"]
+                metrics = {
+                    record: pkt_cate_r,
+                    "jitter": steady["jitter"],
+                    "drop_rate": steady["drop_rate"],
+                }
         line = "%s|" % format_result(size)
         line += "%s" % format_result(pkt_cate_r)
         result_file.write(("%s\n" % line))
+        perf_results["%s--%s" % (pkt_cate, size)] = metrics
+
+    perf_results_db.record_results(test, params, perf_results, **versions)
 
     unbind_dpdk_nic(
         generator1, generator_ip, username, shell_port, password, dpdk_bind_cmd
@@ -346,6 +370,7 @@ def launch_test(
     cores,
     queues,
     running_time,
+    sample_interval=0,
 ):
     """Launch MoonGen"""
 
@@ -382,7 +407,7 @@ def launch_test(
         """Start testpmd on VM"""
 
         cmd = "`command -v python python3 | head -1` "
-        cmd += " %s %s %s %s %s %s %s %s %s > /tmp/testpmd.log" % (
+        cmd += " %s %s %s %s %s %s %s %s %s %s > /tmp/testpmd.log" % (
             exec_file,
             nic1_driver,
             nic2_driver,
@@ -392,6 +417,7 @@ def launch_test(
             cores,
             queues,
             running_time,
+            sample_interval,
         )
         session.cmd_output(cmd)
 